@@ -0,0 +1,165 @@
+"""
+Benchmark cases for the generation, I/O and measurement hot paths.
+
+Each case is a function registered with @case. It takes one value of each
+parameter plus a scratch directory and returns the callable that is timed,
+so setup stays out of the measurement. full lists the realistic sizes,
+quick a subset that runs in a couple of minutes. footprint estimates the peak
+bytes of a parameter set, and the runner skips sets that do not fit its
+memory limit.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+CASES = {}
+
+
+def case(full, quick, footprint=None):
+    """Register a benchmark case.
+    Parameters
+    ----------
+    full, quick : dict
+        parameter name -> list of values, every combination is a benchmark
+    footprint : callable
+        estimated peak bytes for a parameter set, None if small
+    """
+    def register(func):
+        CASES[func.__name__] = dict(func=func, full=full, quick=quick, footprint=footprint)
+        return func
+    return register
+
+
+### (nsamp, nchan) float64 arrays held at once
+def _arrays(n):
+    return lambda nchan, nsamp, dtype="float64", **kw: n * nchan * nsamp * np.dtype(dtype).itemsize
+
+
+def _burst_footprint(nchan, nsamp, fbin=10, dtype="float64", **kw):
+    ### the sub-channel pulses and their band-scaled copy at nchan * fbin, plus the outputs
+    return (2 * fbin + 3) * nchan * nsamp * np.dtype(dtype).itemsize
+
+
+@case(full=dict(nchan=[336, 3296], nsamp=[10 ** 4, 10 ** 5, 10 ** 6], dm=[0, 300, 3000], dtype=["float64", "float32"]),
+      quick=dict(nchan=[336], nsamp=[10 ** 4], dm=[0, 3000], dtype=["float64", "float32"]),
+      footprint=_burst_footprint)
+def burst(nchan, nsamp, dm, dtype, tmp):
+    """Spectra.burst, synthesis and dedispersion of one gaussian burst."""
+    from simpulse.sim.model import Spectra
+    model = Spectra(nchan=nchan, dtype=dtype)
+    return lambda: model.burst(t0=nsamp * model.tsamp / 4, dm=dm, width=1, A=20, nsamp=nsamp, mode="single")
+
+
+@case(full=dict(nchan=[336, 3296], nsamp=[10 ** 4, 10 ** 5, 10 ** 6], dm=[0, 300, 3000]),
+      quick=dict(nchan=[336], nsamp=[10 ** 5], dm=[0, 3000]),
+      footprint=_arrays(3))
+def dedisperse(nchan, nsamp, dm, tmp):
+    """Brute-force dedispersion of a (nsamp, nchan) float64 array."""
+    from simpulse.sim.burst import dedisperse
+    from simpulse.sim.model import Spectra
+    model = Spectra(nchan=nchan)
+    array = np.random.default_rng(0).standard_normal((nsamp, nchan))
+    return lambda: dedisperse(array, dm, model.vif, model.fch1, model.tsamp)
+
+
+@case(full=dict(nchan=[336, 3296], nsamp=[10 ** 4, 10 ** 5, 10 ** 6], dtype=["float64", "float32"]),
+      quick=dict(nchan=[336, 3296], nsamp=[10 ** 4], dtype=["float64", "float32"]),
+      footprint=_arrays(4))
+def inject(nchan, nsamp, dtype, tmp):
+    """Spectra.inject: noise, scaling, quantization and the write of one block."""
+    from simpulse.sim.model import Spectra
+    model = Spectra(nchan=nchan, dtype=dtype)
+    model.create_filterbank(os.path.join(tmp, "inject"), std=18, base=127)
+    array = np.zeros((nsamp, nchan), dtype=dtype)
+    array[nsamp // 2] = 100.0
+
+    def run():
+        model.filterbank.fbank.fin.seek(model.filterbank.fbank.data_start_idx)
+        model.inject(array)
+    return run
+
+
+@case(full=dict(nchan=[336, 3296], nsamp=[10 ** 4, 10 ** 5, 10 ** 6]),
+      quick=dict(nchan=[336, 3296], nsamp=[10 ** 5]),
+      footprint=lambda nchan, nsamp, **kw: nchan * nsamp)
+def writeblock(nchan, nsamp, tmp):
+    """makefilterbank.writeblock of a uint8 block."""
+    from simpulse.io.fbio import makefilterbank
+    from simpulse.sim.model import Spectra
+    fbank = makefilterbank(os.path.join(tmp, "write.fil"), header=Spectra(nchan=nchan).header)
+    block = np.random.default_rng(0).integers(0, 256, (nsamp, nchan), dtype=np.uint8)
+
+    def run():
+        fbank.fbank.fin.seek(fbank.fbank.data_start_idx)
+        fbank.writeblock(block)
+    return run
+
+
+@case(full=dict(nchan=[336, 3296], nsamp=[10 ** 4, 10 ** 5, 10 ** 6]),
+      quick=dict(nchan=[336, 3296], nsamp=[10 ** 5]),
+      footprint=lambda nchan, nsamp, **kw: 2 * nchan * nsamp)
+def get_data(nchan, nsamp, tmp):
+    """SigprocFile.get_data of a whole 8-bit file."""
+    from simpulse.io.fbio import makefilterbank
+    from simpulse.io.sigproc import SigprocFile
+    from simpulse.sim.model import Spectra
+    filename = os.path.join(tmp, "read.fil")
+    header = dict(Spectra(nchan=nchan).header, nsamples=nsamp)
+    fbank = makefilterbank(filename, header=header)
+    fbank.writeblock(np.random.default_rng(0).integers(0, 256, (nsamp, nchan), dtype=np.uint8))
+    fbank.closefile()
+    fil = SigprocFile(filename)
+    return lambda: fil.get_data(slice(0, nsamp))
+
+
+@case(full=dict(metric=["L2_clean", "L2_snr", "L2_flux"], nchan=[336, 3296], nsamp=[10 ** 4, 10 ** 5],
+                dtype=["float64", "float32"]),
+      quick=dict(metric=["L2_clean", "L2_snr", "L2_flux"], nchan=[336], nsamp=[10 ** 4], dtype=["float64", "float32"]),
+      footprint=_arrays(4))
+def measure(metric, nchan, nsamp, dtype, tmp):
+    """S/N and flux measurements of a dedispersed burst."""
+    from simpulse.sim import measurement
+    from simpulse.sim.model import Spectra
+    model = Spectra(nchan=nchan, fbin=1, dtype=dtype)
+    _, ded = model.burst(t0=nsamp * model.tsamp / 4, dm=0, width=2, A=20, nsamp=nsamp, mode="single")
+    func = getattr(measurement, metric)
+    return lambda: func(ded)
+
+
+@case(full=dict(nchan=[336, 3296], npulses=[100, 1000, 10000]),
+      quick=dict(nchan=[336], npulses=[100, 1000]),
+      footprint=lambda nchan, npulses, **kw: 256 * 2 ** 20)
+def simulate_periodic(nchan, npulses, tmp):
+    """simperiod end to end, writing a filterbank of npulses 0.1 s pulses."""
+    from simpulse import simperiod_cli
+    args = argparse.Namespace(
+        dm=1.0, period=0.1, pdot=0.0, f2=0.0, accel=0.0, pb=None, a1=0.0, ecc=0.0, om=0.0, t0=0.0,
+        jitter=0.0, width=1.0, snr=50.0, npulses=npulses, amp_dist="1", width_dist=None, nulling=0.0,
+        mode_switch=0.0, mode_amp=1.0, mode_width=1.0, pulse_table=None, fch1=1100.0, bwchan=1.0,
+        nchan=nchan, tsamp=1.0, tbin=10, fbin=10, noise_std=18.0, noise_base=127.0,
+        output=os.path.join(tmp, "periodic"), max_memory=256, seed=1, stream=None, dtype="float64", threads=1)
+    simperiod_cli.console.quiet = True
+    return lambda: simperiod_cli.simulate_periodic(args)
+
+
+@case(full=dict(ntruth=[10 ** 3, 10 ** 4, 10 ** 5]),
+      quick=dict(ntruth=[10 ** 4]))
+def crossmatch(ntruth, tmp):
+    """Crossmatch of one campaign cell, ntruth injections against 2 * ntruth candidates."""
+    from simpulse.analysis.crossmatch import match, SN, SAMPNO, DM, BOXCAR, IWD
+    rng = np.random.default_rng(0)
+
+    def table(n, jitter):
+        rows = np.zeros((n, 12))
+        rows[:, SAMPNO] = np.sort(rng.uniform(0, 1000 * n, n)) + rng.normal(0, jitter, n)
+        rows[:, DM] = rng.uniform(0, 3000, n)
+        rows[:, SN] = rng.uniform(5, 50, n)
+        rows[:, BOXCAR] = rng.integers(1, 32, n)
+        rows[:, IWD] = rng.uniform(0.5, 5, n)
+        return rows
+
+    truth = table(ntruth, 0)
+    cands = np.concatenate([truth + rng.normal(0, 2, truth.shape), table(ntruth, 0)])
+    return lambda: match(truth, cands, 20, 100)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Run the simpulse benchmarks and compare results between commits.
+
+    python benchmarks/run.py run [--full] [-k burst] [--max-memory 4096]
+    python benchmarks/run.py compare <base> <head> [--threshold 1.1]
+    python benchmarks/run.py list
+
+run writes benchmarks/results/<commit>.json with the best and median wall
+time and the peak traced memory of every case. compare takes two commits or
+result files and exits with status 1 when a case got slower, or used more
+memory, by more than the threshold ratio.
+"""
+
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS = os.path.join(HERE, "results")
+sys.path.insert(0, HERE)
+
+from cases import CASES  # noqa: E402
+
+
+def git(*args):
+    return subprocess.run(["git", *args], cwd=HERE, capture_output=True, text=True).stdout.strip()
+
+
+def commit_id():
+    """Short hash of HEAD, with -dirty when the tree has uncommitted changes."""
+    sha = git("rev-parse", "--short=12", "HEAD") or "unknown"
+    return sha + ("-dirty" if git("status", "--porcelain", "--untracked-files=no") else "")
+
+
+def available_mb():
+    """Available memory (MB), from /proc/meminfo where present."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 4096
+
+
+def combinations(grid):
+    names = list(grid)
+    for values in itertools.product(*(grid[n] for n in names)):
+        yield dict(zip(names, values))
+
+
+def case_name(name, params):
+    return "{}[{}]".format(name, ",".join("{}={}".format(k, v) for k, v in params.items()))
+
+
+def measure(func, repeat, min_time):
+    """Best and median time of one call over repeat rounds, and the peak traced memory of one call.
+    Calls are batched within a round until it lasts min_time."""
+    func()
+    number = 1
+    while True:
+        t = time.perf_counter()
+        for _ in range(number):
+            func()
+        dt = time.perf_counter() - t
+        if dt >= min_time or number >= 1000:
+            break
+        number *= 10 if dt < min_time / 10 else 2
+    times = [dt / number]
+    for _ in range(repeat - 1):
+        t = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - t) / number)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dict(min=min(times), median=statistics.median(times), repeat=repeat, number=number,
+                peak_mb=peak / 2 ** 20)
+
+
+def run(args):
+    limit = args.max_memory if args.max_memory else available_mb() / 2
+    results = {}
+    for name, spec in CASES.items():
+        if args.k and not any(k in name for k in args.k):
+            continue
+        for params in combinations(spec["full"] if args.full else spec["quick"]):
+            label = case_name(name, params)
+            need = spec["footprint"](**params) / 2 ** 20 if spec["footprint"] else 0
+            if need > limit:
+                print("{:60s} skipped, needs ~{:.0f} MB".format(label, need))
+                continue
+            with tempfile.TemporaryDirectory() as tmp:
+                func = spec["func"](tmp=tmp, **params)
+                results[label] = measure(func, args.repeat, args.min_time)
+                del func
+            gc.collect()
+            r = results[label]
+            print("{:60s} {:10.4f} s {:10.1f} MB".format(label, r["min"], r["peak_mb"]), flush=True)
+
+    import simpulse
+    from simpulse.sim import kernels
+    record = dict(commit=commit_id(), date=time.strftime("%Y-%m-%dT%H:%M:%S"), full=args.full,
+                  machine=dict(platform=platform.platform(), python=platform.python_version(),
+                               numpy=np.__version__, cpus=os.cpu_count(), node=platform.node(),
+                               kernels=kernels.backend()),
+                  package=os.path.dirname(simpulse.__file__), results=results)
+    os.makedirs(RESULTS, exist_ok=True)
+    output = args.output or os.path.join(RESULTS, record["commit"] + ".json")
+    ### merge with an earlier run of the same commit, e.g. one restricted with -k
+    if os.path.exists(output) and not args.output:
+        with open(output) as f:
+            old = json.load(f)
+        old["results"].update(results)
+        record["results"] = old["results"]
+    with open(output, "w") as f:
+        json.dump(record, f, indent=1)
+    print("results in", output)
+
+
+def load(ref):
+    """Results of a result file, or of the newest run of a commit (hash prefix or git ref)."""
+    if os.path.exists(ref):
+        path = ref
+    else:
+        sha = git("rev-parse", "--short=12", ref) or ref
+        names = sorted((n for n in os.listdir(RESULTS) if n.startswith(sha[:12])),
+                       key=lambda n: os.path.getmtime(os.path.join(RESULTS, n)))
+        if not names:
+            sys.exit("no results for {} in {}".format(ref, RESULTS))
+        path = os.path.join(RESULTS, names[-1])
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(args):
+    base, head = load(args.base), load(args.head)
+    print("{:60s} {:>10s} {:>10s} {:>7s} {:>9s} {:>9s}".format(
+        "case (" + base["commit"] + " -> " + head["commit"] + ")", "base s", "head s", "ratio", "base MB", "head MB"))
+    worse = 0
+    for label in sorted(set(base["results"]) & set(head["results"])):
+        b, h = base["results"][label], head["results"][label]
+        ratio = h["min"] / b["min"] if b["min"] else float("inf")
+        mem = h["peak_mb"] / b["peak_mb"] if b["peak_mb"] > 1 else 1.0
+        flag = ""
+        if ratio > args.threshold or mem > args.threshold:
+            flag = "  REGRESSION"
+            worse += 1
+        elif ratio < 1 / args.threshold:
+            flag = "  faster"
+        print("{:60s} {:10.4f} {:10.4f} {:7.2f} {:9.1f} {:9.1f}{}".format(
+            label, b["min"], h["min"], ratio, b["peak_mb"], h["peak_mb"], flag))
+    for label in sorted(set(base["results"]) ^ set(head["results"])):
+        print("{:60s} only in {}".format(label, "base" if label in base["results"] else "head"))
+    print("{} regression(s) beyond x{}".format(worse, args.threshold))
+    return 1 if worse else 0
+
+
+def main():
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description="simpulse benchmark suite", formatter_class=ArgumentDefaultsHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run", help="run the benchmarks", formatter_class=ArgumentDefaultsHelpFormatter)
+    p.add_argument("--full", action="store_true", help="realistic sizes instead of the quick subset")
+    p.add_argument("-k", action="append", default=[], help="only cases whose name contains this, repeatable")
+    p.add_argument("--repeat", type=int, default=5, help="timing rounds per case")
+    p.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per round")
+    p.add_argument("--max-memory", type=float, default=None, help="skip cases estimated above this (MB), default half the available memory")
+    p.add_argument("-o", "--output", type=str, default=None, help="result file, default results/<commit>.json")
+    p = sub.add_parser("compare", help="compare two result sets", formatter_class=ArgumentDefaultsHelpFormatter)
+    p.add_argument("base", help="base commit or result file")
+    p.add_argument("head", help="head commit or result file")
+    p.add_argument("--threshold", type=float, default=1.1, help="time or memory ratio flagged as a regression")
+    sub.add_parser("list", help="list the cases")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        sys.exit(compare(args))
+    else:
+        for name, spec in CASES.items():
+            print("{:20s} {}".format(name, spec["func"].__doc__))
+            print("{:20s} full: {}  quick: {}".format("", spec["full"], spec["quick"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# src/simpulse/analysis/__init__.py
+
+from .fdmt import fdmt, boxcar_search, recover, fdmt_file, recover_file
+from .cache import load_table
+
+__all__ = ["fdmt", "boxcar_search", "recover", "fdmt_file", "recover_file", "load_table"]
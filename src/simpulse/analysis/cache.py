@@ -0,0 +1,86 @@
+# analysis/cache.py
+"""
+Binary cache of the text tables read by the analysis: FREDDA .cand.fof
+candidate files and injection truth tables (whitespace or ';' separated).
+
+A table is parsed once and stored as a Fortran-ordered float64 .npy, so
+every column is contiguous on disk. Later loads memory-map it instead of
+re-tokenising the text. Entries are keyed by the size and mtime of the source
+file and are rebuilt when it changes.
+"""
+
+import io
+import logging
+import os
+
+import numpy as np
+
+CACHE_DIRNAME = ".simpulse_cache"
+
+
+def parse_table(path, ncol=0):
+    """Parse a numeric text table into a (nrow, ncol) float64 array.
+    Lines starting with # are skipped and ';' counts as whitespace, so both the
+    FREDDA candidate files and the simpulse truth tables are read. A table
+    without rows gives a (0, ncol) array, ncol being the expected column count.
+    """
+    with open(path) as f:
+        text = f.read().replace(";", " ")
+    if not any(line.strip() and not line.lstrip().startswith("#") for line in text.splitlines()):
+        return np.empty((0, ncol))
+    try:
+        return np.loadtxt(io.StringIO(text), dtype=np.float64, comments="#", ndmin=2)
+    except ValueError as err:
+        raise ValueError("{} is not a table of numbers with rows of equal length: {}".format(path, err)) from err
+
+
+def cache_path(path, cache_dir=None):
+    """Cache file of a table, named after the size and mtime of the source."""
+    st = os.stat(path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIRNAME)
+    name = "{}.{}-{}.npy".format(os.path.basename(path), st.st_size, st.st_mtime_ns)
+    return os.path.join(cache_dir, name)
+
+
+def load_table(path, cache_dir=None, use_cache=True, ncol=0):
+    """Load a text table through the binary cache.
+    Parameters
+    ----------
+    path : string
+        text table
+    ncol : int
+        expected number of columns, the width of the array returned for a table without rows
+    cache_dir : string
+        cache directory, defaults to .simpulse_cache next to the table
+    use_cache : bool
+        False parses the text without reading or writing the cache
+
+    Returns
+    -------
+    (nrow, ncol) float64 array, read-only and memory-mapped when it comes from the cache
+    """
+    if not use_cache:
+        return parse_table(path, ncol)
+    cached = cache_path(path, cache_dir)
+    if os.path.exists(cached):
+        return np.load(cached, mmap_mode="r")
+
+    table = parse_table(path, ncol)
+    prefix = os.path.basename(path) + "."
+    try:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        ### drop entries of older versions of the table
+        for old in os.listdir(os.path.dirname(cached)):
+            key = old[len(prefix):-len(".npy")].split("-")
+            if old.startswith(prefix) and old.endswith(".npy") and len(key) == 2 \
+                    and all(k.isdigit() for k in key):
+                os.remove(os.path.join(os.path.dirname(cached), old))
+        tmp = cached + ".{}.tmp".format(os.getpid())
+        with open(tmp, "wb") as f:
+            np.save(f, np.asfortranarray(table))
+        os.replace(tmp, cached)
+    except OSError as err:
+        logging.warning("Could not cache %s: %s", path, err)
+        return table
+    return np.load(cached, mmap_mode="r")
@@ -1,68 +1,46 @@
 #!/usr/bin/env python3
 """
-Template for making scripts to run from the command line
+Crossmatch injected truths against FREDDA candidates and measure the detection
+rate, false-alarm rate and S/N recovery of an injection campaign.
+
+Library use:
+    truth = load_truth("truth.txt", sncut=50)
+    results = crossmatch(truth, "testset_", label=1, nproc=8)
+    summary = summarise(results)
+
+Command line:
+    simpulse-crossmatch -d testset_ -o freddacheck -j 8 truth.txt
+
+The matching and statistics only need NumPy; matplotlib is imported when plotting.
 
 Copyright (C) CSIRO 2015
 """
-import pylab
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import os
-import sys
 import logging
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-from pylab import *
-from matplotlib.ticker import  MultipleLocator
-from matplotlib.ticker import  FormatStrFormatter
-from scipy import stats
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 
-'''
-dev:python3
+from simpulse.analysis.cache import load_table
 
-python2 will have int/float bugs in this code, plz see comments below
-'''
 __author__ = "CRAFT Harry Qiu <hqiu0129@physics.usyd.edu.au>"
 
-#def _main():
-from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-parser = ArgumentParser(description='Script description', formatter_class=ArgumentDefaultsHelpFormatter)
-parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='Be verbose')
-parser.add_argument('-s','--show', action='store_true', help='Show')
-parser.add_argument('-x','--xaxis',type=int,default=0)
-parser.add_argument('-y','--yaxis',type=int,default=0)
-parser.add_argument('-o','--output',type=str,default='freddacheck')
-parser.add_argument('-d','--set',type=str,default='testset_')
-parser.add_argument('--sncut',type=float,default=50.0)
-parser.add_argument('--scatter', action='store_true', help='Show')
-parser.add_argument('--line', action='store_true', help='Show')
-parser.add_argument('--errornone', action='store_true', help='Show')
-parser.add_argument('--errorbar', default='std',type=str, help='Show')
-parser.add_argument('-l','--label',type=int,default=1,help=' 1 for dm label, 2 for fluence(s/n) label, 3 for width label')
-parser.add_argument('--binmode', type=str,default='mean',help='Show')
-parser.add_argument(dest='files', nargs='+')
-parser.set_defaults(verbose=False)
-values = parser.parse_args()
-if values.verbose:
-    logging.basicConfig(level=logging.DEBUG)
-else:
-    logging.basicConfig(level=logging.INFO)
-pscat=values.scatter
-pguide=values.line
-limit=2000/1.2
-dlim=100
-dbin=values.binmode
-derr=values.errorbar
 ###number links just in case you forget
-'''
-sn=0
-sampno=1
-time=2
-boxcar=3
-idt=4
-dm=5
-beamno=6
-'''
+SN=0
+SAMPNO=1
+TIME=2
+BOXCAR=3
+IDT=4
+DM=5
+BEAMNO=6
+IWD=8
+OFFSET=9
+### columns of the candidate and truth tables
+NCOL=12
+
+### DM matching window (pc cm-3)
+DLIM=100
+
 units={}
 units[0]='S/N'
 units[1]='Sample No.'
@@ -103,265 +81,488 @@ col[4]='green'
 col[5]='#9a0eea'  ###violet
 col[6]='#d90166'  ###dark hot pink
 col[7]='black'
-ol=open(values.output+'outlier.txt','w')
-histo=open(values.output+"histodata.txt",'w')
-histo.write("#### time error, s/n truth, s/n fredda, dm, dm_fredda, width_intrinsic, boxcar_fredda \n")
-x=values.xaxis
-y=values.yaxis
-ident=values.set
-
-plt.figure(1,figsize=(12, 9))
-plt.xlabel("False Acquistion Rate",fontsize=15)
-plt.ylabel("Detection Rate",fontsize=15)
-plt.xlim(-0.01,1.01)
-plt.ylim(-0.01,1.01)
-plt.xticks(fontsize=15)
-plt.yticks(fontsize=15)
-###
-#ol=open(ident+".ol.dat","w")
-####
-plt.figure(2,figsize=(12, 9))
-plt.xlabel('Truth '+units[x],fontsize=15)
-plt.ylabel('Fredda '+units[y],fontsize=15)
-#####
-tom=np.loadtxt(values.files[0],dtype=float)
-dil=np.where(tom.T[0]<=values.sncut)
-t=tom[dil]
-if values.label == 1:
-    alist=np.unique(t.T[5]) #dm
-    blist=np.unique(t.T[0]) #fluence
-    clist=np.unique(t.T[8]) #width
-if values.label == 2:
-    alist=np.unique(t.T[0])
-    blist=np.unique(t.T[5])
-    clist=np.unique(t.T[8])
-if values.label == 3:
-    alist=np.unique(t.T[8])
-    blist=np.unique(t.T[5])
-    clist=np.unique(t.T[0])
-ltag=values.label
-####boxcar= t.T[3] idt=
-a=len(alist)
-b=len(blist)
-c=len(clist)
-yamax=10.
-xamax=10.
-dmax = (np.max(alist))
-#ddf = int(dmax)/3 +1
-pluck = 0
-pdx=[]
-pdy=[]
-pdx_array=np.array([])
-pdy_array=np.array([])
-fax_array=np.array([])
-fay_array=np.array([])
-for d in range(a):
-    pdx=[]
-    pdy=[]
-    pdx_array=np.array([])
-    pdy_array=np.array([])
-    fax_array=np.array([])
-    fay_array=np.array([])
-    dp=alist[d]
-    if ltag== 1:
-        plabel = 'DM = '
-        punit=label[1]
-    if ltag== 2:
-        plabel = 'S/N = '
-        punit=label[2]
-    if ltag== 3:
-        plabel = 'Width = '
-        punit=label[3]
-    if a >6:
-
-
-        if dp <= dmax/3:
-            pluck = 0
-
-        elif dp <= dmax/3*2:
-            pluck = 1
 
-        else:
-            pluck = 2
-        kk=pluck
-        print (pluck,plabel,dp)
+### truth columns of the three grid axes for each --label: (a, b, c)
+LABEL_AXES={1:(DM,SN,IWD),2:(SN,DM,IWD),3:(IWD,DM,SN)}
+LABEL_NAMES={1:'DM = ',2:'S/N = ',3:'Width = '}
+
+### per-cell rates: a, b, c grid values, injected DM/width/S/N, counts, detection and false-alarm rates
+CELL_DTYPE=np.dtype([('a','f8'),('b','f8'),('c','f8'),('dm','f8'),('width','f8'),('sn','f8'),
+                     ('ntruth','i8'),('ncand','i8'),('ndetected','i8'),('nmatched','i8'),
+                     ('pd','f8'),('pfa','f8')])
+RECOVERY_DTYPE=np.dtype([('a','f8'),('x','f8'),('y','f8'),('err','f8'),('count','i8')])
+
+
+def window_pairs(a_time,a_dm,b_time,b_dm,tlim,dmlim):
+    """All pairs (i, j) with |a_time[i]-b_time[j]| < tlim and |a_dm[i]-b_dm[j]| < dmlim.
+    b is sorted by time once and each row of a takes a searchsorted slice of it,
+    so the cost is O((N+M) log M + pairs in the time window) instead of O(N*M).
+    """
+    a_time=np.asarray(a_time)
+    order=np.argsort(b_time,kind='stable')
+    bt=np.asarray(b_time)[order]
+    lo=np.searchsorted(bt,a_time-tlim,side='right')
+    hi=np.searchsorted(bt,a_time+tlim,side='left')
+    counts=np.maximum(hi-lo,0)
+    ai=np.repeat(np.arange(len(a_time)),counts)
+    run=np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts,counts)
+    bj=order[np.repeat(lo,counts)+run]
+    keep=np.abs(np.asarray(a_dm)[ai]-np.asarray(b_dm)[bj])<dmlim
+    return ai[keep],bj[keep]
+
+
+def closest_match(ai,bj,a_sn,b_sn,na):
+    """For each of the na rows of a, the paired row of b with the closest S/N, -1 if unpaired.
+    Ties go to the lowest b index, as the old np.where scan did.
+    """
+    best=np.full(na,-1,dtype=np.int64)
+    if len(ai)==0:
+        return best
+    dsn=np.abs(np.asarray(b_sn)[bj]-np.asarray(a_sn)[ai])
+    order=np.lexsort((bj,dsn,ai))
+    ai_s=ai[order]
+    first=np.ones(len(ai_s),dtype=bool)
+    first[1:]=ai_s[1:]!=ai_s[:-1]
+    best[ai_s[first]]=bj[order][first]
+    return best
+
+
+def load_truth(path,sncut=50.0,cache_dir=None,use_cache=True):
+    """Load a truth table, keeping the injections with S/N <= sncut. See cache.load_table."""
+    tom=load_table(path,cache_dir,use_cache,NCOL)
+    return tom[tom.T[SN]<=sncut]
+
+
+def load_candidates(path,cache_dir=None,use_cache=True):
+    """Load a FREDDA .cand.fof file as a (ncand, 12) table. See cache.load_table."""
+    return load_table(path,cache_dir,use_cache,NCOL)
+
+
+def candidate_file(ident,dm,width,sn):
+    """FREDDA candidate file of one (DM, width, S/N) cell of the campaign."""
+    return ident+"{0:04}".format(int(dm))+'_'+"{0:03}".format(width)+'_'+"{0:03}".format(sn)+'_fixed.fil.cand.fof'
+
+
+def match(tru,fred,limit,dlim=DLIM,x=0,y=0):
+    """Crossmatch the truths and candidates of one cell.
+    Parameters
+    ----------
+    tru : numpy array
+        truth rows of the cell
+    fred : numpy array
+        candidate rows of the cell
+    limit : float
+        sample window
+    dlim : float
+        DM window
+    x, y : int
+        truth and candidate columns compared against each other
+
+    Returns
+    -------
+    dict with pd (candidate y of each truth), bpd (truth detected), fa (truth x of each
+    candidate), bfa (candidate matched) and histo (time error, S/N, DM, width, boxcar rows)
+    """
+    lt=len(tru)
+    lf=len(fred)
+    ######## all truth/candidate pairs inside the time and DM windows, then the closest S/N of each
+    ti,fj=window_pairs(tru.T[SAMPNO],tru.T[DM],fred.T[SAMPNO],fred.T[DM],limit,dlim)
+    tbest=closest_match(ti,fj,tru.T[SN],fred.T[SN],lt)
+    fbest=closest_match(fj,ti,fred.T[SN],tru.T[SN],lf)
+    bpd=tbest>=0
+    bfa=fbest>=0
+    pd=np.zeros(lt,dtype=float)
+    fa=np.zeros(lf,dtype=float)
+    pd[bpd]=fred.T[y][tbest[bpd]]
+    fa[bfa]=tru.T[x][fbest[bfa]]
+    hit=fbest[bfa]
+    ### a single-candidate file logs the truth boxcar in place of the intrinsic width, as the original scan did
+    width=tru.T[BOXCAR] if lf==1 else tru.T[IWD]
+    histo=np.column_stack((fred.T[SAMPNO][bfa]-tru.T[SAMPNO][hit],tru.T[SN][hit],fred.T[SN][bfa],
+                           tru.T[DM][hit],fred.T[DM][bfa],width[hit],fred.T[BOXCAR][bfa]))
+    return {'pd':pd,'bpd':bpd,'fa':fa,'bfa':bfa,'histo':histo}
+
+
+def group_cells(table,ltag=1):
+    """Group a truth table into contiguous (a, b, c) cells with one stable lexsort.
+    Parameters
+    ----------
+    table : numpy array
+        truth table
+    ltag : int
+        grid axes, see LABEL_AXES
+
+    Returns
+    -------
+    keys : numpy array
+        (ncell, 3) a, b, c values of each cell in loop order
+    order : numpy array
+        row order that makes every cell contiguous, rows keep their file order inside a cell
+    offsets : numpy array
+        cell i is rows order[offsets[i]:offsets[i+1]]
+    """
+    ka,kb,kc=LABEL_AXES[ltag]
+    cols=table.T
+    order=np.lexsort((cols[kc],cols[kb],cols[ka]))
+    keys=table[order][:,[ka,kb,kc]]
+    change=np.any(keys[1:]!=keys[:-1],axis=1)
+    starts=np.concatenate(([0],np.flatnonzero(change)+1))
+    offsets=np.append(starts,len(table)).astype(np.int64)
+    return keys[starts] if len(table) else keys,order,offsets
+
+
+def cells(truth,ltag=1):
+    """Split the truth table into (a, b, c) grid cells in loop order.
+    Returns
+    -------
+    list of (a value, b value, c value, truth rows)
+    """
+    keys,order,offsets=group_cells(truth,ltag)
+    grouped=truth[order]
+    return [(a,b,c,grouped[offsets[i]:offsets[i+1]]) for i,(a,b,c) in enumerate(keys)]
+
+
+def match_cell(job):
+    """Process-pool worker: load one candidate file and match it against its truths."""
+    fredfile,tru,limit,dlim,x,y,cache_dir,use_cache=job
+    if not os.path.exists(fredfile):
+        return None
+    fred=load_candidates(fredfile,cache_dir,use_cache)
+    if len(fred)==0:
+        return None
+    result=match(tru,fred,limit,dlim,x,y)
+    result['fred_y']=fred.T[y]
+    return result
+
+
+def crossmatch(truth,ident,ltag=1,x=0,y=0,dlim=DLIM,nproc=None,cache_dir=None,use_cache=True):
+    """Crossmatch every cell of a campaign, fanning the candidate files out over a process pool.
+    Parameters
+    ----------
+    truth : numpy array
+        truth table, see load_truth
+    ident : string
+        candidate file prefix
+    ltag : int
+        1 groups by DM, 2 by fluence (S/N), 3 by width
+    nproc : int
+        worker processes, None for one per CPU and 1 to run in this process. They are spawned
+        rather than forked, which is unsafe once OpenMP-backed numba kernels have run
+    cache_dir, use_cache :
+        binary cache of the candidate files, see cache.load_table
+
+    Returns
+    -------
+    list of dicts, one per cell in loop order, with the cell values (a, b, c, dm, width, sn),
+    its truths, the candidate file name and the match result (None if there is no candidate file)
+    """
+    jobs=[]
+    meta=[]
+    for dp,fp,wp,tru in cells(truth,ltag):
+        dmp=tru.T[DM][0]
+        flp=tru.T[SN][0]
+        wdp=tru.T[IWD][0]
+        limit=wdp/1.2*10
+        fredfile=candidate_file(ident,dmp,wdp,flp)
+        jobs.append((fredfile,tru,limit,dlim,x,y,cache_dir,use_cache))
+        meta.append({'a':dp,'b':fp,'c':wp,'dm':dmp,'width':wdp,'sn':flp,'tru':tru,'file':fredfile})
+
+    if nproc==1:
+        matched=list(map(match_cell,jobs))
     else:
-        pluck=d
-        kk=pluck
-    markersize=15
-        #if
-    for j in range(b):
-        for k in range(c):
-            fp=blist[j]
-            wp=clist[k]
-            ######## dp- alist fp - blist wp -clist
-            if ltag ==1 :  ########  a -dp- dm  b-fp-fl c -wp-wd
-                depo_dm=np.where(t.T[5]==dp)
-                depo_fl=np.where(t.T[0]==fp)
-                depo_wd=np.where(t.T[8]==wp)
-            if ltag ==2 : ########  a -dp- fl  b-fp-dm c -wp-wd
-                depo_dm=np.where(t.T[5]==fp)
-                depo_fl=np.where(t.T[0]==dp)
-                depo_wd=np.where(t.T[8]==wp)
-            if ltag ==3 : ########  a -dp- wd  b-fp-dm c -wp-fl
-                depo_dm=np.where(t.T[5]==fp)
-                depo_fl=np.where(t.T[0]==wp)
-                depo_wd=np.where(t.T[8]==dp)
-            mix=np.intersect1d(depo_dm,depo_fl)
-            mix=np.intersect1d(mix,depo_wd)
-
-            if len(mix) == 0:
+        with ProcessPoolExecutor(max_workers=nproc,mp_context=mp.get_context("spawn")) as pool:
+            matched=list(pool.map(match_cell,jobs,chunksize=max(1,len(jobs)//64)))
+
+    for m,r in zip(meta,matched):
+        m['match']=r
+    return meta
+
+
+def summarise(results,x=0):
+    """Merge per-cell matches into per-group efficiency and false-alarm tables.
+    Returns
+    -------
+    list of dicts per a value with pdx/pdy (false-alarm and detection rate per cell),
+    pdx_array/pdy_array (truth x against recovered y), fax_array/fay_array (candidates with fa == 0,
+    the unmatched ones and those matched to a truth whose x value is 0),
+    and the axis maxima xamax, yamax
+    """
+    groups=[]
+    gid=[]
+    for r in results:
+        if not groups or groups[-1]['a']!=r['a']:
+            groups.append({'a':r['a']})
+        gid.append(len(groups)-1)
+    gid=np.array(gid,dtype=np.int64)
+    ncell=len(results)
+    hit=np.array([r['match'] is not None for r in results],dtype=bool)
+    matched=[r for r in results if r['match'] is not None]
+
+    ######## per-cell rates and maxima as segment reductions over the concatenated matches
+    pdx=np.zeros(ncell)
+    pdy=np.zeros(ncell)
+    counts=np.zeros((4,ncell),dtype=np.int64)
+    counts[0]=[len(r['tru']) for r in results]
+    xamax=10.
+    yamax=10.
+    if matched:
+        nt=np.array([len(r['match']['bpd']) for r in matched])
+        nf=np.array([len(r['match']['bfa']) for r in matched])
+        tstart=np.cumsum(nt)-nt
+        fstart=np.cumsum(nf)-nf
+        bpd=np.concatenate([r['match']['bpd'] for r in matched])
+        bfa=np.concatenate([r['match']['bfa'] for r in matched])
+        pd=np.concatenate([r['match']['pd'] for r in matched])
+        fa=np.concatenate([r['match']['fa'] for r in matched])
+        counts[1,hit]=nf
+        counts[2,hit]=np.add.reduceat(bpd,tstart)
+        counts[3,hit]=np.add.reduceat(bfa,fstart)
+        pdx[hit]=1.-counts[3,hit]/nf
+        pdy[hit]=counts[2,hit]/nt
+        ### the axis limits grow cell by cell, as in the original scan
+        for fmax,pmax in zip(np.maximum.reduceat(fa,fstart),np.maximum.reduceat(pd,tstart)):
+            if xamax < int(fmax)+1:
+                xamax=int(fmax)+5
+            if yamax < int(pmax)+1:
+                yamax=int(pmax)+5
+
+        truth_x=np.concatenate([r['tru'].T[x] for r in matched])
+        fred_y=np.concatenate([r['match']['fred_y'] for r in matched])
+        tgroup=np.repeat(gid[hit],nt)
+        fgroup=np.repeat(gid[hit],nf)
+    for g,grp in enumerate(groups):
+        sel=gid==g
+        grp['pdx']=list(pdx[sel])
+        grp['pdy']=list(pdy[sel])
+        if matched:
+            tsel=tgroup==g
+            fsel=(fgroup==g)&(fa==0)
+            grp['pdx_array']=truth_x[tsel]
+            grp['pdy_array']=pd[tsel]
+            grp['fax_array']=fa[fsel]
+            grp['fay_array']=fred_y[fsel]
+        else:
+            for k in ('pdx_array','pdy_array','fax_array','fay_array'):
+                grp[k]=np.array([])
+    table=np.zeros(ncell,dtype=CELL_DTYPE)
+    for k in ('a','b','c','dm','width','sn'):
+        table[k]=[r[k] for r in results]
+    table['ntruth'],table['ncand'],table['ndetected'],table['nmatched']=counts
+    table['pd']=pdy
+    table['pfa']=pdx
+    return {'groups':groups,'cells':table,'xamax':xamax,'yamax':yamax}
+
+
+def binned_statistic(x,values,statistic='mean',bins=10):
+    """NumPy equivalent of scipy.stats.binned_statistic for 1D data.
+    Parameters
+    ----------
+    x, values : numpy array
+        sample positions and the values to reduce
+    statistic : string
+        mean, std, median, count, sum, min or max
+    bins : int
+        number of equal-width bins spanning the range of x
+
+    Returns
+    -------
+    statistic, bin_edges, binnumber (1-based, as in scipy)
+    """
+    x=np.asarray(x,dtype=np.float64)
+    values=np.asarray(values,dtype=np.float64)
+    bins=int(bins)
+    lo,hi=(x.min(),x.max()) if x.size else (0.,1.)
+    if lo==hi:
+        lo,hi=lo-0.5,hi+0.5
+    edges=np.linspace(lo,hi,bins+1)
+    binnumber=np.searchsorted(edges,x,side='right')
+    ### the right edge belongs to the last bin
+    binnumber[x==edges[-1]]=bins
+    idx=binnumber-1
+    count=np.bincount(idx,minlength=bins).astype(np.float64)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        if statistic=='count':
+            result=count
+        elif statistic=='sum':
+            result=np.bincount(idx,values,minlength=bins)
+        elif statistic in ('mean','std'):
+            mean=np.bincount(idx,values,minlength=bins)/count
+            if statistic=='mean':
+                result=mean
+            else:
+                result=np.sqrt(np.bincount(idx,(values-mean[idx])**2,minlength=bins)/count)
+        elif statistic in ('median','min','max'):
+            func={'median':np.median,'min':np.min,'max':np.max}[statistic]
+            result=np.full(bins,np.nan)
+            order=np.argsort(idx,kind='stable')
+            split=np.split(values[order],np.cumsum(np.bincount(idx,minlength=bins))[:-1])
+            for i,v in enumerate(split):
+                if len(v):
+                    result[i]=func(v)
+        else:
+            raise ValueError("Unknown statistic {}".format(statistic))
+    return result,edges,binnumber
+
+
+def recovery(summary,binmode='mean',errorbar='std',nper=25):
+    """Binned truth vs recovered curve of each group, one bin per nper injections.
+    Only detected injections (recovered value > 0) enter the bins.
+    Returns
+    -------
+    structured array with fields a, x (bin centre), y (binmode), err (errorbar) and count
+    """
+    rows=[]
+    for g in summary['groups']:
+        px=g['pdx_array']
+        py=g['pdy_array']
+        if len(px)==0:
+            continue
+        nbin=max(1,int(len(px)/nper))
+        det=py>0
+        err,edges,_=binned_statistic(px[det],py[det],errorbar,nbin)
+        mean=binned_statistic(px[det],py[det],binmode,nbin)[0]
+        count=binned_statistic(px[det],py[det],'count',nbin)[0]
+        for i in range(nbin):
+            rows.append((g['a'],(edges[i]+edges[i+1])/2,mean[i],err[i],count[i]))
+    return np.array(rows,dtype=RECOVERY_DTYPE)
+
+
+def write_summary(summary,output,binmode='mean',errorbar='std'):
+    """Write the per-cell rates (cells.csv) and the binned recovery curves (recovery.csv)."""
+    cells=summary['cells']
+    np.savetxt(output+"cells.csv",cells,delimiter=',',header=','.join(cells.dtype.names),comments='',
+               fmt=['%.10g']*6+['%d']*4+['%.10g']*2)
+    curve=recovery(summary,binmode,errorbar)
+    np.savetxt(output+"recovery.csv",curve,delimiter=',',header=','.join(curve.dtype.names),comments='',
+               fmt=['%.10g']*4+['%d'])
+
+
+def write_tables(results,output):
+    """Write the matched-candidate histogram data and the false-alarm log."""
+    with open(output+"histodata.txt",'w') as histo, open(output+'outlier.txt','w') as ol:
+        histo.write("#### time error, s/n truth, s/n fredda, dm, dm_fredda, width_intrinsic, boxcar_fredda \n")
+        for r in results:
+            m=r['match']
+            if m is None:
                 continue
-            tru=t[mix]
-            dmp=t.T[5][depo_dm][0]
-            flp=t.T[0][depo_fl][0]
-            wdp=t.T[8][depo_wd][0]
-            boxcar=tru.T[3]
-            limit=wdp/1.2*10
-            fredfile=ident+"{0:04}".format(int(dmp))+'_'+"{0:03}".format(wdp)+'_'+"{0:03}".format(flp)+'_fixed.fil.cand.fof'
-            if os.path.exists(fredfile):
-                fred=np.loadtxt(fredfile,dtype=float)
-                lt=len(mix)
-                lf=int(len(fred.flatten())/12)
-                pd=np.zeros(lt,dtype=float)
-                fa=np.zeros(lf,dtype=float)
-                bpd=np.zeros(lt,dtype=bool)
-                bfa=np.zeros(lf,dtype=bool)
-                if lf >1:
-                    for i in range(lt):
-                        dcheck=tru.T[5][i]
-                        tcheck=tru.T[1][i]
-                        dpos=np.intersect1d(np.where(fred.T[5]<dcheck+dlim),np.where(fred.T[5]>dcheck-dlim))
-                        tpos=np.intersect1d(np.where(fred.T[1]<tcheck+limit),np.where(fred.T[1]>tcheck-limit))
-                        pos=np.intersect1d(tpos,dpos)
-                        if len(pos) >0:
-                            sigcheck=np.min(abs(fred.T[0][pos]-tru.T[0][i]))
-                            match=np.where(abs(fred.T[0][pos]-tru.T[0][i])==sigcheck)
-                            pd[i]= fred.T[y][pos][match][0]
-                            bpd[i]=1
-                    for i in range(lf):
-                        tcheck=fred.T[1][i]
-                        dcheck=fred.T[5][i]
-                        tpos=np.intersect1d(np.where(tru.T[1]<tcheck+limit),np.where(tru.T[1]>tcheck-limit))
-                        dpos=np.intersect1d(np.where(tru.T[5]<dcheck+dlim),np.where(tru.T[5]>dcheck-dlim))
-                        pos=np.intersect1d(tpos,dpos)
-                        if len(pos) >0:
-                            sigcheck=np.min(abs(tru.T[0][pos]-fred.T[0][i]))
-                            match=np.where(abs(tru.T[0][pos]-fred.T[0][i])==sigcheck)
-                            fa[i]= tru.T[x][pos][match][0]
-                            bfa[i]=1
-                            #print(tcheck,dcheck,tru.T[5][pos][match][0])
-                            histo.write("%d %f %f %f %f %f %d\n"%((fred.T[1][i]-tru.T[1][pos][match][0]),tru.T[0][pos][match][0],fred.T[0][i],tru.T[5][pos][match][0],fred.T[5][i],tru.T[8][pos][match][0],fred.T[3][i]))
-                    pdx.append((1.-float(sum(bfa))/len(bfa)))
-                    pdy.append(float(sum(bpd))/len(bpd))
-                else:
-                    #print('single fredda')
-                    for i in range(lt):
-                        tcheck=tru.T[1][i]
-                        dcheck=tru.T[5][i]
-                        dpos=np.intersect1d(np.where(fred.T[5]<dcheck+dlim),np.where(fred.T[5]>dcheck-dlim))
-                        tpos=np.intersect1d(np.where(fred.T[1]<tcheck+limit),np.where(fred.T[1]>tcheck-limit))
-                        pos=np.intersect1d(tpos,dpos)
-                        if len(pos) > 0:
-                            sigcheck=abs(tru.T[0][i]-fred.T[0])
-                            pd[i]= fred.T[y]
-                            bpd[i]=1
-                            #if fred.T[0] < 15 and (tru.T[0][i]>25):
-                            #     ol.write(fredfile+" "+str(fred.T[2])+" "+str(fred.T[0])+" "+str(tru.T[0][i])+"\n")
-                    tcheck=fred.T[1]
-                    dcheck=fred.T[5]
-                    tpos=np.intersect1d(np.where(tru.T[1]<tcheck+limit),np.where(tru.T[1]>tcheck-limit))
-                    dpos=np.intersect1d(np.where(tru.T[5]<dcheck+dlim),np.where(tru.T[5]>dcheck-dlim))
-                    pos=np.intersect1d(tpos,dpos)
-                    if len(pos) >0:
-                        sigcheck=np.min(abs(tru.T[0][pos]-fred.T[0]))
-                        match=np.where(abs(tru.T[0][pos]-fred.T[0])==sigcheck)
-                        fa[0]= tru.T[x][pos][match][0]
-                        bfa[0]=1
-                        #print(tcheck,dcheck,tru.T[5][pos][match][0])
-                        #histo.write("#### time error, s/n truth, s/n fredda, dm, dm fredda, boxcar, boxcar fredda \n")
-                        histo.write("%d %f %f %f %f %d %d\n"%((fred.T[1]-tru.T[1][pos][match][0]),tru.T[0][pos][match][0],fred.T[0],tru.T[5][pos][match][0],fred.T[5],tru.T[3][pos][match][0],fred.T[3]))
-                    pdx.append((1.-float(sum(bfa))/len(bfa)))
-                    pdy.append(float(sum(bpd))/len(bpd))
-                if xamax < int(np.max(fa))+1:
-                    xamax=int(np.max(fa))+5
-                if yamax < int(np.max(pd))+1:
-                    yamax=int(np.max(pd))+5
-                #if (sum((tru.T[x]-pd)>20)) > 0:
-                    #print(tru.T[x]-pd)
-                    #print(dp,wp,fp)
-
-                #print(fa-fred.T[y])
-                #plt.scatter(tru.T[x],pd,color=col[kk],marker=mark[pluck],alpha=0.5,s=markersize)
-                #plt.scatter(fa,fred.T[y],color=col[kk],marker=mark[pluck],alpha=0.5,s=markersize)
-                #print(dmp,flp,wdp,len(pd),len(tru.T[x]),len(pdx_array),len(pdy_array))
-                if lf >1:
-                    pdx_array=np.append(pdx_array,tru.T[x])
-                    pdy_array=np.append(pdy_array,pd)
-                    fax_array=np.append(fax_array,fa[fa==0])
-                    fay_array=np.append(fay_array,fred.T[y][fa==0])
-                    if len(fax_array)!= len(fay_array):
-                        print('-----bad fred')
-                        print(dmp,flp,wdp,len(fa),len(fred.T[y]),len(fax_array),len(fay_array))
-                else:
-                    pdx_array=np.append(pdx_array,tru.T[x])
-                    pdy_array=np.append(pdy_array,pd)
-                    if sum(fa==0):
-                        fax_array=np.append(fax_array,fa[fa==0])
-                        fay_array=np.append(fay_array,fred.T[y])
-                    if len(fax_array)!= len(fay_array):
-                        print('-----bad fred')
-                        print(dmp,flp,wdp,len(fa),len(fred.T[y]),len(fax_array),len(fay_array))
-                if len(pdx_array)!= len(pdy_array):
-                    print('-----bad true')
-                    print(dmp,flp,wdp,len(pd),len(tru.T[x]),len(pdx_array),len(pdy_array))
+            np.savetxt(histo,m['histo'],fmt="%d %f %f %f %f %d %d" if len(m['bfa'])==1 else "%d %f %f %f %f %f %d")
+            if len(m['bfa']) >1 :
+                fa=m['fa']==0
+                ol.write("fa "+r['file']+" "+str(r['a'])+" "+str(r['c'])+" "+str(r['b'])+" "+str(1.-float(sum(m['bfa']))/len(m['bfa']))+" "+str(m['fa'][fa])+" "+str(m['fred_y'][fa])+"\n")
+
+
+def plot(summary,ltag=1,x=0,y=0,output='freddacheck',scatter=False,line=False,
+         errornone=False,errorbar='std',binmode='mean',show=False):
+    """Plot the detection/false-alarm curves (pdpfa.png) and truth vs recovered values (compare.png)."""
+    import matplotlib.pyplot as plt
+    plt.figure(1,figsize=(12, 9))
+    plt.xlabel("False Acquistion Rate",fontsize=15)
+    plt.ylabel("Detection Rate",fontsize=15)
+    plt.xlim(-0.01,1.01)
+    plt.ylim(-0.01,1.01)
+    plt.xticks(fontsize=15)
+    plt.yticks(fontsize=15)
+    plt.figure(2,figsize=(12, 9))
+    plt.xlabel('Truth '+units[x],fontsize=15)
+    plt.ylabel('Fredda '+units[y],fontsize=15)
+
+    groups=summary['groups']
+    plabel=LABEL_NAMES[ltag]
+    punit=label[ltag]
+    dmax=max([g['a'] for g in groups]) if groups else 0
+    markersize=15
+    for d,g in enumerate(groups):
+        dp=g['a']
+        if len(groups) >6:
+            if dp <= dmax/3:
+                pluck = 0
+            elif dp <= dmax/3*2:
+                pluck = 1
+            else:
+                pluck = 2
+            logging.debug('%s %s goes in panel %s',plabel,dp,pluck)
+        else:
+            pluck=d
+        kk=pluck
+        pdx_array=g['pdx_array']
+        pdy_array=g['pdy_array']
+        if len(pdx_array):
+            if line:
+                binmark=mark[pluck]+"-"
+            else:
+                binmark=mark[pluck]
+            if scatter:
+                plt.scatter(pdx_array,pdy_array,color=col[kk],marker=mark[pluck],alpha=0.7,s=markersize,label=plabel+str(dp)+punit)
+                plt.scatter(g['fax_array'],g['fay_array'],color=col[kk],marker=mark[pluck],alpha=0.5,s=markersize)
             else:
-                pdx.append(0.0)
-                pdy.append(0.0)
-            if lf >1 :
-                ol.write("fa "+fredfile+" "+str(dp)+" "+str(wp)+" "+str(fp)+" "+str(pdx[-1])+" "+str(fa[fa==0])+" "+str(fred.T[y][fa==0])+"\n")
-            #ol.write("pd "+fredfile+" "+str(dp)+" "+str(wp)+" "+str(fp)+" "+str(pdy[-1])+"\n")
+                curve=recovery({'groups':[g]},binmode,errorbar)
+                pd_std=0 if errornone else curve['err']
+                plt.errorbar(curve['x'],curve['y'],yerr=pd_std,color=col[kk],fmt=binmark,alpha=0.5,ms=markersize,label=plabel+str(dp)+punit)
             plt.figure(1)
+            plt.plot(g['pdx'],g['pdy'],binmark,color=col[kk],label=plabel+str(dp)+punit,alpha=0.5,ms=markersize/4)
             plt.figure(2)
-    if len(pdx_array):
-        if pguide:
-            binmark=mark[pluck]+"-"
-        else:
-            binmark=mark[pluck]
-        if pscat:
-            plt.scatter(pdx_array,pdy_array,color=col[kk],marker=mark[pluck],alpha=0.7,s=markersize,label=plabel+str(dp)+punit)
-            plt.scatter(fax_array,fay_array,color=col[kk],marker=mark[pluck],alpha=0.5,s=markersize)
-        else:
-            #plt.scatter(pdx_array[pdy_array==0],pdy_array[pdy_array==0],color=col[kk],marker=mark[pluck],alpha=0.5,s=markersize)
-            pd_std, bin_edges, binnumber=stats.binned_statistic(pdx_array[pdy_array>0],pdy_array[pdy_array>0], statistic=derr, bins=int(len(pdx_array)/25))
-            pd_mean =stats.binned_statistic(pdx_array[pdy_array>0],pdy_array[pdy_array>0], statistic=dbin, bins=(len(pdx_array)/25))[0]
-            bin_width = (bin_edges[1] - bin_edges[0])/2
-            xbinned=bin_edges[:-1]+ bin_width
-            ybinned=pd_mean
-            if values.errornone:
-                pd_std=0
-            plt.errorbar(xbinned,ybinned,yerr=pd_std,color=col[kk],fmt=binmark,alpha=0.5,ms=markersize,label=plabel+str(dp)+punit)
-        plt.figure(1)
-        plt.plot(pdx,pdy,binmark,color=col[kk],label=plabel+str(dp)+punit,alpha=0.5,ms=markersize/4)
-        plt.figure(2)
-meanie=np.arange(xamax)
-if x==y:
-    plt.plot(meanie,meanie,color='Purple',linewidth=5)
-plt.legend(loc=0,fontsize=15)
-plt.xlim(-0.1,xamax)
-plt.ylim(-0.1,yamax)
-plt.xticks(fontsize=15)
-plt.yticks(fontsize=15)
-if values.show:
-    plt.show()
-plt.savefig(values.output+"compare.png")
-plt.close()
-plt.figure(1)
-plt.legend(loc=0,fontsize=15)
-
-
-plt.savefig(values.output+"pdpfa.png")
-plt.close()
-
-ol.close()
-histo.close()
+    xamax=summary['xamax']
+    yamax=summary['yamax']
+    meanie=np.arange(xamax)
+    if x==y:
+        plt.plot(meanie,meanie,color='Purple',linewidth=5)
+    plt.legend(loc=0,fontsize=15)
+    plt.xlim(-0.1,xamax)
+    plt.ylim(-0.1,yamax)
+    plt.xticks(fontsize=15)
+    plt.yticks(fontsize=15)
+    if show:
+        plt.show()
+    plt.savefig(output+"compare.png")
+    plt.close()
+    plt.figure(1)
+    plt.legend(loc=0,fontsize=15)
+    plt.savefig(output+"pdpfa.png")
+    plt.close()
+
+
+def main():
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+    parser = ArgumentParser(description='Crossmatch injected truths against FREDDA candidates', formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='Be verbose')
+    parser.add_argument('-s','--show', action='store_true', help='Show')
+    parser.add_argument('-x','--xaxis',type=int,default=0)
+    parser.add_argument('-y','--yaxis',type=int,default=0)
+    parser.add_argument('-o','--output',type=str,default='freddacheck')
+    parser.add_argument('-d','--set',type=str,default='testset_')
+    parser.add_argument('--sncut',type=float,default=50.0)
+    parser.add_argument('--scatter', action='store_true', help='Show')
+    parser.add_argument('--line', action='store_true', help='Show')
+    parser.add_argument('--errornone', action='store_true', help='Show')
+    parser.add_argument('--errorbar', default='std',type=str, help='Show')
+    parser.add_argument('-l','--label',type=int,default=1,help=' 1 for dm label, 2 for fluence(s/n) label, 3 for width label')
+    parser.add_argument('--binmode', type=str,default='mean',help='Show')
+    parser.add_argument('-j','--nproc',type=int,default=None,help='worker processes for candidate files, one per CPU if not set')
+    parser.add_argument('--no-plot', action='store_true', help='only write the tables, without importing matplotlib')
+    parser.add_argument('--cache-dir',type=str,default=None,help='binary table cache, .simpulse_cache next to each file if not set')
+    parser.add_argument('--no-cache', action='store_true', help='parse the text tables without using the cache')
+    parser.add_argument(dest='files', nargs='+')
+    parser.set_defaults(verbose=False)
+    values = parser.parse_args()
+    if values.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    x=values.xaxis
+    y=values.yaxis
+    use_cache=not values.no_cache
+    truth=load_truth(values.files[0],values.sncut,values.cache_dir,use_cache)
+    results=crossmatch(truth,values.set,values.label,x,y,nproc=values.nproc,
+                       cache_dir=values.cache_dir,use_cache=use_cache)
+    write_tables(results,values.output)
+    summary=summarise(results,x)
+    write_summary(summary,values.output,binmode=values.binmode,errorbar=values.errorbar)
+    if values.no_plot:
+        return
+    plot(summary,values.label,x,y,values.output,scatter=values.scatter,line=values.line,
+         errornone=values.errornone,errorbar=values.errorbar,binmode=values.binmode,show=values.show)
+
+
+if __name__ == '__main__':
+    main()
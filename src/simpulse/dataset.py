@@ -0,0 +1,316 @@
+# dataset.py
+"""
+In-memory training sets of simulated bursts.
+
+TrainingSet yields batches of noisy, quantized dynamic-spectrum cutouts and
+their labels without writing any files. Worker processes fill slots of a
+shared-memory ring buffer. The consumer takes the batches in order, so a
+given seed gives the same stream whatever the number of workers.
+
+Workers are started with spawn, so a script using TrainingSet needs an
+if __name__ == "__main__" guard. A worker that raises, or dies, makes
+batches() raise RuntimeError with its traceback or exit code, instead of
+waiting forever, and the shared memory is released.
+
+Cutouts are (batch, nchan, nsamp), frequency by time, which is the
+transpose of the Spectra (nsamp, nchan) convention. Each burst is placed
+with the simperiod template engine: a Gaussian of the sampled width,
+dispersed with tidm and scaled to the sampled optimal S/N.
+
+    with TrainingSet(nchan=256, nsamp=512, batch_size=64, nworkers=4, seed=1) as ts:
+        for data, labels in ts.batches(1000):
+            ...
+"""
+
+import multiprocessing as mp
+import queue
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from simpulse.sim.burst import tidm
+from simpulse.sim.model import freq_splitter_idx
+from simpulse.sim.periodic import pulse_templates, place_pulses
+
+LABEL_DTYPE = np.dtype([
+    ("dm", "f8"),       # pc cm-3, 0 for noise-only cutouts
+    ("width", "f8"),    # gaussian sigma (ms)
+    ("snr", "f8"),      # optimal S/N of the injected burst, 0 for noise-only cutouts
+    ("sample", "f8"),   # arrival sample at fch1
+    ("burst", "i8"),    # 1 if the cutout holds a burst
+])
+
+### seconds between checks that the workers are alive while waiting for a batch
+POLL = 1.0
+
+
+class BatchConfig:
+    def __init__(self, nchan=336, nsamp=1024, batch_size=32, fch1=1100, bwchan=1, tsamp=1,
+                 dm=(0.0, 3.0), width=(0.5, 5.0), snr=(5.0, 50.0), noise_fraction=0.0,
+                 std=18, base=127, oversample=10):
+        """Instrument setup and parameter ranges of a training set.
+        Parameters
+        ----------
+        nchan, nsamp : int
+            cutout size
+        batch_size : int
+            cutouts per batch
+        fch1, bwchan, tsamp :
+            first channel (MHz), channel bandwidth (MHz) and time resolution (ms), as for Spectra
+        dm : (float, float)
+            uniform DM range (pc cm-3), in the units of tidm
+        width : (float, float)
+            log-uniform range of the gaussian sigma (ms)
+        snr : (float, float)
+            uniform range of the optimal S/N
+        noise_fraction : float
+            fraction of cutouts without a burst
+        std, base : float
+            noise rms and level before quantizing to uint8
+        oversample : int
+            sub-sample phases of the pulse templates
+        """
+        self.nchan = nchan
+        self.nsamp = nsamp
+        self.batch_size = batch_size
+        self.fch1 = fch1
+        self.bwchan = bwchan
+        self.tsamp = tsamp
+        self.dm = dm
+        self.width = width
+        self.snr = snr
+        self.noise_fraction = noise_fraction
+        self.std = std
+        self.base = base
+        self.oversample = oversample
+        self.vif = freq_splitter_idx(nchan, 0, nchan, bwchan, fch1)[0]
+
+
+def sample_labels(rng, config):
+    """Draw the burst parameters of one batch."""
+    n = config.batch_size
+    labels = np.zeros(n, dtype=LABEL_DTYPE)
+    labels["burst"] = rng.random(n) >= config.noise_fraction
+    labels["dm"] = rng.uniform(*config.dm, n)
+    labels["width"] = np.exp(rng.uniform(*np.log(config.width), n))
+    labels["snr"] = rng.uniform(*config.snr, n)
+
+    ### arrival at fch1 such that the whole dispersion sweep lies in the cutout where possible
+    delays = tidm(labels["dm"][:, None], config.vif[None, :], config.fch1)
+    pad = 3 * labels["width"]
+    lo = pad - delays.min(axis=1)
+    hi = config.nsamp * config.tsamp - pad - delays.max(axis=1)
+    t0 = np.where(hi > lo, lo + rng.random(n) * (hi - lo), (lo + hi) / 2)
+    labels["sample"] = t0 / config.tsamp
+
+    labels["dm"][labels["burst"] == 0] = 0
+    labels["snr"][labels["burst"] == 0] = 0
+    return labels
+
+
+def make_batch(seed, index, config, out=None):
+    """Generate batch number index of the stream of seed.
+    Parameters
+    ----------
+    out : numpy array
+        optional (batch_size, nchan, nsamp) uint8 array to fill
+
+    Returns
+    -------
+    data : numpy array
+        (batch_size, nchan, nsamp) uint8 cutouts
+    labels : numpy array
+        LABEL_DTYPE record per cutout
+    """
+    rng = np.random.default_rng([seed, index])
+    labels = sample_labels(rng, config)
+    if out is None:
+        out = np.empty((config.batch_size, config.nchan, config.nsamp), dtype=np.uint8)
+
+    burst = np.zeros((config.nsamp, config.nchan))
+    for k, lab in enumerate(labels):
+        dyn = rng.standard_normal((config.nchan, config.nsamp), dtype=np.float32)
+        dyn *= config.std
+        dyn += config.base
+        if lab["burst"]:
+            burst[:] = 0
+            templates, half = pulse_templates(lab["width"], config.tsamp, oversample=config.oversample)
+            delays = tidm(lab["dm"], config.vif, config.fch1)
+            place_pulses(burst, [lab["sample"] * config.tsamp], delays, templates, half, config.tsamp)
+            norm = np.sqrt(np.sum(burst ** 2))
+            if norm > 0:
+                dyn += burst.T * (lab["snr"] * config.std / norm)
+        np.clip(dyn, 0, 255, out=dyn)
+        out[k] = dyn
+    return out, labels
+
+
+def _worker(shm_name, shape, seed, config, free, tasks, ready):
+    """fill free ring slots with the batches handed out in tasks until a None task arrives,
+    an exception is sent back as (index, None, traceback)"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    index = None
+    try:
+        ring = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        while True:
+            ### hold a slot before taking a task, so an in-order consumer can never starve
+            slot = free.get()
+            index = tasks.get()
+            if index is None:
+                break
+            _, labels = make_batch(seed, index, config, out=ring[slot])
+            ready.put((index, slot, labels))
+    except Exception:
+        ready.put((index, None, traceback.format_exc()))
+    finally:
+        shm.close()
+
+
+class TrainingSet:
+    def __init__(self, nworkers=None, nslots=None, seed=None, **kwargs):
+        """Stream of simulated training batches.
+        Parameters
+        ----------
+        nworkers : int
+            worker processes, None for one per CPU and 0 to generate in this process.
+            They are spawned, not forked, see the module docstring
+        nslots : int
+            batches held in the shared-memory ring, defaults to twice the number of workers
+        seed : int
+            base seed, batch i always holds the same cutouts for the same seed and config
+        kwargs :
+            BatchConfig parameters
+        """
+        self.config = BatchConfig(**kwargs)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy % 2 ** 32
+        self.seed = seed
+        self.nworkers = mp.cpu_count() if nworkers is None else nworkers
+        self.nslots = nslots or 2 * max(self.nworkers, 1)
+        self.workers = []
+        self.shm = None
+
+    def _start(self):
+        c = self.config
+        self.shape = (self.nslots, c.batch_size, c.nchan, c.nsamp)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)))
+        try:
+            self.ring = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+            ### fork is unsafe once OpenMP-backed numba kernels have run in this process
+            ctx = mp.get_context("spawn")
+            self.free = ctx.Queue()
+            self.tasks = ctx.Queue()
+            self.ready = ctx.Queue()
+            for slot in range(self.nslots):
+                self.free.put(slot)
+            self.workers = [ctx.Process(target=_worker, daemon=True,
+                                        args=(self.shm.name, self.shape, self.seed, c,
+                                              self.free, self.tasks, self.ready))
+                            for _ in range(self.nworkers)]
+            for w in self.workers:
+                w.start()
+        except BaseException:
+            self.close()
+            raise
+
+    def _next_ready(self):
+        """Next (index, slot, labels) from the workers. Closes the set and raises RuntimeError
+        when a worker sent back an exception or has exited."""
+        while True:
+            ### workers only exit when closed, so any exit is a failure
+            dead = [w for w in self.workers if not w.is_alive()]
+            if dead:
+                codes = ", ".join(str(w.exitcode) for w in dead)
+                ### a worker that raised has sent its traceback before exiting
+                error = None
+                while error is None:
+                    try:
+                        got, slot, labels = self.ready.get_nowait()
+                    except queue.Empty:
+                        break
+                    if slot is None:
+                        error = got, labels
+                self._abort()
+                if error is not None:
+                    raise RuntimeError("TrainingSet worker failed on batch {}:\n{}".format(*error))
+                raise RuntimeError("{} TrainingSet worker(s) exited, exit code {}".format(len(dead), codes))
+            try:
+                got, slot, labels = self.ready.get(timeout=POLL)
+            except queue.Empty:
+                continue
+            if slot is None:
+                self._abort()
+                raise RuntimeError("TrainingSet worker failed on batch {}:\n{}".format(got, labels))
+            return got, slot, labels
+
+    def batches(self, nbatch, start=0):
+        """Yield (data, labels) for batches start .. start+nbatch-1, in order.
+        data is a copy, so it stays valid after the next batch is produced.
+        """
+        if self.nworkers == 0:
+            for index in range(start, start + nbatch):
+                yield make_batch(self.seed, index, self.config)
+            return
+
+        if self.shm is None:
+            self._start()
+        stop = start + nbatch
+        ### keep at most nslots batches in flight, an abandoned stream then drains quickly
+        submitted = min(stop, start + self.nslots)
+        for index in range(start, submitted):
+            self.tasks.put(index)
+        pending = {}
+        index = start
+        try:
+            while index < stop:
+                while index not in pending:
+                    got, slot, labels = self._next_ready()
+                    pending[got] = (slot, labels)
+                slot, labels = pending.pop(index)
+                data = self.ring[slot].copy()
+                self.free.put(slot)
+                index += 1
+                if submitted < stop:
+                    self.tasks.put(submitted)
+                    submitted += 1
+                yield data, labels
+        finally:
+            ### nothing to hand back once a failure has closed the set
+            if self.shm is not None:
+                for _ in range(submitted - index - len(pending)):
+                    got, slot, labels = self._next_ready()
+                    pending[got] = (slot, labels)
+                for slot, _ in pending.values():
+                    self.free.put(slot)
+
+    def _abort(self):
+        """Stop the workers without waiting for them and release the shared memory."""
+        for w in self.workers:
+            w.terminate()
+        self.close()
+
+    def close(self):
+        """Stop the workers and release the shared memory."""
+        if self.shm is None:
+            return
+        try:
+            for _ in self.workers:
+                self.free.put(-1)
+                self.tasks.put(None)
+            for w in self.workers:
+                w.join(timeout=5)
+                if w.is_alive():
+                    w.terminate()
+        finally:
+            self.workers = []
+            self.ring = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,7 +1,6 @@
 """
 Writes numpy files into filterbank, needs sigproc.py now sigproc3
 """
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import sys
@@ -10,11 +9,29 @@ import logging
 # from astropy import units as u
 # import sigpyproc as sgp
 from simpulse.io import sigproc as sgp
+from simpulse.profiling import stage, add
 
 __author__ = "Harry Qiu"
 
 
 
+def noise_block(nchan,nsamp,std,base,channels=None,dtype=np.float64):
+    """(nchan, nsamp) uint8 white noise. The draw is channel-major, so chunks of channels
+    continue the same stream as one draw and the block does not depend on channels.
+    The float64 draw is scaled and offset in dtype, float32 or float64."""
+    channels=channels or nchan
+    dtype=np.dtype(dtype)
+    std,base=dtype.type(std),dtype.type(base)
+    noise=np.empty((nchan,nsamp),dtype=np.uint8)
+    for lo in range(0,nchan,channels):
+        hi=min(lo+channels,nchan)
+        with stage("noise"):
+            chunk=np.random.randn(hi-lo, nsamp).astype(dtype,copy=False)*std + base
+        with stage("quantize"):
+            noise[lo:hi]=chunk.astype(np.uint8)
+    return noise
+
+
 class makefilterbank:
     def __init__(self,filename,header=None):
         # if header== "Empty":
@@ -48,14 +65,28 @@ class makefilterbank:
             self.header=header
         self.fbank=sgp.SigprocFile(filename,'wb',header)
         self.fbank.seek_data()
+        ### samples written so far, the position of the next block
+        self.nwritten=0
 
     def writeblock(self,input):
-        input.T.tofile(self.fbank.fin)
+        """write a (nsamp, nchan) block in sigproc sample-major order"""
+        with stage("write"):
+            input.tofile(self.fbank.fin)
+        self.nwritten+=input.shape[0]
+        add("bytes_written",input.nbytes)
+        add("samples_written",input.shape[0])
         
-    def writenoise(self,nsamp,std,base):
-        noise=(np.random.randn(self.header['nchans'], nsamp)*std + base).astype(np.uint8)
-        noise.T.tofile(self.fbank.fin)
+    def writenoise(self,nsamp,std,base,channels=None,dtype=np.float64):
+        """write nsamp samples of quantized white noise, drawn channels channels at a time (all by default)
+        and computed in dtype"""
+        noise=noise_block(self.header['nchans'],nsamp,std,base,channels,dtype)
+        with stage("write"):
+            noise.T.tofile(self.fbank.fin)
+        self.nwritten+=nsamp
+        add("bytes_written",noise.nbytes)
+        add("samples_written",nsamp)
         
     def closefile(self):
-        self.fbank.fin.flush()
-        self.fbank.fin.close()
+        with stage("write"):
+            self.fbank.fin.flush()
+            self.fbank.fin.close()
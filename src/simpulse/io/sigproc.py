@@ -10,6 +10,7 @@ Patched for Python3 bytes/str handling by OA Johnson
 
 import struct
 import os
+import sys
 import numpy as np
 import warnings
 
@@ -146,6 +147,30 @@ def write(f, v, struct_format):
         raise
 
 
+def write_header(f, header):
+    """Write a SIGPROC header at the current position of f, without seeking.
+    Keys whose value is None (e.g. nsamples of a stream) are left out."""
+    write_str(f, "HEADER_START")
+
+    for k, v in header.items():
+        if v is None:
+            continue
+        if k in STRING_PARAMS:
+            write_str(f, k)
+            write_str(f, v)
+        elif k in INT_PARAMS:
+            write_str(f, k)
+            write(f, int(v), INT_FORMAT)
+        elif k in DOUBLE_PARAMS:
+            write_str(f, k)
+            write(f, float(v), DOUBLE_FORMAT)
+        else:
+            # Unknown key – skip, on stderr so a stream on stdout stays clean
+            print("Cannot write header", k, file=sys.stderr)
+
+    write_str(f, "HEADER_END")
+
+
 class SigprocFile(object):
     def __init__(self, filename, mode="r", header=None):
         self.filename = filename
@@ -171,25 +196,7 @@ class SigprocFile(object):
     def _write_header(self, header):
         f = self.fin
         f.seek(0)
-        write_str(f, "HEADER_START")
-
-        for k, v in header.items():
-            if v is None:
-                continue
-            if k in STRING_PARAMS:
-                write_str(f, k)
-                write_str(f, v)
-            elif k in INT_PARAMS:
-                write_str(f, k)
-                write(f, int(v), INT_FORMAT)
-            elif k in DOUBLE_PARAMS:
-                write_str(f, k)
-                write(f, float(v), DOUBLE_FORMAT)
-            else:
-                # Unknown key – skip
-                print("Cannot write header", k)
-
-        write_str(f, "HEADER_END")
+        write_header(f, header)
         self.data_start_idx = f.tell()
 
     def _read_header(self):
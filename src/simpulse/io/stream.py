@@ -0,0 +1,91 @@
+# io/stream.py
+"""
+Streams filterbank data to a pipe or socket instead of a file.
+
+The SIGPROC header is written once, without seeking, and the data blocks
+follow. A reader that falls behind holds up the writer through the blocking
+writes of the pipe or socket. Sink specs:
+    -  or  stdout         standard output
+    fifo:/path            named pipe, created if missing
+    tcp:host:port         TCP connection
+    unix:/path            Unix domain socket
+"""
+import os
+import socket
+import stat
+import sys
+
+import numpy as np
+
+from simpulse.io.sigproc import write_header
+from simpulse.io.fbio import noise_block
+from simpulse.profiling import stage, add
+
+__author__ = "Owen A. Johnson"
+
+
+def open_sink(spec):
+    """Open a writable binary stream for a sink spec, see the module docstring."""
+    if spec in ("-", "stdout"):
+        return sys.stdout.buffer
+    kind, _, target = spec.partition(":")
+    if kind == "fifo":
+        if not os.path.exists(target):
+            os.mkfifo(target)
+        elif not stat.S_ISFIFO(os.stat(target).st_mode):
+            raise ValueError("{} exists and is not a named pipe".format(target))
+        ### blocks until a reader opens the pipe
+        return open(target, "wb")
+    if kind == "tcp":
+        host, _, port = target.rpartition(":")
+        sock = socket.create_connection((host or "localhost", int(port)))
+        return sock.makefile("wb")
+    if kind == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(target)
+        return sock.makefile("wb")
+    raise ValueError("Unknown sink {}, expected -, fifo:PATH, tcp:HOST:PORT or unix:PATH".format(spec))
+
+
+class streamfilterbank:
+    def __init__(self, spec, header, nsamples=None):
+        """Filterbank writer on a stream, with the interface of fbio.makefilterbank.
+        Parameters
+        ----------
+        spec : string
+            sink spec, see open_sink
+        header : dict
+            SIGPROC header
+        nsamples : int
+            number of samples sent in-band in the header, None leaves it unset for an open-ended stream
+        """
+        self.header = dict(header, nsamples=nsamples)
+        self.spec = spec
+        self.fout = open_sink(spec)
+        write_header(self.fout, self.header)
+        self.nwritten = 0
+
+    def writeblock(self, input):
+        """write a (nsamp, nchan) block in sigproc sample-major order"""
+        with stage("write"):
+            self.fout.write(np.ascontiguousarray(input).tobytes())
+        self.nwritten += input.shape[0]
+        add("bytes_written", input.nbytes)
+        add("samples_written", input.shape[0])
+
+    def writenoise(self, nsamp, std, base, channels=None, dtype=np.float64):
+        self.writeblock(noise_block(self.header['nchans'], nsamp, std, base, channels, dtype).T)
+
+    def flush(self):
+        with stage("write"):
+            self.fout.flush()
+
+    def closefile(self):
+        """Flush, but keep the stream open so several simulated files can follow each other in it."""
+        self.flush()
+
+    def close(self):
+        """Flush and close the stream."""
+        self.fout.flush()
+        if self.fout is not sys.stdout.buffer:
+            self.fout.close()
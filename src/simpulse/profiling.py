@@ -0,0 +1,174 @@
+# profiling.py
+"""
+Per-stage timers and throughput counters.
+
+Library code marks its stages with `with stage("burst"):` and its output with
+`add("bytes_written", n)`. Both are no-ops until a Profiler is enabled, so
+an unprofiled run only pays a function call per stage. Stages are timed
+exclusively: a nested stage pauses the one around it, so the stage times add
+up to the profiled wall time and a regression shows up in the stage that
+caused it. Each thread keeps its own stack of open stages.
+
+    profiler = enable()
+    ...
+    print(json.dumps(profiler.snapshot()))
+"""
+
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+_NULL = nullcontext()
+_active = None
+
+
+def peak_rss():
+    """Peak resident set size of this process (bytes)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ### kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        now = time.perf_counter()
+        stack = self.profiler._stack()
+        if stack:
+            self.profiler._charge(stack[-1], now)
+        stack.append([self.name, now])
+        return self
+
+    def __exit__(self, *exc):
+        now = time.perf_counter()
+        stack = self.profiler._stack()
+        self.profiler._charge(stack.pop(), now, call=True)
+        if stack:
+            stack[-1][1] = now
+
+
+class Profiler:
+    def __init__(self):
+        """Stage times and counters of one run, started at creation."""
+        self.start = time.perf_counter()
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _charge(self, entry, now, call=False):
+        name, since = entry
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + now - since
+            if call:
+                self.calls[name] = self.calls.get(name, 0) + 1
+
+    def stage(self, name):
+        """Context manager timing the enclosed code as stage name."""
+        return _Stage(self, name)
+
+    def add(self, name, n=1):
+        """Increase counter name by n."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        """Stage times, counters and throughput so far, as a JSON-ready dict."""
+        elapsed = time.perf_counter() - self.start
+        with self.lock:
+            seconds = dict(self.seconds)
+            calls = dict(self.calls)
+            counters = dict(self.counters)
+        stages = {name: dict(seconds=s, calls=calls.get(name, 0), fraction=s / elapsed if elapsed else 0.0)
+                  for name, s in sorted(seconds.items(), key=lambda kv: -kv[1])}
+        rate = 1.0 / elapsed if elapsed else 0.0
+        return dict(elapsed=elapsed, stages=stages,
+                    other=max(0.0, elapsed - sum(seconds.values())),
+                    counters=counters,
+                    samples_per_s=counters.get("samples_written", 0) * rate,
+                    mb_per_s=counters.get("bytes_written", 0) * rate / 2 ** 20,
+                    peak_rss_mb=peak_rss() / 2 ** 20)
+
+
+def enable():
+    """Start profiling with a new Profiler, returned."""
+    global _active
+    _active = Profiler()
+    return _active
+
+
+def disable():
+    """Stop profiling, returning the Profiler that was active."""
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def active():
+    """The enabled Profiler, None if profiling is off."""
+    return _active
+
+
+def stage(name):
+    """Time the enclosed code as stage name when profiling is on."""
+    profiler = _active
+    return _NULL if profiler is None else profiler.stage(name)
+
+
+def add(name, n=1):
+    """Increase counter name by n when profiling is on."""
+    profiler = _active
+    if profiler is not None:
+        profiler.add(name, n)
+
+
+class ProfileReport:
+    def __init__(self, filename, interval=None):
+        """Write profiler snapshots as JSON lines, every interval seconds and once at the end.
+        Parameters
+        ----------
+        filename : string
+            output file, - for stderr
+        interval : float
+            seconds between intermediate snapshots, only the final one if None
+        """
+        self.profiler = enable()
+        self.fout = sys.stderr if filename == "-" else open(filename, "w")
+        self.interval = interval
+        self.done = threading.Event()
+        self.thread = None
+        if interval:
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def _write(self, final):
+        rec = dict(self.profiler.snapshot(), final=final)
+        self.fout.write(json.dumps(rec) + "\n")
+        self.fout.flush()
+
+    def _loop(self):
+        while not self.done.wait(self.interval):
+            self._write(False)
+
+    def close(self):
+        """Write the final snapshot and stop profiling."""
+        self.done.set()
+        if self.thread is not None:
+            self.thread.join()
+        self._write(True)
+        if self.fout is not sys.stderr:
+            self.fout.close()
+        disable()
@@ -0,0 +1,353 @@
+# realtime.py
+"""
+Paced filterbank stream emulating a live backend.
+
+A producer thread generates blocks of noise with injected bursts ahead of
+wall-clock time into a bounded queue. The writer releases block i to the sink
+once it would have been recorded, at start + (i + 1) * block duration, so
+the stream runs at the instrument data rate of nchan * nbits / tsamp.
+
+A block that is not ready in time counts as an underrun, and its lag is
+recorded. If the sink falls behind by more than max_lag, blocks are dropped,
+as a backend with a full ring buffer would, until the stream is back on
+schedule. The sample clock keeps running through dropped blocks.
+
+Bursts arrive at a fixed interval or as a Poisson process. Their DM, width
+and S/N are drawn from parse_dist specs, and their clean templates come from
+Spectra.burst. Each burst is logged as a JSON line with the wall-clock time
+its peak left the simulator, for end-to-end latency measurements:
+
+    simpulse-realtime --stream unix:/tmp/search.sock --rate 0.2 --dm uniform:0,2 --truth live.jsonl
+"""
+
+import json
+import queue
+import threading
+import time
+
+import numpy as np
+from rich.console import Console
+
+from simpulse.sim.model import Spectra
+from simpulse.sim import kernels
+from simpulse.sim.burst import tidm
+from simpulse.sim.noise import quantize
+from simpulse.sim.periodic import parse_dist
+from simpulse.io.stream import streamfilterbank
+
+console = Console()
+
+
+def draw(spec, rng):
+    """One draw of a parse_dist spec."""
+    kind, params = parse_dist(spec)
+    if kind == "const":
+        return params[0]
+    if kind == "normal":
+        return rng.normal(*params)
+    if kind == "lognormal":
+        return np.exp(rng.normal(*params))
+    return rng.uniform(*params)
+
+
+class RealtimeStats:
+    def __init__(self):
+        """Counters of a paced run, updated by the writer."""
+        self.blocks = 0
+        self.written = 0
+        self.dropped = 0
+        self.underruns = 0
+        self.bursts = 0
+        self.lag_sum = 0.0
+        self.lag_max = 0.0
+        self.lag = 0.0
+        self.depth = 0
+
+    def update(self, lag, dropped, underrun, depth):
+        self.blocks += 1
+        self.dropped += dropped
+        self.written += not dropped
+        self.underruns += underrun
+        self.lag = lag
+        self.lag_sum += lag
+        self.lag_max = max(self.lag_max, lag)
+        self.depth = depth
+
+    def summary(self):
+        return dict(blocks=self.blocks, written=self.written, dropped=self.dropped,
+                    underruns=self.underruns, bursts=self.bursts,
+                    lag_mean=self.lag_sum / max(self.blocks, 1), lag_max=self.lag_max)
+
+    def report(self):
+        return ("{} blocks, {} dropped, {} underruns, {} bursts | lag {:.1f} ms (max {:.1f} ms) | "
+                "{} blocks ahead").format(self.blocks, self.dropped, self.underruns, self.bursts,
+                                          self.lag * 1e3, self.lag_max * 1e3, self.depth)
+
+
+class RealtimeStream:
+    def __init__(self, model, sink, block=1024, ahead=8, rate=None, interval=None,
+                 dm="0", width="1", snr="20", mode="single", std=18, base=127,
+                 max_lag=None, seed=None, truth=None, burst=None):
+        """Paced burst stream.
+        Parameters
+        ----------
+        model : Spectra
+            instrument setup, its header goes out with the stream
+        sink : streamfilterbank
+            open stream the blocks are written to
+        block : int
+            samples per block
+        ahead : int
+            blocks generated ahead of wall-clock time
+        rate : float
+            mean Poisson burst rate (per second)
+        interval : float
+            fixed time between bursts (s), used when rate is not set
+        dm, width, snr : string or float
+            parse_dist specs of the burst DM (pc cm-3), gaussian width (ms) and optimal S/N
+        mode : string
+            Spectra.burst pulse shape
+        std, base : float
+            noise rms and level before quantizing to uint8
+        max_lag : float
+            lag (s) beyond which blocks are dropped, defaults to the time covered by ahead blocks
+        seed : int
+            seed of the noise and the burst schedule
+        truth : file
+            open text file, one JSON line per burst
+        burst : callable
+            replacement for model.burst with the same arguments, e.g. a TemplateCache burst
+        """
+        self.model = model
+        self.sink = sink
+        self.block = block
+        self.ahead = ahead
+        self.rate = rate
+        self.interval = interval
+        self.dm = dm
+        self.width = width
+        self.snr = snr
+        self.mode = mode
+        self.std = std
+        self.base = base
+        self.duration = block * model.tsamp / 1000.0
+        self.max_lag = ahead * self.duration if max_lag is None else max_lag
+        self.rng = np.random.default_rng(seed)
+        self.truth = truth
+        self.burst = model.burst if burst is None else burst
+        self.stats = RealtimeStats()
+        self.blocks = queue.Queue(maxsize=ahead)
+        self.stop = threading.Event()
+        self.error = None
+
+    def next_arrival(self, sample):
+        """Sample of the burst after the one at sample, None without a schedule."""
+        nsamp = 1000.0 / self.model.tsamp
+        if self.rate:
+            return sample + max(1, int(round(self.rng.exponential(1.0 / self.rate) * nsamp)))
+        if self.interval:
+            return sample + max(1, int(round(self.interval * nsamp)))
+        return None
+
+    def template(self, dm, width, snr):
+        """Clean burst scaled to an optimal S/N of snr, cropped to its nonzero samples.
+        Returns
+        -------
+        cropped (n, nchan) template, sample of its peak at fch1 inside it
+        """
+        model = self.model
+        pad = 6 * width
+        delays = tidm(dm, model.vif, model.fch1)
+        t0 = pad - min(0.0, delays.min())
+        nsamp = int(np.ceil((t0 + max(0.0, delays.max()) + pad) / model.tsamp)) + 1
+        base1, _ = self.burst(t0=t0, dm=dm, A=1, width=width, mode=self.mode, nsamp=nsamp)
+        rows = np.flatnonzero(np.any(base1 != 0, axis=1))
+        lo, hi = (rows[0], rows[-1] + 1) if rows.size else (0, 1)
+        norm = np.sqrt(np.sum(base1 ** 2))
+        scale = snr * self.std / norm if norm > 0 else 0.0
+        return (base1[lo:hi] * scale).astype(np.float32), int(round(t0 / model.tsamp)) - lo
+
+    def schedule(self, sample, pulse):
+        """Draw the burst peaking at sample (at fch1), None without a schedule.
+        Returns
+        -------
+        first sample of the template, template, truth record
+        """
+        if sample is None:
+            return None
+        dm = draw(self.dm, self.rng)
+        width = draw(self.width, self.rng)
+        snr = draw(self.snr, self.rng)
+        array, peak = self.template(dm, width, snr)
+        return sample - peak, array, dict(pulse=pulse, sample=sample, dm=dm, width=width, snr=snr)
+
+    def produce(self):
+        """Fill the block queue until stop is set."""
+        try:
+            nchan = self.model.nchan
+            pending = []
+            announced = []
+            upcoming = self.schedule(self.next_arrival(0), 0)
+            index = 0
+            while not self.stop.is_set():
+                start = index * self.block
+                stop = start + self.block
+                ### a burst joins the first block it touches, which can be before its peak
+                while upcoming is not None and upcoming[0] < stop:
+                    first, array, rec = upcoming
+                    pending.append((first, array))
+                    announced.append(rec)
+                    upcoming = self.schedule(self.next_arrival(rec["sample"]), rec["pulse"] + 1)
+
+                dyn = self.rng.standard_normal((self.block, nchan), dtype=np.float32)
+                dyn *= self.std
+                dyn += self.base
+                for first, array in pending:
+                    lo = max(first, start)
+                    hi = min(first + array.shape[0], stop)
+                    if hi > lo:
+                        dyn[lo - start:hi - start] += array[lo - first:hi - first]
+                pending = [(first, array) for first, array in pending if first + array.shape[0] > stop]
+                ### bursts are reported with the block holding their peak
+                bursts = [rec for rec in announced if rec["sample"] < stop]
+                announced = [rec for rec in announced if rec["sample"] >= stop]
+                item = (index, kernels.dispatch("quantize", quantize)(dyn), bursts)
+
+                while not self.stop.is_set():
+                    try:
+                        self.blocks.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                index += 1
+        except Exception as err:
+            self.error = err
+            self.stop.set()
+
+    def log(self, burst, written, t0):
+        """Log one burst with the wall-clock times of its peak sample, None for written if dropped."""
+        self.stats.bursts += 1
+        if self.truth is None:
+            return
+        rec = dict(burst, due=t0 + (burst["sample"] + 1) * self.model.tsamp / 1000.0, written=written)
+        self.truth.write(json.dumps(rec) + "\n")
+        self.truth.flush()
+
+    def run(self, duration=None, report=10.0):
+        """Stream for duration seconds, forever if None, printing stats every report seconds.
+        Returns
+        -------
+        RealtimeStats
+        """
+        producer = threading.Thread(target=self.produce, daemon=True)
+        producer.start()
+        ### let the producer get ahead before the clock starts
+        while self.blocks.qsize() < self.ahead and producer.is_alive() and not self.stop.is_set():
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        wall = time.time()
+        nblocks = None if duration is None else int(np.ceil(duration / self.duration))
+        last_report = start
+        try:
+            while nblocks is None or self.stats.blocks < nblocks:
+                index = self.stats.blocks
+                due = start + (index + 1) * self.duration
+                now = time.monotonic()
+                if now < due:
+                    time.sleep(due - now)
+                underrun = self.blocks.empty()
+                while True:
+                    if self.error is not None:
+                        raise self.error
+                    try:
+                        _, data, bursts = self.blocks.get(timeout=0.1)
+                        break
+                    except queue.Empty:
+                        continue
+                now = time.monotonic()
+                lag = max(0.0, now - due)
+                dropped = lag > self.max_lag
+                if not dropped:
+                    self.sink.writeblock(data)
+                    self.sink.flush()
+                written = None if dropped else wall + (time.monotonic() - start)
+                for burst in bursts:
+                    self.log(burst, written, wall)
+                self.stats.update(lag, dropped, underrun, self.blocks.qsize())
+
+                if report and now - last_report >= report:
+                    console.print(self.stats.report(), soft_wrap=True)
+                    last_report = now
+        finally:
+            self.stop.set()
+            producer.join(timeout=5)
+        return self.stats
+
+
+def main():
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='Stream simulated bursts at the instrument data rate to a live search pipeline.', formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--stream', type=str, default='-', help='sink: -, fifo:PATH, tcp:HOST:PORT or unix:PATH')
+    parser.add_argument('--duration', type=float, default=None, help='run time (s), runs until interrupted if not set')
+    parser.add_argument('--nchan', type=int, default=336, help='number of channels')
+    parser.add_argument('--tsamp', type=float, default=1, help='time resolution (ms)')
+    parser.add_argument('--fch1', type=float, default=1100, help='first channel center freq (MHz)')
+    parser.add_argument('--bwchan', type=float, default=1, help='channel bandwidth (MHz)')
+    parser.add_argument('-t', '--tbin', type=int, default=10, help='time samples per bin during simulation')
+    parser.add_argument('-f', '--fbin', type=int, default=10, help='freq channels per bin during simulation')
+    parser.add_argument('--block', type=int, default=1024, help='samples per block')
+    parser.add_argument('--ahead', type=int, default=8, help='blocks generated ahead of wall-clock time')
+    parser.add_argument('--max_lag', type=float, default=None, help='lag (s) beyond which blocks are dropped, the time of --ahead blocks if not set')
+    parser.add_argument('--rate', type=float, default=None, help='mean Poisson burst rate (per second)')
+    parser.add_argument('--interval', type=float, default=None, help='fixed time between bursts (s)')
+    parser.add_argument('--dm', type=str, default='0', help='burst DM (pc cm-3): a number or const:a, normal:mean,std, lognormal:mu,sigma, uniform:lo,hi')
+    parser.add_argument('--width', type=str, default='1', help='burst gaussian width (ms), same syntax as --dm')
+    parser.add_argument('--snr', type=str, default='20', help='burst optimal S/N, same syntax as --dm')
+    parser.add_argument('-m', '--mode', type=str, default='single', help='Injection modes: single, scat, boxcar')
+    parser.add_argument('--cache_dir', type=str, default=None, help='burst template cache directory, no caching if not set')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the noise and the burst schedule')
+    parser.add_argument('--truth', type=str, default=None, help='JSON-lines burst log with the wall-clock time of each burst')
+    parser.add_argument('--report', type=float, default=10, help='seconds between lag and drop reports')
+    values = parser.parse_args()
+
+    if values.rate is not None and values.interval is not None:
+        parser.error("--rate and --interval are exclusive")
+    if values.stream in ('-', 'stdout'):
+        ### keep the filterbank stream on stdout clean
+        console.stderr = True
+
+    model = Spectra(fch1=values.fch1, nchan=values.nchan, bwchan=values.bwchan, tsamp=values.tsamp,
+                    tbin=values.tbin, fbin=values.fbin)
+    burst = None
+    if values.cache_dir:
+        from functools import partial
+        from simpulse.sim.cache import TemplateCache
+        burst = partial(TemplateCache(values.cache_dir).burst, model)
+
+    rate = values.nchan * model.nbits / 8 / (values.tsamp / 1000.0)
+    console.print(f"[bold magenta]streaming[/] to {values.stream} at {rate / 2**20:.2f} MB/s, "
+                  f"{values.block} samples per block")
+    sink = streamfilterbank(values.stream, model.header)
+    truth = open(values.truth, 'a') if values.truth else None
+    stream = RealtimeStream(model, sink, block=values.block, ahead=values.ahead, rate=values.rate,
+                            interval=values.interval, dm=values.dm, width=values.width, snr=values.snr,
+                            mode=values.mode, max_lag=values.max_lag, seed=values.seed, truth=truth,
+                            burst=burst)
+    try:
+        stream.run(values.duration, report=values.report)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        if truth is not None:
+            truth.close()
+        try:
+            sink.close()
+        except BrokenPipeError:
+            pass
+    console.print(f"[bold green]Finished[/]: {stream.stats.report()}", soft_wrap=True)
+
+
+if __name__ == '__main__':
+    main()
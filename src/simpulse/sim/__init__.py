@@ -1,5 +1,11 @@
 # src/simpulse/sim/__init__.py
-
-from .model import Spectra, TimeSeries, fgrid
+### the model classes load on first use, so importing a submodule stays cheap
 
 __all__ = ["Spectra", "TimeSeries", "fgrid"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import model
+        return getattr(model, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
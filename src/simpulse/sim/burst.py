@@ -2,18 +2,40 @@
 
 import numpy as np
 import math as m
-from scipy.signal import convolve
+from simpulse.profiling import stage
+from . import kernels
+from .parallel import map_blocks
 
-def dedisperse(dynamic_spectrum, dm, vif, fch1, tsamp):
-    """Basic brute-force dedispersion."""
-    out = np.zeros_like(dynamic_spectrum)
+def dedisperse(dynamic_spectrum, dm, vif, fch1, tsamp, threads=1):
+    """Basic brute-force dedispersion, with blocks of channels shifted on a pool of threads threads."""
     nchan = dynamic_spectrum.shape[1]
+    shifts = np.zeros(nchan, dtype=np.int64)
 
     for i in range(nchan):
         delay = tidm(dm, vif[i], fch1)
-        shift = int(delay / tsamp)
-        out[:, i] = np.roll(dynamic_spectrum[:, i], -shift)
+        shifts[i] = -int(delay / tsamp)
 
+    out = np.empty_like(dynamic_spectrum)
+
+    def roll(lo, hi):
+        ### looked up on the thread that runs it, see kernels.compiled
+        kernels.dispatch("roll_channels", roll_channels)(dynamic_spectrum[:, lo:hi], shifts[lo:hi], out[:, lo:hi])
+
+    map_blocks(roll, nchan, threads)
+    return out
+
+def roll_channels(array, shifts, out=None):
+    """Roll each channel (column) of array by its own number of samples, like np.roll."""
+    if out is None:
+        out = np.zeros_like(array)
+    for i in range(array.shape[1]):
+        out[:, i] = np.roll(array[:, i], shifts[i])
+    return out
+
+def gaussian_rows(out, time, tstarts, width, A):
+    """Fill row r of out with single_pulse_smear(time, tstarts[r], width, A)."""
+    for r in range(len(tstarts)):
+        out[r] = single_pulse_smear(time, tstarts[r], width, A)
     return out
 
 def boxcar_func(t, t0, a, width):
@@ -47,67 +69,85 @@ class BurstMixin:
             This sets the length of the array. Must be long enough for the dispersion track.
         A : float
             This is now the channel amplitude of the pulse with whichever mode, this parameter decides the injected value of the boxcar.
-        """
-
-        self.dm=dm
-        self.width=width
-        self.nsamp=nsamp
-        tif=np.zeros((self.nchan*self.fbin,nsamp))
-        tif2=np.zeros((self.nchan*self.fbin,nsamp))
-        self.t0=t0
-
-        if bandfrac is None:
-            bandfrac = np.ones(self.nchan)
-
-        ### time grid
-        time = np.arange(nsamp) * self.tsamp
-
-        ### compute frequency grid
-        fgrid = self.vif.repeat(self.fbin)
-
-        ### base arrays
-        base = np.zeros((self.nchan*self.fbin, nsamp))
-        ded = np.zeros((self.nchan*self.fbin, nsamp))
-
-        ### injection loop
-        for i in range(self.nchan*self.fbin):
-
-            ### DM and drift delays
-            tstart = (t0
-                      + tidm(dm+dmoff, fgrid[i], self.fch1)
-                      + pdrift(drift, fgrid[i], self.fch1)
-                      + offset)
-
-            ### scattering
-            if kscat:
-                tscat = tau * (fgrid[i]/1000)**(-alpha)
-
-            ### choose shape
-            if mode == "boxcar":
-                pulse = boxcar_func(time, tstart, A, width)
-            elif mode == "scat":
-                pulse = scat_pulse_smear(time, tstart, width, A, tscat)
-            elif mode == "single":
-                pulse = single_pulse_smear(time, tstart, width, A)
-            else:
-                raise ValueError("Unknown mode {}".format(mode))
 
-            base[i] = pulse
+        The pulse of each sub-channel is evaluated in float64 and stored in the model dtype, so a float32
+        burst differs from the float64 one by the rounding of its values only.
+        """
 
-        ### Band fraction scaling
-        ### reshape from (nchan*fbin, nsamp) to (nchan, fbin, nsamp)
-        base = base.reshape(self.nchan, self.fbin, nsamp)
-        base = base * bandfrac[:,None,None]
-        base = base.reshape(self.nchan*self.fbin, nsamp)
+        with stage("burst"):
+            self.dm=dm
+            self.width=width
+            self.nsamp=nsamp
+            self.t0=t0
 
-        self.burst_original = base.reshape(self.nchan, self.fbin, nsamp).mean(1).T * bandfrac
+            if bandfrac is None:
+                bandfrac = np.ones(self.nchan, dtype=self.dtype)
+            else:
+                bandfrac = np.asarray(bandfrac).astype(self.dtype, copy=False)
+
+            ### time grid
+            time = np.arange(nsamp) * self.tsamp
+
+            ### compute frequency grid
+            fgrid = self.vif.repeat(self.fbin)
+
+            ### channels synthesised at once, each with its fbin sub-channels
+            batch = self.memory_plan(nsamp).burst_channels
+            base = np.zeros((batch*self.fbin, nsamp), dtype=self.dtype)
+            original = np.empty((nsamp, self.nchan), dtype=self.dtype, order="F")
+
+            def synthesise(c0, lo, hi):
+                ### channels [lo, hi) of the batch starting at channel c0, held in base from row (lo - c0)*fbin
+                rows = base[(lo - c0)*self.fbin:(hi - c0)*self.fbin]
+
+                ### DM and drift delays
+                tstarts = [t0
+                           + tidm(dm+dmoff, fgrid[i], self.fch1)
+                           + pdrift(drift, fgrid[i], self.fch1)
+                           + offset
+                           for i in range(lo*self.fbin, hi*self.fbin)]
+
+                if mode == "single":
+                    kernels.dispatch("gaussian_rows", gaussian_rows)(rows, time, tstarts, width, A)
+                else:
+                    ### injection loop
+                    for i in range(lo*self.fbin, hi*self.fbin):
+                        tstart = tstarts[i - lo*self.fbin]
+
+                        ### scattering
+                        if kscat:
+                            tscat = tau * (fgrid[i]/1000)**(-alpha)
+
+                        ### choose shape
+                        if mode == "boxcar":
+                            pulse = boxcar_func(time, tstart, A, width)
+                        elif mode == "scat":
+                            pulse = scat_pulse_smear(time, tstart, width, A, tscat)
+                        else:
+                            raise ValueError("Unknown mode {}".format(mode))
+
+                        rows[i - lo*self.fbin] = pulse
+
+                ### Band fraction scaling
+                ### reshape from (channels*fbin, nsamp) to (channels, fbin, nsamp) and average the sub-channels
+                block = rows.reshape(hi - lo, self.fbin, nsamp)
+                original[:, lo:hi] = (block * bandfrac[lo:hi,None,None]).mean(1).T * bandfrac[lo:hi]
+
+            ### batches bound the memory, the channel blocks of a batch run on the threads
+            for c0 in range(0, self.nchan, batch):
+                c1 = min(c0 + batch, self.nchan)
+                map_blocks(lambda lo, hi: synthesise(c0, c0 + lo, c0 + hi), c1 - c0, self.threads)
+
+            self.burst_original = original
 
         ### dedisperse
-        self.burst_dedispersed = dedisperse(self.burst_original,
-                                            dm=self.dm,
-                                            vif=self.vif,
-                                            fch1=self.fch1,
-                                            tsamp=self.tsamp)
+        with stage("dedisperse"):
+            self.burst_dedispersed = dedisperse(self.burst_original,
+                                                dm=self.dm,
+                                                vif=self.vif,
+                                                fch1=self.fch1,
+                                                tsamp=self.tsamp,
+                                                threads=self.threads)
         return self.burst_original, self.burst_dedispersed
 
 def single_pulse_smear(t, t0, width, A):
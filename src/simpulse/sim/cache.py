@@ -0,0 +1,149 @@
+# sim/cache.py
+"""
+On-disk cache of clean burst templates.
+
+Spectra.burst is the slow step of a simpulse campaign, and nightly runs
+repeat the same grid. A template is keyed by a hash of every physical and
+instrument parameter it depends on. It is stored sparsely: each channel keeps
+only the samples between its first and last nonzero value. Values are
+uncompressed .npy files loaded with memory mapping. The cache is bounded in
+size, and the least recently used templates are evicted first.
+"""
+
+import hashlib
+import inspect
+import os
+
+import numpy as np
+
+from simpulse.profiling import stage
+
+### bump when the burst model changes so stale templates are not reused
+CACHE_VERSION = 1
+
+
+def sparse_channels(array):
+    """Per-channel [start, stop) of the nonzero samples of a (nsamp, nchan) array and their values."""
+    nz = array != 0
+    anynz = nz.any(axis=0)
+    start = np.where(anynz, nz.argmax(axis=0), 0)
+    stop = np.where(anynz, array.shape[0] - nz[::-1].argmax(axis=0), 0)
+    values = np.concatenate([array[start[c]:stop[c], c] for c in range(array.shape[1])])
+    return np.stack([start, stop]), values
+
+
+def dense_channels(index, values, nsamp):
+    """Inverse of sparse_channels, channel-major like the arrays Spectra.burst returns
+    so that reductions over them round identically."""
+    start, stop = index
+    out = np.zeros((nsamp, index.shape[1]), dtype=values.dtype, order="F")
+    offsets = np.concatenate(([0], np.cumsum(stop - start)))
+    for c in range(index.shape[1]):
+        out[start[c]:stop[c], c] = values[offsets[c]:offsets[c + 1]]
+    return out
+
+
+class TemplateCache:
+    def __init__(self, cache_dir, max_mb=1024):
+        """Burst template cache in cache_dir, holding at most max_mb of templates.
+        Parameters
+        ----------
+        cache_dir : string
+            cache directory, created if missing
+        max_mb : float
+            size bound (MB), the least recently used templates are evicted beyond it
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 2 ** 20
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, model, params):
+        """Content hash of the instrument setup of model and the full burst parameters."""
+        params = dict(params, version=CACHE_VERSION, fch1=model.fch1, nchan=model.nchan,
+                      bwchan=model.bwchan, tsamp=model.tsamp, fbin=model.fbin, tbin=model.tbin)
+        ### float64 keys are unchanged from before the dtype option, so existing caches stay valid
+        if model.dtype != np.float64:
+            params["dtype"] = model.dtype.str
+        items = []
+        for k, v in sorted(params.items()):
+            if isinstance(v, np.ndarray):
+                v = (v.shape, hashlib.sha1(np.ascontiguousarray(v).tobytes()).hexdigest())
+            items.append((k, repr(v)))
+        return hashlib.sha1(repr(items).encode()).hexdigest()
+
+    def _files(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return [base + suffix for suffix in (".idx.npy", ".orig.npy", ".ded.npy")]
+
+    def load(self, key, nsamp):
+        """Dense (original, dedispersed) templates of key, None on a miss."""
+        files = self._files(key)
+        if not all(os.path.exists(f) for f in files):
+            return None
+        try:
+            index = np.load(files[0])
+            orig = dense_channels(index[:2], np.load(files[1], mmap_mode="r"), nsamp)
+            ded = dense_channels(index[2:], np.load(files[2], mmap_mode="r"), nsamp)
+        except (OSError, ValueError):
+            return None
+        for f in files:
+            os.utime(f)
+        return orig, ded
+
+    def store(self, key, orig, ded):
+        """Write the templates of key and evict old entries beyond the size bound."""
+        files = self._files(key)
+        index1, values1 = sparse_channels(orig)
+        index2, values2 = sparse_channels(ded)
+        tmp = [f + ".{}.tmp".format(os.getpid()) for f in files]
+        for f, array in zip(tmp, (np.concatenate([index1, index2]), values1, values2)):
+            with open(f, "wb") as fout:
+                np.save(fout, array)
+        ### index last, a template only counts as present once all its files are in place
+        for t, f in list(zip(tmp, files))[::-1]:
+            os.replace(t, f)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used templates until the cache fits in max_mb."""
+        entries = {}
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            st = os.stat(path)
+            key = name.split(".")[0]
+            size, atime = entries.get(key, (0, 0))
+            entries[key] = (size + st.st_size, max(atime, st.st_mtime))
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda e: e[1][1]):
+            if total <= self.max_bytes:
+                break
+            for f in self._files(key):
+                if os.path.exists(f):
+                    os.remove(f)
+            total -= size
+
+    def burst(self, model, **kwargs):
+        """Cached Spectra.burst: same arguments, sets the same attributes on model.
+        Returns
+        -------
+        burst_original, burst_dedispersed
+        """
+        bound = inspect.signature(model.burst).bind(**kwargs)
+        bound.apply_defaults()
+        params = bound.arguments
+        with stage("cache"):
+            key = self.key(model, params)
+            cached = self.load(key, params["nsamp"])
+            if cached is None:
+                orig, ded = model.burst(**kwargs)
+                self.store(key, orig, ded)
+                return orig, ded
+
+        model.dm = params["dm"]
+        model.width = params["width"]
+        model.nsamp = params["nsamp"]
+        model.t0 = params["t0"]
+        model.burst_original, model.burst_dedispersed = cached
+        return cached
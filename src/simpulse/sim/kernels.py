@@ -0,0 +1,240 @@
+# sim/kernels.py
+"""
+Optional Numba backend for the loop-shaped kernels of the simulator.
+
+The NumPy reference of every kernel stays next to the code that uses it:
+roll_channels and gaussian_rows in burst.py, scatter_pulses in periodic.py,
+quantize in noise.py, triangle_max and rolling_max in measurement.py. Those
+call sites go through dispatch(name, reference), which returns the compiled
+kernel of the same name when the numba backend is active and the reference
+otherwise. On the main thread the compiled kernels run in parallel over
+channels (or rows, start samples, widths) with prange. Other threads, such as
+the channel-block pool of parallel.py or the simpulse-realtime producer, get
+single-threaded builds of the same kernels: the workqueue threading layer
+aborts on concurrent launches, and TBB hangs at interpreter exit once a
+parallel kernel has run on a second Python thread.
+
+numba's default threading layer priority is kept, so TBB is used when it is
+installed and a process that has run kernels can still fork. Without TBB
+numba falls back to OpenMP, and GNU OpenMP aborts any child forked after a
+kernel has run. The process pools of the package (TrainingSet and the
+crossmatch pool) therefore start their workers with spawn.
+
+The backend is chosen on first use, so importing simpulse does not import
+numba. It is numba when numba imports and numpy otherwise, and the
+SIMPULSE_KERNELS environment variable (auto, numba or numpy) or
+set_backend() override it. Kernels compile on their first call and are
+cached on disk by numba.
+
+TOLERANCE holds the largest relative difference between a compiled kernel
+and its reference. 0 means the two are identical: they add the same values
+in the same order. gaussian_rows evaluates each pulse only within
+GAUSSIAN_CUTOFF sigma of its peak, on an increasing time grid, and differs
+by the last bits of exp. The boxcar searches use running sums instead of
+NumPy's pairwise sums.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+BACKENDS = ("numba", "numpy")
+
+### largest relative difference of each compiled kernel from its NumPy reference
+TOLERANCE = dict(roll_channels=0.0, scatter_pulses=0.0, quantize=0.0,
+                 gaussian_rows=1e-14, triangle_max=1e-12, rolling_max=1e-12)
+
+### gaussians are exactly 0 in float64 beyond 38.6 sigma, where exp(-x**2/2) underflows
+GAUSSIAN_CUTOFF = 40.0
+
+_backend = None
+_compiled = {}
+_lock = threading.Lock()
+
+
+def numba_available():
+    """True when numba imports."""
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def set_backend(name=None):
+    """Select the kernel backend: numba, numpy, or None (or auto) for numba when it imports.
+    Raises ImportError when numba is asked for but does not import."""
+    global _backend
+    if name in (None, "auto"):
+        name = "numba" if numba_available() else "numpy"
+    if name not in BACKENDS:
+        raise ValueError("kernel backend must be one of {}, not {}".format(BACKENDS, name))
+    if name == "numba" and not numba_available():
+        raise ImportError("the numba kernel backend needs numba, pip install simpulse[fast]")
+    _backend = name
+    return name
+
+
+def backend():
+    """Name of the active kernel backend, resolved from SIMPULSE_KERNELS on first use."""
+    if _backend is None:
+        return set_backend(os.environ.get("SIMPULSE_KERNELS") or None)
+    return _backend
+
+
+def dispatch(name, reference):
+    """Compiled kernel name under the numba backend, reference under numpy. Call it on the
+    thread that runs the kernel, which decides between the parallel and serial builds."""
+    if backend() == "numpy":
+        return reference
+    return compiled(name)
+
+
+def compiled(name, parallel=None):
+    """Compiled kernel name, built on first request. The parallel build is used on the main
+    thread and the single-threaded one elsewhere, unless parallel says otherwise."""
+    if parallel is None:
+        parallel = threading.current_thread() is threading.main_thread()
+    with _lock:
+        if parallel not in _compiled:
+            _compiled[parallel] = _build(parallel)
+    return _compiled[parallel][name]
+
+
+def _build(parallel=True):
+    """JIT-compile the kernels; every wrapper takes the arguments of its NumPy reference."""
+    from numba import njit, prange
+
+    if not parallel:
+        ### prange is a closure variable of the kernels, so the serial builds also get their
+        ### own entries in numba's disk cache, whose key ignores the parallel flag
+        prange = range  # noqa: F811
+    ### nogil so that threads running kernels on different channel blocks overlap
+    jit = njit(parallel=parallel, nogil=True, cache=True)
+
+    @jit
+    def _roll_channels(array, shifts, out):
+        nsamp, nchan = array.shape
+        for c in prange(nchan):
+            s = shifts[c]
+            for j in range(nsamp):
+                k = j + s
+                if k >= nsamp:
+                    k -= nsamp
+                out[k, c] = array[j, c]
+
+    def roll_channels(array, shifts, out=None):
+        if out is None:
+            out = np.empty_like(array)
+        if array.shape[0]:
+            shifts = np.mod(np.asarray(shifts, dtype=np.int64), array.shape[0])
+            _roll_channels(array, shifts, out)
+        return out
+
+    @jit
+    def _gaussian_rows(out, time, tstarts, norm, var, amp, cutoff):
+        ### time is increasing, and the samples further than cutoff from the peak are exactly 0
+        for r in prange(tstarts.shape[0]):
+            t0 = tstarts[r]
+            lo = np.searchsorted(time, t0 - cutoff)
+            hi = np.searchsorted(time, t0 + cutoff, side="right")
+            out[r, :lo] = 0.0
+            out[r, hi:] = 0.0
+            for j in range(lo, hi):
+                d = time[j] - t0
+                out[r, j] = norm * np.exp(-1 / 2 * (d * d) / var) * amp
+
+    def gaussian_rows(out, time, tstarts, width, A):
+        norm = 1 / np.sqrt(np.pi * 2 * (width ** 2))
+        _gaussian_rows(out, np.asarray(time, dtype=np.float64), np.asarray(tstarts, dtype=np.float64),
+                       norm, width ** 2, A, GAUSSIAN_CUTOFF * abs(width))
+        return out
+
+    @jit
+    def _scatter_pulses(out, arrivals_ms, delays_ms, templates, tidx, amps, half, tsamp_ms, start):
+        nsamp, nchan = out.shape
+        oversample = templates.shape[1]
+        for c in prange(nchan):
+            for p in range(arrivals_ms.shape[0]):
+                pos = (arrivals_ms[p] + delays_ms[c]) / tsamp_ms - start
+                i0 = np.floor(pos)
+                k = np.int64(np.rint((pos - i0) * oversample))
+                if k == oversample:
+                    i0 += 1
+                    k = 0
+                first = np.int64(i0) - half
+                for s in range(2 * half + 1):
+                    j = first + s
+                    if j >= 0 and j < nsamp:
+                        out[j, c] += templates[tidx[p], k, s] * amps[p]
+
+    def scatter_pulses(out, arrivals_ms, delays_ms, templates, half, tsamp_ms, start, amps, tidx,
+                       batch_elements=None):
+        ### adds in place without temporaries, so batch_elements does not apply
+        if amps is None:
+            amps = np.ones(arrivals_ms.size)
+        _scatter_pulses(out, arrivals_ms, delays_ms, templates, tidx,
+                        np.asarray(amps, dtype=np.float64), half, float(tsamp_ms), start)
+        return out
+
+    @jit
+    def _quantize(flat, out):
+        for i in prange(flat.shape[0]):
+            v = flat[i]
+            if v < 0:
+                v = 0
+            elif v > 255:
+                v = 255
+            out[i] = np.uint8(v)
+
+    def quantize(array):
+        array = np.ascontiguousarray(array)
+        out = np.empty(array.shape, dtype=np.uint8)
+        _quantize(array.reshape(-1), out.reshape(-1))
+        return out
+
+    @jit
+    def _triangle_max(fs):
+        n = fs.shape[0]
+        best = np.full(n, -np.inf)
+        for i in prange(n):
+            s = 0.0
+            for j in range(i + 1, n):
+                s += abs(fs[j - 1])
+                x = s / np.sqrt(j - i)
+                if x > best[i]:
+                    best[i] = x
+        return best.max()
+
+    def triangle_max(fs):
+        fs = np.asarray(fs, dtype=np.float64)
+        if fs.size < 2:
+            raise ValueError("triangle_max needs at least 2 samples")
+        return _triangle_max(fs)
+
+    @jit
+    def _rolling_max(fs):
+        n = fs.shape[0]
+        cs = np.zeros(n + 1)
+        for i in range(n):
+            cs[i + 1] = cs[i] + fs[i]
+        best = np.zeros(max(n, 1))
+        for w in prange(1, n):
+            off = (w - 1) // 2
+            top = -np.inf
+            for m in range(n):
+                k = m + off
+                lo = max(0, k - w + 1)
+                hi = min(k, n - 1)
+                x = (cs[hi + 1] - cs[lo]) / w
+                if x > top:
+                    top = x
+            best[w] = top
+        return best.max()
+
+    def rolling_max(fs):
+        return _rolling_max(np.asarray(fs, dtype=np.float64))
+
+    return dict(roll_channels=roll_channels, gaussian_rows=gaussian_rows, scatter_pulses=scatter_pulses,
+                quantize=quantize, triangle_max=triangle_max, rolling_max=rolling_max)
@@ -0,0 +1,113 @@
+# sim/manifest.py
+"""
+Campaign manifest for resumable simpulse runs.
+
+A JSON-lines file: the first line records the campaign parameters and every
+later line one completed (width, DM) cell, with its file, size, checksum and
+truth rows. A line is appended only after the cell's filterbank has been
+closed, so a run that dies mid-cell leaves no record of it. A resumed run
+skips the cells whose files still match, and regenerates everything else.
+"""
+
+import hashlib
+import json
+import os
+
+
+def file_checksum(filename, blocksize=1 << 20):
+    """sha1 of a file, read in blocks"""
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _jsonable(value):
+    """plain python value of a numpy scalar"""
+    return value.item() if hasattr(value, "item") else value
+
+
+def _ends_with_newline(filename):
+    """False when the last line of a non-empty file was cut short"""
+    with open(filename, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class Manifest:
+    def __init__(self, filename, params, resume=False):
+        """Open a campaign manifest.
+        Parameters
+        ----------
+        filename : string
+            JSON-lines manifest
+        params : dict
+            campaign parameters, a resumed campaign must match them. A seed of None is
+            taken from the manifest.
+        resume : bool
+            keep the cells already recorded in filename, otherwise start a new manifest
+        """
+        self.filename = filename
+        self.params = dict(params)
+        self.done = {}
+        stored = None
+        if resume and os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        ### a line cut short by the interrupted run
+                        continue
+                    if "campaign" in rec:
+                        stored = rec["campaign"]
+                    else:
+                        self.done[tuple(rec["cell"])] = rec
+
+        if stored is None:
+            self.fout = open(filename, "w")
+            self._write({"campaign": {k: _jsonable(v) for k, v in self.params.items()}})
+            return
+
+        for key, value in self.params.items():
+            if key == "seed" and value is None:
+                continue
+            if stored.get(key) != _jsonable(value):
+                raise ValueError("Cannot resume {}: {} was {}, now {}".format(
+                    filename, key, stored.get(key), value))
+        self.params = stored
+        self.fout = open(filename, "a")
+        if not _ends_with_newline(filename):
+            self.fout.write("\n")
+
+    def _write(self, rec):
+        self.fout.write(json.dumps(rec) + "\n")
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+
+    def completed(self, cell):
+        """Truth rows of a recorded cell whose file is unchanged, None if it has to be (re)generated."""
+        rec = self.done.get(tuple(cell))
+        if rec is None:
+            return None
+        filename = rec["file"]
+        if not os.path.exists(filename) or os.path.getsize(filename) != rec["size"]:
+            return None
+        if file_checksum(filename) != rec["sha1"]:
+            return None
+        return rec["truth"]
+
+    def record(self, cell, filename, rows):
+        """Append a completed cell once its file is closed."""
+        rows = [{k: _jsonable(v) for k, v in row.items()} for row in rows]
+        rec = {"cell": list(cell), "file": filename, "size": os.path.getsize(filename),
+               "sha1": file_checksum(filename), "truth": rows}
+        self.done[tuple(cell)] = rec
+        self._write(rec)
+
+    def close(self):
+        self.fout.close()
@@ -2,6 +2,8 @@
 
 import numpy as np
 import math as m
+from simpulse.profiling import stage
+from . import kernels
 
 
 class MeasurementMixin:
@@ -13,18 +15,27 @@ class MeasurementMixin:
     def write_snr(self):
         """Harry's fscrunch and L2 snr script"""
         base2 = self.burst_dedispersed
-        quadsn = L2_clean(base2)
+        with stage("measure"):
+            quadsn = L2_clean(base2)
         fwhm = (m.sqrt(8.0 * m.log(2.0))) * self.width
         return f"{self.dm};{self.width};{fwhm};{quadsn}\n", quadsn
 
     def write_flux(self):
         """Compute L2_flux of the dedispersed burst."""
         base2 = self.burst_dedispersed
-        flux = L2_flux(base2)
+        with stage("measure"):
+            flux = L2_flux(base2)
         return flux
 
+def compute_dtype(array):
+    """float32 for float32 arrays, float64 otherwise"""
+    return np.dtype(np.float32 if array.dtype == np.float32 else np.float64)
+
+
 def simulate(array, std=18, base=127, outtype=np.uint8):
-    bkg = np.random.randn(array.shape[0], array.shape[1]) * std + base
+    """array plus white noise, computed in the precision of array and cast to outtype"""
+    dtype = compute_dtype(array)
+    bkg = np.random.randn(array.shape[0], array.shape[1]).astype(dtype, copy=False) * dtype.type(std) + dtype.type(base)
     imprint = (bkg + array).astype(outtype)
     return imprint
 
@@ -52,10 +63,36 @@ def fscrunch(array, prepost=2000):
     return fscr * mask
 
 
-def L2_snr(base2):
-    """Harry's fscrunch and L2 snr script"""
-    simdata = simulate(base2, outtype=np.float64)  # base2 is the clean burst array
-    fscrunched = np.sum((simdata.astype(np.float64)), axis=0)
+def simulated_fscrunch(base2, rows):
+    """Channel sums of simulate(base2), simulated rows samples at a time.
+    Each chunk is added on top of the running sum row by row, in the order np.sum(axis=0) takes
+    over the whole block, and the noise is drawn in the same order, so the result is identical."""
+    nsamp, nchan = base2.shape
+    buf = np.empty((rows + 1, nchan))
+    fscrunched = None
+    for lo in range(0, nsamp, rows):
+        simdata = simulate(base2[lo:lo + rows], outtype=compute_dtype(base2))
+        if fscrunched is None:
+            fscrunched = np.sum(simdata, axis=0, dtype=np.float64)
+            continue
+        n = simdata.shape[0] + 1
+        buf[0] = fscrunched
+        buf[1:n] = simdata
+        fscrunched = np.sum(buf[:n], axis=0)
+    return fscrunched
+
+
+def L2_snr(base2, rows=None):
+    """Harry's fscrunch and L2 snr script
+    rows : int
+        samples simulated at once to bound the memory, None for the whole block. The result does not depend on it.
+    The noisy block is simulated in the precision of base2 and summed in float64.
+    """
+    if rows is None or rows >= base2.shape[0]:
+        simdata = simulate(base2, outtype=compute_dtype(base2))  # base2 is the clean burst array
+        fscrunched = np.sum(simdata, axis=0, dtype=np.float64)
+    else:
+        fscrunched = simulated_fscrunch(base2, rows)
     fscrun_mean = np.mean(fscrunched)
     fscrun_median = np.median(fscrunched)
     fscrun_mad = np.median(np.abs(fscrunched - fscrun_mean))  ##use MAD
@@ -70,16 +107,15 @@ def L2_snr(base2):
 def L2_clean(base2):
     """Harry's fscrunch and L2 snr script with no noise, assume rms/std is 1"""
     ydata = base2  # base2 is the clean burst array
-    fscrunched = np.mean((ydata.astype(np.float64)), axis=0)
+    fscrunched = np.mean(ydata, axis=0, dtype=np.float64)
     mask = np.mean(base2, axis=0) > 0  # find where pulse is after fscrunch
     sf = fscrunched[mask]
     quadsn = (np.sum(sf ** 2) ** 0.5)
     return quadsn
 
 
-def triangle_snr(base2):
-    ## triangle method snr
-    fscrunched = np.sum(base2, axis=0)
+def triangle_max(fscrunched):
+    """Largest sum(|fscrunched[i:j]|) / sqrt(j - i) over 0 <= i < j < len(fscrunched)"""
     slen = len(fscrunched)
     arr = []
 
@@ -92,24 +128,20 @@ def triangle_snr(base2):
     return np.max(arr)
 
 
+def triangle_snr(base2):
+    ## triangle method snr
+    fscrunched = np.sum(base2, axis=0)
+    return kernels.dispatch("triangle_max", triangle_max)(fscrunched)
+
+
 def triangle_clean(base2):
     ## triangle method clean snr
     fscrunched = np.mean(base2, axis=0)
-    slen = len(fscrunched)
-    arr = []
+    return kernels.dispatch("triangle_max", triangle_max)(fscrunched)
 
-    for i in range(slen):
-        for j in range(i + 1, slen):
-            tri = fscrunched[i:j]
-            x = np.sum(np.abs(tri)) / np.sqrt(len(tri))
-            arr.append(x)
 
-    return np.max(arr)
-
-
-def rollingbox(base2):
-    """rolling boxcar filter"""
-    fs = np.sum(base2, axis=0)
+def rolling_max(fs):
+    """Largest value of fs smoothed by a centred boxcar of any width from 1 to len(fs) - 1, at least 0"""
     l = len(fs)
     best = 0
 
@@ -122,10 +154,16 @@ def rollingbox(base2):
     return best
 
 
+def rollingbox(base2):
+    """rolling boxcar filter"""
+    fs = np.sum(base2, axis=0)
+    return kernels.dispatch("rolling_max", rolling_max)(fs)
+
+
 def L2_flux(base2):
     """Harry's fscrunch and L2 snr script with no noise, assume rms/std is 1"""
     ydata = base2  # base2 is the clean burst array
-    fscrunched = np.mean((ydata.astype(np.float64)), axis=0)
+    fscrunched = np.mean(ydata, axis=0, dtype=np.float64)
     mask = np.mean(base2, axis=0) > 0  # find where pulse is after fscrunch
     sf = fscrunched[mask]
     flux = np.sum(sf)
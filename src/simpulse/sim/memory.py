@@ -0,0 +1,132 @@
+# sim/memory.py
+"""
+Memory planning for burst synthesis and filterbank output.
+
+A simpulse cell holds a few (nsamp, nchan) float arrays for its whole
+length: the original and dedispersed bursts, and the scaled copy passed to
+the injection or measurement. Everything else can be done in pieces:
+burst synthesis in batches of channels, each with its fbin sub-channels,
+and noise, quantization and writing in chunks of samples or channels.
+MemoryPlan fits those pieces into what the held arrays leave of a budget.
+The chunking does not change the output: the noise is drawn in the same
+order and the reductions add in the same order. Sizes are per element of the
+compute dtype, 8 bytes for float64 and 4 for float32.
+
+StreamPlan does the same for simperiod, which holds nothing across the file:
+chunks of samples, and the scatter-add batches that place pulses in them.
+"""
+
+from .parallel import channel_blocks
+from .periodic import BATCH_ELEMENTS, SCATTER_BYTES
+
+FLOAT = 8
+
+### (nsamp, nchan) float arrays held through a simpulse cell
+HELD_ARRAYS = 3
+
+### float temporaries per element of a burst batch: the sub-channel pulses and their band-scaled copy
+BURST_TEMPORARIES = 2
+
+### float temporaries per element of a row chunk: noise, scaled burst and their sum
+CHUNK_ARRAYS = 3
+
+
+def chunk_bytes(itemsize=FLOAT):
+    """Bytes per element of a row chunk: the float temporaries and the uint8 block, plus the
+    float64 noise draw when it is cast down to a narrower dtype."""
+    return CHUNK_ARRAYS * itemsize + 1 + (FLOAT if itemsize < FLOAT else 0)
+
+
+class MemoryPlan:
+    def __init__(self, nchan, fbin, nsamp, max_memory=None, itemsize=FLOAT):
+        """Batch and chunk sizes that keep one cell inside max_memory.
+        Parameters
+        ----------
+        nchan, fbin : int
+            channels, and sub-channels per channel during synthesis
+        nsamp : int
+            samples of the burst block
+        max_memory : float
+            budget for the simulation arrays (MB), None for no limit: whole-band batches and blocks
+        itemsize : int
+            bytes per element of the compute dtype
+
+        Raises
+        ------
+        MemoryError
+            when the held arrays plus the smallest batch and chunk do not fit
+        """
+        self.nchan = nchan
+        self.fbin = fbin
+        self.nsamp = nsamp
+        self.max_memory = max_memory
+        self.held = HELD_ARRAYS * nsamp * nchan * itemsize
+        burst_row = BURST_TEMPORARIES * fbin * nsamp * itemsize
+        sample_row = chunk_bytes(itemsize) * nchan
+        noise_chan = chunk_bytes(itemsize) * nsamp
+
+        if max_memory is None:
+            self.burst_channels = nchan
+            self.rows = nsamp
+            self.noise_channels = nchan
+        else:
+            free = max_memory * 2 ** 20 - self.held
+            minimum = self.held + max(burst_row, sample_row, noise_chan)
+            if free < max(burst_row, sample_row, noise_chan):
+                raise MemoryError("{} channels x {} samples need at least {:.0f} MB, the budget is {} MB".format(
+                    nchan, nsamp, minimum / 2 ** 20, max_memory))
+            self.burst_channels = int(min(nchan, free // burst_row))
+            self.rows = int(min(nsamp, free // sample_row))
+            self.noise_channels = int(min(nchan, free // noise_chan))
+
+        self.peak = self.held + max(self.burst_channels * burst_row, self.rows * sample_row,
+                                    self.noise_channels * noise_chan)
+
+    def describe(self):
+        return ("bursts in batches of {} channels, I/O in chunks of {} samples / {} channels, "
+                "planned peak {:.0f} MB{}").format(
+                    self.burst_channels, self.rows, self.noise_channels, self.peak / 2 ** 20,
+                    "" if self.max_memory is None else " of {} MB".format(self.max_memory))
+
+
+class StreamPlan:
+    def __init__(self, nchan, nsamp, window, max_memory, itemsize=FLOAT, threads=1):
+        """Chunk and scatter-add batch sizes that keep a streamed periodic run inside max_memory.
+        Parameters
+        ----------
+        nchan, nsamp : int
+            channels and samples of the file
+        window : int
+            samples of one pulse template
+        max_memory : float
+            budget (MB)
+        itemsize : int
+            bytes per element of the compute dtype
+        threads : int
+            threads placing pulses, each block of channels gets its own batch
+
+        Raises
+        ------
+        MemoryError
+            when one sample of every channel plus one pulse per block do not fit
+        """
+        self.nchan = nchan
+        self.max_memory = max_memory
+        blocks = channel_blocks(nchan, threads)
+        budget = max_memory * 2 ** 20
+        sample_row = chunk_bytes(itemsize) * nchan
+        ### one pulse across the widest block is the smallest useful batch
+        smallest = max(hi - lo for lo, hi in blocks) * window
+        if budget < sample_row + len(blocks) * smallest * SCATTER_BYTES:
+            raise MemoryError("{} channels with a {} sample window need at least {:.1f} MB, the budget is {} MB".format(
+                nchan, window, (sample_row + len(blocks) * smallest * SCATTER_BYTES) / 2 ** 20, max_memory))
+        ### the scatter-add batches get at most a quarter of the budget, the chunk the rest
+        per_block = min(BATCH_ELEMENTS, int(budget / 4 / len(blocks) / SCATTER_BYTES))
+        self.batch_elements = max(smallest, per_block)
+        scatter = len(blocks) * self.batch_elements * SCATTER_BYTES
+        self.rows = int(min(nsamp, (budget - scatter) // sample_row))
+        self.peak = scatter + self.rows * sample_row
+
+    def describe(self):
+        return "chunks of {} samples, scatter-add batches of {} elements, planned peak {:.0f} MB of {} MB".format(
+            self.rows, self.batch_elements, self.peak / 2 ** 20, self.max_memory)
@@ -1,16 +1,34 @@
 # sim/model.py
-import matplotlib.pyplot as plt
 import numpy as np
 import math as m
+import time
 from simpulse.io.fbio import makefilterbank
-from scipy.signal import convolve
-from astropy.time import Time
+from simpulse.profiling import stage
+from .memory import MemoryPlan
+from .parallel import map_blocks
 
 # Import mixins (implemented in other files)
 from .noise import NoiseMixin
 from .burst import BurstMixin
 from .measurement import MeasurementMixin
 
+### MJD of the unix epoch, 1970-01-01
+MJD_UNIX_EPOCH = 40587.0
+
+
+def mjd_now():
+    """Current UTC as an MJD, without the import cost of astropy.time"""
+    return time.time() / 86400.0 + MJD_UNIX_EPOCH
+
+
+def float_dtype(dtype):
+    """Compute dtype of the simulation arrays, float32 or float64"""
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError("dtype must be float32 or float64, not {}".format(dtype))
+    return dtype
+
+
 def freq_splitter_idx(n, skip, end, bwchan, fch1):
     ### generates the frequency of channels and then group them into subbands, 
     ### also returns an array that records the channel numbers of each subband
@@ -24,7 +42,7 @@ def freq_splitter_idx(n, skip, end, bwchan, fch1):
 
 
 class TimeSeries:
-    def __init__(self, tsamp=1, nsamp=1000, bins=10):
+    def __init__(self, tsamp=1, nsamp=1000, bins=10, dtype=np.float64):
         """initiate function for creating a mock time series. This sets up the frequency.
         Parameters
         ----------
@@ -34,6 +52,9 @@ class TimeSeries:
             This sets the length of the array. Must be long enough for scattering tail and dispersion track
         bins : int
             grid resolution of the array,
+        dtype : numpy dtype
+            float32 or float64 grids. The times are computed in float64 and rounded once, so a
+            float32 grid is within 6e-8 of its value relative to nsamp * tsamp.
         """
         # self.fch=fch
         # self.bwchan=bwchan
@@ -43,8 +64,9 @@ class TimeSeries:
         matrix = np.ones((nsamp, bins)) * np.linspace(-0.5, 0.5, bins) * tsamp
         timematrix = (np.ones((nsamp, bins)).T * time).T
         finergrid = (matrix + timematrix).flatten()
-        self.grid = finergrid
-        self.x_time = time
+        self.dtype = float_dtype(dtype)
+        self.grid = finergrid.astype(self.dtype, copy=False)
+        self.x_time = time.astype(self.dtype, copy=False)
 
     def boxcar(self, t0, width, a):
         tims = boxcar_func(self.x_time, t0, A, width)
@@ -70,7 +92,7 @@ class TimeSeries:
 
 class Spectra(NoiseMixin, BurstMixin, MeasurementMixin):
     def __init__(self, fch1=1100, nchan=336, bwchan=1, tsamp=1,
-                 nbits=8, fbin=10, tbin=10):
+                 nbits=8, fbin=10, tbin=10, max_memory=None, dtype=np.float64, threads=1):
         """initiate function for creating a mock dynamic spectrum data. This sets up the header.
         Parameters
         ----------
@@ -82,6 +104,14 @@ class Spectra(NoiseMixin, BurstMixin, MeasurementMixin):
             channel bandwidth (MHz)
         tsamp : float
             time resolution (ms)
+        max_memory : float
+            memory budget (MB) of the simulation arrays, see memory.MemoryPlan. None for no limit.
+        dtype : numpy dtype
+            float32 or float64, the precision of the burst, dedispersion, noise and measurement
+            arrays. float32 halves their memory, see the README for its accuracy against float64.
+        threads : int
+            threads working on blocks of channels in burst, dedisperse and inject, 0 for every core.
+            The output does not depend on it.
         """
 
         self.fch1 = fch1
@@ -91,6 +121,9 @@ class Spectra(NoiseMixin, BurstMixin, MeasurementMixin):
         self.nbits = nbits
         self.fbin = fbin
         self.tbin = tbin
+        self.max_memory = max_memory
+        self.dtype = float_dtype(dtype)
+        self.threads = threads
 
         # Frequency grid
         vi, chan_idx = freq_splitter_idx(nchan, 0, nchan, bwchan, fch1)
@@ -108,12 +141,12 @@ class Spectra(NoiseMixin, BurstMixin, MeasurementMixin):
             "nbits": nbits,             
             "nifs": 1,                  # number of IFs
             "tsamp": tsamp / 1000.0,    
-            "tstart": Time.now().mjd,   # MJD start
+            "tstart": mjd_now(),       # MJD start
             "source_name": "SIMULATED",
             "nsamples": None
         }
 
-    def create_filterbank(self, file_name, std=np.sqrt(336), base=127):
+    def create_filterbank(self, file_name, std=np.sqrt(336), base=127, stream=None):
         """Create a mock dynamic spectrum filterbank file.
         Parameters
         ----------
@@ -123,8 +156,13 @@ class Spectra(NoiseMixin, BurstMixin, MeasurementMixin):
             standard deviation of white noise, for normalised noise after fscrunching, set to sqrt(nchan)
         base : float
             base level of array
+        stream : streamfilterbank
+            open stream to append to instead of a new file, file_name is then unused
         """
-        self.filterbank = makefilterbank(file_name + ".fil", header=self.header)
+        if stream is not None:
+            self.filterbank = stream
+        else:
+            self.filterbank = makefilterbank(file_name + ".fil", header=self.header)
         self.fil_std = std
         self.fil_base = base
 
@@ -132,17 +170,42 @@ class Spectra(NoiseMixin, BurstMixin, MeasurementMixin):
         """Close writing filterbank"""
         self.filterbank.closefile()
 
-    def inject(self, array):
+    def memory_plan(self, nsamp):
+        """MemoryPlan of an nsamp block of this instrument, dtype and memory budget"""
+        return MemoryPlan(self.nchan, self.fbin, nsamp, self.max_memory, self.dtype.itemsize)
+
+    def inject(self, array, norm=None):
         """Create a mock dynamic spectrum filterbank file.
         Parameters
         ----------
         array : numpy array object
             the burst array data to be injected into the filterbank object
+        norm : int
+            block length the burst amplitude is normalised to, defaults to the length of array.
+            Set it to the single-burst nsamp when array holds several packed bursts.
         """
-        scaledarray = array * self.fil_std / np.sqrt(array.shape[0])
-        bkg = (np.random.randn(array.shape[0], array.shape[1]) *
-               self.fil_std + self.fil_base)
-        imprint = (bkg + scaledarray).astype(np.uint8)
+        if norm is None:
+            norm = array.shape[0]
+        ### noise is drawn row-major, so chunks of rows continue the same stream as one draw
+        rows = self.memory_plan(array.shape[0]).rows
+        ### scalars of the compute dtype, so that float32 blocks stay float32
+        std = self.dtype.type(self.fil_std)
+        root = self.dtype.type(np.sqrt(norm))
+        base = self.dtype.type(self.fil_base)
+        imprint = np.empty(array.shape, dtype=np.uint8)
+        for lo in range(0, array.shape[0], rows):
+            hi = min(lo + rows, array.shape[0])
+            ### the draw stays on this thread, in the order of a single draw
+            with stage("noise"):
+                noise = np.random.randn(hi - lo, array.shape[1]).astype(self.dtype, copy=False)
+
+            def quantize(c0, c1):
+                scaledarray = array[lo:hi, c0:c1] * std / root
+                bkg = noise[:, c0:c1] * std + base
+                imprint[lo:hi, c0:c1] = (bkg + scaledarray).astype(np.uint8)
+
+            with stage("quantize"):
+                map_blocks(quantize, array.shape[1], self.threads)
         self.filterbank.writeblock(imprint)
         self.injected_array = imprint
 
@@ -150,7 +213,7 @@ class Spectra(NoiseMixin, BurstMixin, MeasurementMixin):
 
 class fgrid:
     def __init__(self, fch1=1000, bwchan=1, nchan=336, tsamp=1,
-                 nsamp=1000, tbin=10, fbin=10):
+                 nsamp=1000, tbin=10, fbin=10, dtype=np.float64):
         """Simulate a burst in a higher resolution grid. tgrid is the higher resolution 
         while fgrid is the final dynamic higher resolution
         Parameters
@@ -169,6 +232,8 @@ class fgrid:
             grid time resolution
         fbin : int
             grid frequency resolution
+        dtype : numpy dtype
+            float32 or float64 time grid and burst array
         """
         self.fch1 = fch1
         self.bwchan = bwchan
@@ -177,7 +242,8 @@ class fgrid:
         self.nsamp = nsamp
         time = np.arange(nsamp) * tsamp
 
-        tims = TimeSeries(tsamp=tsamp, nsamp=nsamp, bins=tbin)
+        self.dtype = float_dtype(dtype)
+        tims = TimeSeries(tsamp=tsamp, nsamp=nsamp, bins=tbin, dtype=self.dtype)
         self.tims = tims
         self.tgrid = tims.grid
         self.x_time = tims.x_time
@@ -192,7 +258,7 @@ class fgrid:
                                             bwchan / fbin, fch1 - bwchan * 0.5)
         self.fgrid = vif2
 
-        self.array = np.zeros((nchan * fbin, nsamp))
+        self.array = np.zeros((nchan * fbin, nsamp), dtype=self.dtype)
 
     def pulse(self, t0, width, A, tau=10, alpha=4, dm=0, mode='gaussian', drift=0, dmerr=0):
         """Simulates pulse in datagrid
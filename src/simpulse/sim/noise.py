@@ -3,6 +3,11 @@
 import numpy as np
 
 
+def quantize(array):
+    """Clip array to 0-255 and cast it to uint8"""
+    return np.clip(array, 0, 255).astype(np.uint8)
+
+
 class NoiseMixin:
     """
     Noise-related methods mixed into Spectra.
@@ -18,4 +23,5 @@ class NoiseMixin:
         nsamp : int
             length of noise in units of tsamp
         """
-        self.filterbank.writenoise(nsamp, self.fil_std, self.fil_base)
+        channels = self.memory_plan(nsamp).noise_channels
+        self.filterbank.writenoise(nsamp, self.fil_std, self.fil_base, channels, self.dtype)
@@ -0,0 +1,70 @@
+# sim/parallel.py
+"""
+Thread pool over blocks of channels.
+
+NumPy releases the GIL inside its array loops, and the compiled kernels are
+built with nogil, so blocks of channels processed on threads run in parallel
+without the start-up and pickling cost of processes. Each block is computed
+as it would be on its own, and every reduction runs within a channel (over
+time or sub-channels), so the result does not depend on the thread count.
+Random numbers are still drawn on the calling thread, in the order of a
+single-threaded run.
+
+Pools are shared per thread count. A call made from inside a pool worker runs
+its blocks serially, so nested use cannot deadlock the pool. The workers call
+the single-threaded builds of the compiled kernels, see kernels.py.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_pools = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def resolve_threads(threads):
+    """Thread count of a threads option: None is 1, 0 or less is every core."""
+    if threads is None:
+        return 1
+    if threads < 1:
+        return os.cpu_count() or 1
+    return int(threads)
+
+
+def channel_blocks(nchan, threads):
+    """[lo, hi) ranges splitting nchan channels into at most threads contiguous blocks of near-equal size."""
+    n = max(1, min(resolve_threads(threads), nchan))
+    edges = [nchan * i // n for i in range(n + 1)]
+    return [(edges[i], edges[i + 1]) for i in range(n)]
+
+
+def _worker_init():
+    _local.worker = True
+
+
+def _pool(threads):
+    with _lock:
+        pool = _pools.get(threads)
+        if pool is None:
+            pool = _pools[threads] = ThreadPoolExecutor(threads, thread_name_prefix="simpulse",
+                                                        initializer=_worker_init)
+        return pool
+
+
+def map_blocks(func, nchan, threads):
+    """Call func(lo, hi) for each channel block and return the results in block order.
+    Parameters
+    ----------
+    func : callable
+        works on channels [lo, hi), blocks do not overlap so they can write to disjoint slices of one array
+    nchan : int
+        number of channels
+    threads : int
+        blocks run on a pool of this many threads, see resolve_threads
+    """
+    blocks = channel_blocks(nchan, threads)
+    if len(blocks) == 1 or getattr(_local, "worker", False):
+        return [func(lo, hi) for lo, hi in blocks]
+    return list(_pool(len(blocks)).map(lambda block: func(*block), blocks))
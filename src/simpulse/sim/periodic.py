@@ -0,0 +1,294 @@
+# sim/periodic.py
+"""
+Template placement engine for periodic injection.
+
+A Gaussian pulse profile is tabulated once on a sub-sample grid of fractional
+arrival phases. Each pulse is then added into only the samples inside its
+window, so the cost scales with npulses * nchan * width, not with the
+length of the observation.
+
+Per-pulse amplitudes and widths (nulling, mode changes, RRAT-like
+distributions) are drawn for all pulses in one pass. The widths are
+quantised onto a small bank of templates.
+"""
+
+import numpy as np
+
+from . import kernels
+from .timing import pulse_normal, pulse_uniform
+
+### elements per scatter-add batch, bounds the (pulses, nchan, window) temporaries
+BATCH_ELEMENTS = 1 << 22
+
+### bytes of scatter-add temporaries (indices, values, masks and their masked copies) per batch element
+SCATTER_BYTES = 64
+
+### most templates kept for a distribution of widths
+WIDTH_BANK = 64
+
+### independent per-pulse random streams (stream 0 is the timing jitter)
+AMP_STREAM, WIDTH_STREAM, NULL_STREAM, MODE_STREAM = 1, 2, 3, 4
+
+
+def pulse_templates(width_ms, tsamp_ms, oversample=10, nsigma=6):
+    """Tabulate a unit-peak Gaussian at `oversample` fractional sample phases.
+    Parameters
+    ----------
+    width_ms : float or numpy array
+        Gaussian sigma (ms), an array gives one template per width
+    tsamp_ms : float
+        time resolution (ms)
+    oversample : int
+        number of fractional phases per sample
+    nsigma : float
+        half-width of the window in units of the largest sigma
+
+    Returns
+    -------
+    templates : numpy array
+        (oversample, 2*half+1) profile, row k is for an arrival k/oversample samples after an integer sample.
+        For an array of widths the shape is (nwidth, oversample, 2*half+1).
+    half : int
+        half-width of the window (samples)
+    """
+    width_ms = np.asarray(width_ms, dtype=np.float64)
+    half = int(np.ceil(nsigma * width_ms.max() / tsamp_ms))
+    span = np.arange(-half, half + 1)
+    frac = np.arange(oversample) / oversample
+    x = (span[None, :] - frac[:, None]) * tsamp_ms / width_ms[..., None, None]
+    return np.exp(-0.5 * x ** 2), half
+
+
+def width_bank(widths, nbank=WIDTH_BANK):
+    """Quantise per-pulse widths onto at most nbank template widths.
+    Returns
+    -------
+    bank : numpy array
+        template widths (ms)
+    idx : numpy array
+        index into bank of every pulse
+    """
+    widths = np.asarray(widths, dtype=np.float64)
+    unique = np.unique(widths)
+    if unique.size <= nbank:
+        return unique, np.searchsorted(unique, widths)
+    ### log-spaced bank, relative width error below half a bank step
+    wmin, wmax = unique[0], unique[-1]
+    bank = np.geomspace(wmin, wmax, nbank)
+    idx = np.rint(np.log(widths / wmin) / np.log(wmax / wmin) * (nbank - 1)).astype(np.int64)
+    return bank, idx
+
+
+def place_pulses(out, arrivals_ms, delays_ms, templates, half, tsamp_ms, start=0,
+                 amps=None, tidx=None, batch_elements=BATCH_ELEMENTS):
+    """Scatter-add pulses into a (nsamp, nchan) block.
+    Parameters
+    ----------
+    out : numpy array
+        (nsamp, nchan) block covering samples [start, start + nsamp), modified in place
+    arrivals_ms : numpy array
+        emission time of each pulse at the reference frequency (ms)
+    delays_ms : numpy array
+        dispersion delay of each channel relative to the reference frequency (ms)
+    templates, half :
+        output of pulse_templates
+    tsamp_ms : float
+        time resolution (ms)
+    start : int
+        absolute sample index of the first row of out
+    amps : numpy array
+        amplitude of each pulse, default 1
+    tidx : numpy array
+        template of each pulse when templates holds a bank of widths
+    batch_elements : int
+        (pulse, channel, window) elements per scatter-add batch of the NumPy kernel, each holds
+        SCATTER_BYTES of temporaries
+    """
+    arrivals_ms = np.asarray(arrivals_ms, dtype=np.float64)
+    delays_ms = np.asarray(delays_ms, dtype=np.float64)
+    if templates.ndim == 2:
+        templates = templates[None]
+        tidx = None
+    if tidx is None:
+        tidx = np.zeros(arrivals_ms.size, dtype=np.int64)
+    scatter = kernels.dispatch("scatter_pulses", scatter_pulses)
+    return scatter(out, arrivals_ms, delays_ms, templates, half, tsamp_ms, start, amps, tidx, batch_elements)
+
+
+def scatter_pulses(out, arrivals_ms, delays_ms, templates, half, tsamp_ms, start, amps, tidx,
+                   batch_elements=BATCH_ELEMENTS):
+    """NumPy reference of the scatter-add of place_pulses, with a (nwidth, oversample, 2*half+1)
+    template bank and the template index of every pulse."""
+    nsamp, nchan = out.shape
+    oversample = templates.shape[-2]
+    span = np.arange(-half, half + 1)
+    chan = np.arange(nchan)
+    flat = out.reshape(-1)
+    batch = max(1, batch_elements // (nchan * span.size))
+
+    for b in range(0, arrivals_ms.size, batch):
+        ### fractional sample position of every (pulse, channel) arrival
+        pos = (arrivals_ms[b:b + batch, None] + delays_ms[None, :]) / tsamp_ms - start
+        i0 = np.floor(pos)
+        k = np.rint((pos - i0) * oversample).astype(np.int64)
+        wrap = k == oversample
+        i0[wrap] += 1
+        k[wrap] = 0
+
+        idx = i0.astype(np.int64)[:, :, None] + span
+        inside = (idx >= 0) & (idx < nsamp)
+        vals = templates[tidx[b:b + batch, None], k]
+        if amps is not None:
+            vals = vals * amps[b:b + batch, None, None]
+        np.add.at(flat, (idx * nchan + chan[None, :, None])[inside], vals[inside])
+    return out
+
+
+def template_sums(templates):
+    """Time-integrated value (in samples) of each template, averaged over the sub-sample phases."""
+    return templates.sum(axis=-1).mean(axis=-1)
+
+
+def window_sums(arrivals_ms, delays_ms, templates, half, tsamp_ms, nsamp, amps=None, tidx=None,
+                batch_elements=BATCH_ELEMENTS):
+    """Per-channel time sum of the given pulses over samples [0, nsamp) without building the block.
+    Used for the pulses cut by the edges of the file, whose area is not the full template area.
+    The pulses are taken in batches of batch_elements // nchan, whose (pulse, channel) temporaries
+    hold about 2 * SCATTER_BYTES per element.
+    """
+    if templates.ndim == 2:
+        templates = templates[None]
+        tidx = None
+    arrivals_ms = np.asarray(arrivals_ms, dtype=np.float64)
+    if tidx is None:
+        tidx = np.zeros(arrivals_ms.size, dtype=np.int64)
+    if amps is None:
+        amps = np.ones(arrivals_ms.size)
+    oversample = templates.shape[-2]
+    nspan = templates.shape[-1]
+
+    cs = np.zeros(templates.shape[:-1] + (nspan + 1,))
+    np.cumsum(templates, axis=-1, out=cs[..., 1:])
+
+    delays_ms = np.asarray(delays_ms)
+    batch = max(1, batch_elements // delays_ms.size)
+    total = None
+    for b in range(0, max(arrivals_ms.size, 1), batch):
+        pos = (arrivals_ms[b:b + batch, None] + delays_ms[None, :]) / tsamp_ms
+        i0 = np.floor(pos)
+        k = np.rint((pos - i0) * oversample).astype(np.int64)
+        wrap = k == oversample
+        i0[wrap] += 1
+        k[wrap] = 0
+
+        first = i0.astype(np.int64) - half
+        jlo = np.clip(-first, 0, nspan)
+        jhi = np.clip(nsamp - first, 0, nspan)
+        t = tidx[b:b + batch, None]
+        sums = (cs[t, k, jhi] - cs[t, k, jlo]) * amps[b:b + batch, None]
+        ### the sum over pulses runs row after row, so continuing it from the running total
+        ### adds in the same order as one batch
+        if total is not None:
+            sums = np.concatenate([total[None], sums])
+        total = sums.sum(axis=0)
+    return total
+
+
+def parse_dist(spec):
+    """Parse a per-pulse distribution spec: a number, or kind:a,b with kind in const, normal, lognormal, uniform.
+    Returns
+    -------
+    kind, params
+    """
+    spec = str(spec)
+    if ":" not in spec:
+        return "const", (float(spec),)
+    kind, _, params = spec.partition(":")
+    params = tuple(float(p) for p in params.split(","))
+    nparams = {"const": 1, "normal": 2, "lognormal": 2, "uniform": 2}
+    if kind not in nparams:
+        raise ValueError("Unknown distribution {}".format(kind))
+    if len(params) != nparams[kind]:
+        raise ValueError("{} takes {} parameters, got {}".format(kind, nparams[kind], spec))
+    return kind, params
+
+
+def draw_dist(spec, seed, n, stream):
+    """Draw the distribution spec (see parse_dist) for each pulse index in n."""
+    kind, params = parse_dist(spec)
+    n = np.asarray(n, dtype=np.int64)
+    if kind == "const":
+        return np.full(n.shape, params[0])
+    if kind == "normal":
+        return params[0] + params[1] * pulse_normal(seed, n, stream)
+    if kind == "lognormal":
+        return np.exp(params[0] + params[1] * pulse_normal(seed, n, stream))
+    return params[0] + (params[1] - params[0]) * pulse_uniform(seed, n, stream)
+
+
+def pulse_parameters(npulses, seed, amp=1.0, width=1.0, nulling=0.0,
+                     mode_switch=0.0, mode_amp=1.0, mode_width=1.0, table=None):
+    """Amplitude and width of every pulse, drawn in one vectorized pass.
+    Parameters
+    ----------
+    npulses : int
+        number of pulses
+    seed : int
+        seed of the per-pulse streams
+    amp, width : float or string
+        distribution spec (see parse_dist) of the relative amplitude and the sigma (ms)
+    nulling : float
+        fraction of pulses that are nulled
+    mode_switch : float
+        probability of switching between the two emission modes at each pulse
+    mode_amp, mode_width : float
+        amplitude and width scaling of the second mode
+    table : numpy array
+        optional per-pulse table overriding the distributions, a structured array with
+        any of the fields amp, width, null or a (npulses, 2) array of amp, width
+
+    Returns
+    -------
+    amps, widths : numpy array
+    """
+    n = np.arange(npulses)
+    amps = draw_dist(amp, seed, n, AMP_STREAM)
+    widths = draw_dist(width, seed, n, WIDTH_STREAM)
+    null = np.zeros(npulses, dtype=bool)
+
+    if table is not None:
+        if len(table) < npulses:
+            raise ValueError("Pulse table has {} rows for {} pulses".format(len(table), npulses))
+        names = table.dtype.names
+        if names is None:
+            amps = np.array(table[:npulses, 0], dtype=np.float64)
+            widths = np.array(table[:npulses, 1], dtype=np.float64)
+        else:
+            if "amp" in names:
+                amps = np.array(table["amp"][:npulses], dtype=np.float64)
+            if "width" in names:
+                widths = np.array(table["width"][:npulses], dtype=np.float64)
+            if "null" in names:
+                null = np.array(table["null"][:npulses], dtype=bool)
+
+    if nulling > 0:
+        null |= pulse_uniform(seed, n, NULL_STREAM) < nulling
+
+    if mode_switch > 0:
+        ### two-state Markov chain, the mode is the parity of the number of switches so far
+        switches = pulse_uniform(seed, n, MODE_STREAM) < mode_switch
+        second = np.cumsum(switches) % 2 == 1
+        amps[second] *= mode_amp
+        widths[second] *= mode_width
+
+    amps[null] = 0.0
+    return amps, np.maximum(widths, 1e-3)
+
+
+def chunk_window(delays_ms, half, tsamp_ms, start, stop):
+    """Range of reference-frequency arrival times (ms) whose windows can touch samples [start, stop).
+    Pulses emitted before start still count when their dispersion tail reaches into the chunk.
+    """
+    lo_ms = (start - half - 1) * tsamp_ms - np.max(delays_ms)
+    hi_ms = (stop + half + 1) * tsamp_ms - np.min(delays_ms)
+    return lo_ms, hi_ms
@@ -0,0 +1,165 @@
+# sim/truth.py
+"""
+Truth catalog of injected pulses.
+
+Every injection is logged with its file, exact sample position, DM, width,
+amplitude, S/N metrics and seed. Records collect in a preallocated
+structured buffer and are flushed in bulk to a .npy file, whose header is
+rewritten on close. export_text writes the legacy ';'-separated truth table.
+The file field is fixed width, size it with truth_dtype when names can be long.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+TRUTH_DTYPE = np.dtype([
+    ("file", "U128"),       # filterbank the pulse was written to
+    ("pulse", "i8"),        # pulse number within the file
+    ("block", "i8"),        # first sample of the injected block
+    ("sample", "i8"),       # sample of the pulse peak at fch1
+    ("t0", "f8"),           # peak time within the block at fch1, offset included (ms)
+    ("dm", "f8"),           # pc cm-3
+    ("width", "f8"),        # gaussian sigma (ms)
+    ("fwhm", "f8"),         # ms
+    ("offset", "f8"),       # sub-sample offset of the peak (ms)
+    ("amplitude", "f8"),    # injected scale factor (fluence or S/N target)
+    ("quadsn", "f8"),       # L2_clean of the dedispersed burst
+    ("l2snr", "f8"),        # L2_snr of the burst in simulated noise
+    ("flux", "f8"),         # L2_flux of the dedispersed burst
+    ("seed", "i8"),         # seed of the random state the file was written with
+])
+
+### columns of the legacy text truth table
+TEXT_COLUMNS = ("dm", "width", "fwhm", "quadsn", "l2snr", "offset")
+
+_MAGIC = b"\x93NUMPY\x01\x00"
+### bytes per character of a numpy unicode field
+_UCHAR = np.dtype("U1").itemsize
+
+
+def truth_dtype(longest, dtype=TRUTH_DTYPE):
+    """Record layout with a file field wide enough for names of longest characters.
+    Parameters
+    ----------
+    longest : int
+        length of the longest file name the catalog will hold
+    dtype : numpy dtype
+        layout to widen, the file field is never narrowed
+    """
+    dtype = np.dtype(dtype)
+    width = max(longest, dtype["file"].itemsize // _UCHAR)
+    return np.dtype([(name, "U{}".format(width) if name == "file" else dtype[name]) for name in dtype.names])
+
+
+def _npy_header(dtype, nrows):
+    """version 1.0 .npy header padded to the length needed for any record count,
+    so it can be rewritten in place once the number of records is known"""
+    descr = np.lib.format.dtype_to_descr(dtype)
+    text = repr({"descr": descr, "fortran_order": False, "shape": (nrows,)})
+    longest = repr({"descr": descr, "fortran_order": False, "shape": (2 ** 63,)})
+    total = -(-(len(_MAGIC) + 2 + len(longest) + 1) // 64) * 64
+    hlen = total - len(_MAGIC) - 2
+    return _MAGIC + struct.pack("<H", hlen) + (text.ljust(hlen - 1) + "\n").encode("latin1")
+
+
+class TruthCatalog:
+    def __init__(self, filename, capacity=4096, dtype=TRUTH_DTYPE):
+        """Open a truth catalog for writing.
+        Parameters
+        ----------
+        filename : string
+            output .npy file
+        capacity : int
+            records buffered before a bulk write
+        dtype : numpy dtype
+            record layout, see TRUTH_DTYPE
+        """
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.buffer = np.zeros(capacity, dtype=self.dtype)
+        self.blank = np.zeros((), dtype=self.dtype)
+        self.nbuf = 0
+        self.nrows = 0
+        self.fout = open(filename, "wb")
+        self.fout.write(_npy_header(self.dtype, 0))
+
+    def add(self, **fields):
+        """Log one injection, fields missing from the call are left at zero.
+        Raises ValueError rather than truncate a string longer than its field."""
+        for key, value in fields.items():
+            field = self.dtype[key]
+            if field.kind == "U" and len(value) > field.itemsize // _UCHAR:
+                raise ValueError("{} {!r} does not fit the {} characters of the catalog, "
+                                 "size it with truth_dtype".format(key, value, field.itemsize // _UCHAR))
+        if self.nbuf == len(self.buffer):
+            self.flush()
+        self.buffer[self.nbuf] = self.blank
+        row = self.buffer[self.nbuf]
+        for key, value in fields.items():
+            row[key] = value
+        self.nbuf += 1
+
+    def flush(self):
+        """Write the buffered records to disk."""
+        self.buffer[:self.nbuf].tofile(self.fout)
+        self.nrows += self.nbuf
+        self.nbuf = 0
+        self.fout.flush()
+
+    def close(self):
+        """Flush and fix up the record count in the header."""
+        if self.fout.closed:
+            return
+        self.flush()
+        self.fout.seek(0)
+        self.fout.write(_npy_header(self.dtype, self.nrows))
+        self.fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_truth(filename, mmap=True):
+    """Read a truth catalog written by TruthCatalog as a structured array."""
+    return np.load(filename, mmap_mode="r" if mmap else None)
+
+
+def export_text(catalog, filename, columns=TEXT_COLUMNS):
+    """Write a truth catalog as a ';'-separated text table, by default the legacy simpulse columns.
+    Parameters
+    ----------
+    catalog : string or numpy array
+        truth catalog file or structured array
+    filename : string
+        output text file
+    columns : sequence of string
+        fields to write, in order
+    """
+    if isinstance(catalog, (str, os.PathLike)):
+        catalog = load_truth(catalog)
+    cols = [np.asarray(catalog[c]).tolist() for c in columns]
+    with open(filename, "w") as w:
+        for row in zip(*cols):
+            w.write(";".join(map(str, row)) + "\n")
+
+
+def merge_catalogs(filenames, output):
+    """Concatenate truth catalogs, e.g. of the shards of a campaign, sorted by file and pulse.
+    The file field takes the width of the widest catalog.
+    Returns
+    -------
+    the merged structured array, also saved to output
+    """
+    parts = [load_truth(f, mmap=False) for f in filenames]
+    dtype = parts[0].dtype
+    for part in parts[1:]:
+        dtype = truth_dtype(part.dtype["file"].itemsize // _UCHAR, dtype)
+    merged = np.concatenate([part.astype(dtype) for part in parts])
+    merged = merged[np.lexsort((merged["pulse"], merged["file"]))]
+    np.save(output, merged)
+    return merged
@@ -0,0 +1,82 @@
+# sim/workqueue.py
+"""
+Splitting a simpulse campaign across nodes.
+
+shard_cells gives a static round-robin partition of the (width, DM) grid.
+WorkQueue is a pull-based alternative for nodes of different speeds. Nodes
+claim cells through lock files in a shared directory, created with O_EXCL,
+so no external service is needed. A finished cell's lock is renamed to a
+.done marker. A lock without a .done marker belongs to a node that died
+and can be deleted to hand the cell out again. Node names are stable across
+restarts, the hostname by default, and a restarted node takes back the locks
+of its earlier run. The pid of the process is only recorded in the lock.
+"""
+
+import os
+import socket
+import time
+
+
+def parse_shard(spec):
+    """Parse an i/N shard spec into (i, N) with 0 <= i < N."""
+    try:
+        index, count = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError("Shard must be i/N, got {}".format(spec))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Shard index must be in [0, N), got {}".format(spec))
+    return index, count
+
+
+def shard_cells(nwidth, ndm, index, count):
+    """Cells (iwidth, idm) of shard index out of count, dealt round-robin in grid order."""
+    return [(iw, idm) for iw in range(nwidth) for idm in range(ndm)
+            if (iw * ndm + idm) % count == index]
+
+
+class WorkQueue:
+    def __init__(self, queue_dir, node=None):
+        """Work queue backed by lock files in queue_dir, which every node must see.
+        node names this node, the hostname by default; two processes sharing a name must not
+        run at the same time, a later one takes over the locks of an earlier one."""
+        self.queue_dir = queue_dir
+        self.node = node or socket.gethostname()
+        if not self.node or any(c.isspace() or c in "/\\" for c in self.node):
+            raise ValueError("Node name must be non-empty, without whitespace or path separators, got {!r}".format(self.node))
+        self.owner = "{}-{}".format(self.node, os.getpid())
+        os.makedirs(queue_dir, exist_ok=True)
+
+    def _path(self, cell, suffix):
+        return os.path.join(self.queue_dir, "cell_{}_{}.{}".format(cell[0], cell[1], suffix))
+
+    def claim(self, cell):
+        """Atomically take a cell, False if another node has it or it is done."""
+        if os.path.exists(self._path(cell, "done")):
+            return False
+        try:
+            fd = os.open(self._path(cell, "lock"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self.lock_node(cell) != self.node:
+                return False
+            ### left by an earlier run of this node, which never finished the cell
+            fd = os.open(self._path(cell, "lock"), os.O_TRUNC | os.O_WRONLY)
+        with os.fdopen(fd, "w") as f:
+            f.write("{} {}\n".format(self.owner, time.time()))
+        ### another node may have finished it between the check and the lock
+        if os.path.exists(self._path(cell, "done")):
+            os.remove(self._path(cell, "lock"))
+            return False
+        return True
+
+    def lock_node(self, cell):
+        """Node name of the owner of a cell's lock, None if it has no readable lock."""
+        try:
+            with open(self._path(cell, "lock")) as f:
+                owner = f.read().split()
+        except FileNotFoundError:
+            return None
+        return owner[0].rsplit("-", 1)[0] if owner else None
+
+    def done(self, cell):
+        """Mark a claimed cell as finished."""
+        os.replace(self._path(cell, "lock"), self._path(cell, "done"))
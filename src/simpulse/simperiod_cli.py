@@ -12,8 +12,15 @@ from rich.progress import Progress, BarColumn, TextColumn, TimeRemainingColumn
 # internal imports
 from simpulse.sim.model import Spectra
 from simpulse.sim.burst import tidm
-from simpulse.sim.measurement import L2_clean
+from simpulse.sim.periodic import (pulse_templates, place_pulses, width_bank,
+                                   template_sums, window_sums, pulse_parameters,
+                                   chunk_window)
+from simpulse.sim.timing import TimingModel
+from simpulse.sim.parallel import map_blocks
+from simpulse.sim.memory import StreamPlan
 from simpulse.io.fbio import makefilterbank
+from simpulse.io.stream import streamfilterbank
+from simpulse.profiling import ProfileReport, stage
 
 console = Console()
 
@@ -29,6 +36,22 @@ def main():
                         help="Spin period P (seconds)")
     parser.add_argument("-pdot", type=float, default=0.0,
                         help="Period derivative Pdot (s/s)")
+    parser.add_argument("--f2", type=float, default=0.0,
+                        help="Second spin frequency derivative (Hz/s^2)")
+    parser.add_argument("--accel", type=float, default=0.0,
+                        help="Constant line-of-sight acceleration (m/s^2)")
+    parser.add_argument("--pb", type=float, default=None,
+                        help="Orbital period (days); omit for an isolated pulsar")
+    parser.add_argument("--a1", type=float, default=0.0,
+                        help="Projected semi-major axis (light seconds)")
+    parser.add_argument("--ecc", type=float, default=0.0,
+                        help="Orbital eccentricity")
+    parser.add_argument("--om", type=float, default=0.0,
+                        help="Longitude of periastron (degrees)")
+    parser.add_argument("--t0", type=float, default=0.0,
+                        help="Epoch of periastron (s from the start of the file)")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="rms per-pulse arrival-time jitter (ms)")
     parser.add_argument("-w", "--width", type=float, required=True,
                         help="Intrinsic pulse width sigma (ms)")
     parser.add_argument("-snr", type=float, required=True,
@@ -36,6 +59,24 @@ def main():
     parser.add_argument("-npulses", type=int, default=100,
                         help="Number of pulses to simulate")
 
+    # Per-pulse parameters
+    parser.add_argument("--amp-dist", type=str, default="1",
+                        help="Relative pulse amplitude: a number or const:a, normal:mean,std, "
+                             "lognormal:mu,sigma, uniform:lo,hi")
+    parser.add_argument("--width-dist", type=str, default=None,
+                        help="Pulse width sigma (ms) distribution, same syntax as --amp-dist; "
+                             "overrides --width")
+    parser.add_argument("--nulling", type=float, default=0.0,
+                        help="Fraction of nulled pulses")
+    parser.add_argument("--mode-switch", type=float, default=0.0,
+                        help="Probability of switching emission mode at each pulse")
+    parser.add_argument("--mode-amp", type=float, default=1.0,
+                        help="Amplitude scaling of the second emission mode")
+    parser.add_argument("--mode-width", type=float, default=1.0,
+                        help="Width scaling of the second emission mode")
+    parser.add_argument("--pulse-table", type=str, default=None,
+                        help=".npy table of per-pulse amp/width/null (structured) or (npulses, 2) amp, width")
+
     # Data parameters
     parser.add_argument("-fch1", type=float, default=190,
                         help="Top-of-band channel centre frequency (MHz)")
@@ -46,7 +87,7 @@ def main():
     parser.add_argument("-tsamp", type=float, default=0.655,
                         help="Time resolution (ms)")
     parser.add_argument("-tbin", type=int, default=10,
-                        help="Time grid resolution (used internally)")
+                        help="Sub-sample phases used to tabulate the pulse profile")
     parser.add_argument("-fbin", type=int, default=10,
                         help="Frequency grid resolution (used internally)")
 
@@ -57,10 +98,37 @@ def main():
                         help="Base level added to data before uint8 cast")
     parser.add_argument("-o", "--output", type=str, default="simperiodic",
                         help="Output filterbank basename ('.fil' will be added)")
+    parser.add_argument("--max-memory", type=float, default=2048,
+                        help="Memory budget (MB); the file is generated in time chunks that fit inside it, "
+                             "an error if the budget cannot hold one sample of every channel")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed for the noise")
+    parser.add_argument("--dtype", type=str, default="float64", choices=["float32", "float64"],
+                        help="Precision of the burst and noise blocks before the uint8 cast")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="Threads placing pulses and quantizing blocks of channels, 0 for every core; "
+                             "the output does not depend on it")
+    parser.add_argument("--stream", type=str, default=None,
+                        help="Stream the filterbank to -, fifo:PATH, tcp:HOST:PORT or unix:PATH "
+                             "instead of writing <output>.fil")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="Write per-stage times, throughput and peak RSS as JSON lines to this file, - for stderr")
+    parser.add_argument("--profile-interval", type=float, default=None,
+                        help="Seconds between intermediate --profile snapshots; only the final one if omitted")
 
     args = parser.parse_args()
+    if args.stream in ("-", "stdout"):
+        # keep the filterbank stream on stdout clean
+        console.stderr = True
 
-    simulate_periodic(args)
+    profile = ProfileReport(args.profile, args.profile_interval) if args.profile else None
+    try:
+        simulate_periodic(args)
+    except MemoryError as err:
+        parser.error(str(err))
+    finally:
+        if profile is not None:
+            profile.close()
     
 def simulate_periodic(args):
     console.print("[bold magenta]SIMPERIOD pulsar simulator[/]")
@@ -83,16 +151,28 @@ def simulate_periodic(args):
     noise_base = args.noise_base
     output = args.output
 
-    # --- 1. Compute pulse emission times including Pdot ---
-    # t_n = n*P0 + 0.5*n*(n-1)*Pdot  (seconds)
+    if args.seed is not None:
+        np.random.seed(args.seed)
+        seed = args.seed
+    else:
+        seed = np.random.SeedSequence().entropy % 2 ** 32
+
+    # --- 1. Timing model for the pulse arrival times ---
+    # Spin (P, Pdot, F2), acceleration, binary motion and jitter, evaluated
+    # per chunk of pulses rather than for the whole train at once.
     console.print(f"[bold]DM[/]: {dm} pc cm^-3")
     console.print(f"[bold]P[/]: {P0_s} s, [bold]Pdot[/]: {pdot_s} s/s")
+    if args.pb is not None:
+        console.print(f"[bold]Binary[/]: Pb={args.pb} d, A1={args.a1} lt-s, "
+                      f"e={args.ecc}, om={args.om} deg")
     console.print(f"[bold]Width[/]: {width_ms} ms | [bold]Pulses[/]: {npulses}")
     console.print(f"[bold]Target S/N[/]: {target_snr}\n")
 
-    n_arr = np.arange(npulses, dtype=float)
-    t_n_s = n_arr * P0_s + 0.5 * n_arr * (n_arr - 1.0) * pdot_s
-    t_last_s = t_n_s[-1]
+    model = TimingModel.from_period(P0_s, pdot_s, f2=args.f2, accel=args.accel,
+                                    pb=args.pb, a1=args.a1, ecc=args.ecc,
+                                    om=args.om, t0=args.t0, jitter=args.jitter,
+                                    seed=seed)
+    t_last_s = model.arrival_times([npulses - 1])[0]
     total_s = t_last_s + 2.0 * P0_s  # small padding
     total_ms = total_s * 1000.0
 
@@ -102,63 +182,144 @@ def simulate_periodic(args):
 
     # --- 2. Set up Spectra just to get header + freq grid ---
     spec = Spectra(fch1=fch1, nchan=nchan, bwchan=bwchan,
-                   tsamp=tsamp_ms, tbin=tbin, fbin=fbin)
+                   tsamp=tsamp_ms, tbin=tbin, fbin=fbin,
+                   dtype=args.dtype, threads=args.threads)
 
     vif = spec.vif  # frequency grid (MHz)
     nchan = spec.nchan
 
-    # --- 3. Build burst-only dynamic spectrum (no noise yet) ---
-    t = np.arange(nsamp) * tsamp_ms  # time axis in ms
-    burst_dyn = np.zeros((nsamp, nchan), dtype=float)
+    # --- 3. Per-pulse parameters, template bank and time chunks ---
+    # Amplitudes, widths, nulling and mode changes are drawn for all pulses
+    # in one pass. Profiles are tabulated once per bank width on a tbin
+    # sub-sample grid, each pulse is added into its window only, and the
+    # file is generated in chunks that fit inside --max-memory.
+    table = np.load(args.pulse_table, mmap_mode="r") if args.pulse_table else None
+    amps, widths = pulse_parameters(npulses, seed,
+                                    amp=args.amp_dist,
+                                    width=args.width_dist or width_ms,
+                                    nulling=args.nulling,
+                                    mode_switch=args.mode_switch,
+                                    mode_amp=args.mode_amp,
+                                    mode_width=args.mode_width,
+                                    table=table)
+    bank, tidx = width_bank(widths)
+    delays_ms = tidm(dm, vif, fch1)
+    templates, half = pulse_templates(bank, tsamp_ms, oversample=tbin)
+
+    plan = StreamPlan(nchan, nsamp, 2 * half + 1, args.max_memory, spec.dtype.itemsize, args.threads)
+    console.print(f"[bold]memory[/]: {plan.describe()}")
+    chunk = plan.rows
+    nchunks = -(-nsamp // chunk)
+    console.print(f"[bold blue]Injecting {npulses} pulses[/] "
+                  f"({np.count_nonzero(amps == 0)} nulled, {bank.size} template width(s), "
+                  f"window of {2 * half + 1} samples) in {nchunks} chunk(s) "
+                  f"of {chunk} samples")
+
+    # --- 4. Scale burst to target S/N using L2_clean ---
+    # L2_clean squares the per-channel time mean. Every pulse inside the file
+    # adds amp * (template area) to it, so only the pulses cut by the start
+    # or end of the file need their windows summed explicitly.
+    edge = np.zeros(npulses, dtype=bool)
+    for start, stop in ((-nsamp, 1), (nsamp - 1, 2 * nsamp)):
+        lo_ms, hi_ms = chunk_window(delays_ms, half, tsamp_ms, start, stop)
+        lo, hi = model.pulse_range(lo_ms / 1000.0, hi_ms / 1000.0)
+        edge[lo:hi] = True
+    n_edge = np.flatnonzero(edge)
+
+    with stage("measure"):
+        chansum = np.full(nchan, np.sum((amps * template_sums(templates)[tidx])[~edge]))
+        chansum += window_sums(model.arrival_times(n_edge) * 1000.0, delays_ms, templates,
+                               half, tsamp_ms, nsamp, amps=amps[n_edge], tidx=tidx[n_edge],
+                               batch_elements=plan.batch_elements)
+    chanmean = chansum / nsamp
+    snr0 = np.sum(chanmean[chanmean > 0] ** 2) ** 0.5
+    if snr0 == 0:
+        console.print("[bold red]Error:[/] clean S/N is zero; check parameters.")
+        return
+
+    amp_factor = target_snr / snr0
+    console.print(f"Base clean S/N: {snr0:.2f} → scaling by factor {amp_factor:.3f}")
+    amps = amps * amp_factor
+
+    # --- 5. Add noise + base level and write to filterbank, chunk by chunk ---
+    # Each block of channels gets every pulse of the chunk in the same order,
+    # so the sums per channel do not depend on --threads.
+    def burst_chunk(start, stop):
+        block = np.zeros((stop - start, nchan), dtype=dtype)
+        lo_ms, hi_ms = chunk_window(delays_ms, half, tsamp_ms, start, stop)
+        lo, hi = model.pulse_range(lo_ms / 1000.0, hi_ms / 1000.0)
+        n = np.arange(lo, min(hi, npulses))
+        n = n[amps[n] > 0]
+        arrivals_ms = model.arrival_times(n) * 1000.0
+
+        def place(c0, c1):
+            sub = block if c1 - c0 == nchan else np.zeros((stop - start, c1 - c0), dtype=dtype)
+            place_pulses(sub, arrivals_ms, delays_ms[c0:c1], templates, half,
+                         tsamp_ms, start=start, amps=amps[n], tidx=tidx[n],
+                         batch_elements=plan.batch_elements)
+            if sub is not block:
+                block[:, c0:c1] = sub
 
-    console.print("[bold blue]Injecting pulses...[/]")
+        map_blocks(place, nchan, threads)
+        return block
+
+    header = spec.header.copy()
+    header["nsamples"] = nsamp
+    dtype = spec.dtype
+    std, base = dtype.type(noise_std), dtype.type(noise_base)
+    threads = spec.threads
+
+    stream = args.stream
+    if stream is not None:
+        console.print(f"[bold blue]Streaming filterbank:[/] {stream}")
+        fbank = streamfilterbank(stream, header, nsamples=nsamp)
+    else:
+        console.print(f"[bold blue]Writing filterbank:[/] {output}.fil")
+        fbank = makefilterbank(output + ".fil", header=header)
 
     with Progress(
         TextColumn("[cyan]{task.description}"),
         BarColumn(),
-        TextColumn("{task.completed}/{task.total} pulses"),
+        TextColumn("{task.completed}/{task.total} chunks"),
         TimeRemainingColumn(),
         console=console,
     ) as progress:
 
-        pulse_task = progress.add_task("Pulses", total=npulses)
+        chunk_task = progress.add_task("Chunks", total=nchunks)
 
-        for n_idx, t_emit_s in enumerate(t_n_s):
-            t_emit_ms = t_emit_s * 1000.0
+        for start in range(0, nsamp, chunk):
+            stop = min(start + chunk, nsamp)
+            with stage("burst"):
+                burst_dyn = burst_chunk(start, stop)
 
-            # For each channel, compute arrival time including DM delay
-            for ci, freq in enumerate(vif):
-                t_arrival_ms = t_emit_ms + tidm(dm, freq, fch1)
-                burst_dyn[:, ci] += np.exp(
-                    -0.5 * ((t - t_arrival_ms) / width_ms) ** 2
-                )
+            # sequential randn draws continue the same stream as one full draw,
+            # and stay on this thread; only the arithmetic is split over channels
+            with stage("noise"):
+                dyn = np.random.randn(stop - start, nchan).astype(dtype, copy=False)
 
-            progress.update(pulse_task, advance=1)
+                def scale(c0, c1):
+                    block = dyn[:, c0:c1]
+                    block *= std
+                    block += base
+                    block += burst_dyn[:, c0:c1]
 
-    # --- 4. Scale burst to target S/N using L2_clean ---
-    console.print("\n[bold blue]Measuring clean S/N for scaling...[/]")
-    snr0 = L2_clean(burst_dyn)
-    if snr0 == 0:
-        console.print("[bold red]Error:[/] clean S/N is zero; check parameters.")
-        return
-
-    amp_factor = target_snr / snr0
-    console.print(f"Base clean S/N: {snr0:.2f} → scaling by factor {amp_factor:.3f}")
-    burst_dyn *= amp_factor
+                map_blocks(scale, nchan, threads)
+            with stage("quantize"):
+                data = np.empty(dyn.shape, dtype=np.uint8)
 
-    # --- 5. Add noise + base level ---
-    console.print("[bold blue]Adding noise and base level...[/]")
-    noise = np.random.randn(nsamp, nchan) * noise_std + noise_base
-    dyn = noise + burst_dyn
+                def quantize(c0, c1):
+                    data[:, c0:c1] = dyn[:, c0:c1]
 
-    # --- 6. Write to filterbank ---
-    console.print(f"[bold blue]Writing filterbank:[/] {output}.fil")
+                map_blocks(quantize, nchan, threads)
+            fbank.writeblock(data)
+            # free this chunk before the next one is built, the memory plan holds one at a time
+            del burst_dyn, dyn, data
 
-    header = spec.header.copy()
-    header["nsamples"] = nsamp
+            progress.update(chunk_task, advance=1)
 
-    fbank = makefilterbank(output + ".fil", header=header)
-    fbank.writeblock(dyn.astype(np.uint8))
-    fbank.closefile()
+    if stream is not None:
+        fbank.close()
+    else:
+        fbank.closefile()
 
     console.print("[bold green]Done![/] Filterbank written.\n")
\ No newline at end of file
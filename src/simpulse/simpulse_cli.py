@@ -1,8 +1,16 @@
 from simpulse.sim.model import Spectra, TimeSeries, fgrid
 from simpulse.sim.measurement import L2_snr
-import matplotlib.pyplot as plt
+from simpulse.sim.truth import TruthCatalog, export_text, merge_catalogs, truth_dtype
+from simpulse.sim.cache import TemplateCache
+from simpulse.sim.manifest import Manifest
+from simpulse.sim.memory import MemoryPlan
+from simpulse.sim.workqueue import WorkQueue, parse_shard, shard_cells
+from simpulse.io.stream import streamfilterbank
+from simpulse.profiling import ProfileReport, stage
 import numpy as np
 import math as m
+import os
+from functools import partial
 from rich.console import Console
 from rich.progress import Progress, BarColumn, TextColumn, TimeRemainingColumn
 
@@ -31,8 +39,30 @@ def main():
     parser.add_argument('--sig_start',type=float, default=0.5,help='starting pulse width sigma (ms)')
     parser.add_argument('--sig_step',type=float, default=0.5,help='starting pulse width sigma (ms)')
     parser.add_argument('--sig',type=float, default=0.5,help='max pulse width sigma (ms)')
+    parser.add_argument('--pack',action='store_true',help='pack all pulses of a file back to back instead of one nsamp block each')
+    parser.add_argument('--pack_gap',type=int, default=None,help='noise samples between packed pulses, the burst length if not set')
+    parser.add_argument('--cache_dir',type=str, default=None,help='burst template cache directory, no caching if not set')
+    parser.add_argument('--cache_size',type=float, default=1024,help='template cache size bound (MB)')
+    parser.add_argument('--seed',type=int, default=None,help='base random seed, each file gets its own seed derived from it')
+    parser.add_argument('--resume',action='store_true',help='skip the cells recorded in the campaign manifest whose files are unchanged')
+    parser.add_argument('--shard',type=str, default=None,help='only write shard i/N of the (width, DM) grid, e.g. 0/4')
+    parser.add_argument('--queue',type=str, default=None,help='shared work-queue directory, nodes claim (width, DM) cells from it')
+    parser.add_argument('--node',type=str, default=None,help='name of this node in a --queue run, kept across restarts so --resume finds its outputs, the hostname if not set')
+    parser.add_argument('--stream',type=str, default=None,help='write the campaign as one continuous filterbank stream to -, fifo:PATH, tcp:HOST:PORT or unix:PATH instead of files')
+    parser.add_argument('--max_memory','--max-memory',type=float, default=None,help='memory budget of the simulation arrays per process (MB); burst synthesis, noise and I/O are chunked to fit it')
+    parser.add_argument('--dtype',type=str, default='float64',choices=['float32','float64'],help='precision of the burst, dedispersion, noise and measurement arrays')
+    parser.add_argument('--threads',type=int, default=1,help='threads working on blocks of channels within each burst, 0 for every core; the output does not depend on it')
+    parser.add_argument('--profile',type=str, default=None,help='write per-stage times, throughput and peak RSS as JSON lines to this file, - for stderr')
+    parser.add_argument('--profile_interval',type=float, default=None,help='seconds between intermediate --profile snapshots, only the final one if not set')
     values = parser.parse_args()
 
+    if values.stream is not None:
+        if values.resume:
+            parser.error("--resume needs filterbank files, it cannot be used with --stream")
+        if values.stream in ('-','stdout'):
+            ### keep the filterbank stream on stdout clean
+            console.stderr=True
+
     sigmarange=np.arange(values.sig_start,values.sig+0.5*values.sig_step,values.sig_step)
     dmrange=np.arange(values.dm_start,values.dm+0.5*values.step,values.step)
     tbin=values.tbin
@@ -43,79 +73,111 @@ def main():
     tsamp=values.tsamp
     nsamp=values.samples
     mode=values.mode
-    label=values.label
+    label=values.output
     npulse=values.npulse
     ampl=values.amplitude
+    seed=values.seed
+    cache=TemplateCache(values.cache_dir,values.cache_size) if values.cache_dir else None
+    try:
+        plan=MemoryPlan(nchan,fbin,nsamp,values.max_memory,np.dtype(values.dtype).itemsize)
+    except MemoryError as err:
+        parser.error(str(err))
+    console.print(f"[bold]memory[/]: {plan.describe()}")
+
+    ### per-node outputs of a split campaign, combined with simpulse-merge
+    cells=None
+    queue=None
+    tag=""
+    if values.shard is not None and values.queue is not None:
+        parser.error("--shard and --queue are exclusive")
+    if values.shard is not None:
+        try:
+            index,count=parse_shard(values.shard)
+        except ValueError as err:
+            parser.error(str(err))
+        cells=shard_cells(len(sigmarange),len(dmrange),index,count)
+        tag=f".shard{index}of{count}"
+    if values.node is not None and values.queue is None:
+        parser.error("--node names a --queue node, it needs --queue")
+    if values.queue is not None:
+        try:
+            queue=WorkQueue(values.queue,values.node)
+        except ValueError as err:
+            parser.error(str(err))
+        tag=f".{queue.node}"
+        if values.seed is None:
+            parser.error("--queue needs --seed so that every node writes the same campaign")
+
+    ### a resumed campaign takes its seed from the manifest
+    manifestname=f"{label}_{mode}{tag}.manifest.jsonl"
+    if seed is None and not (values.resume and os.path.exists(manifestname)):
+        seed=np.random.SeedSequence().entropy % 2**32
+    campaign=dict(mode=mode,snmode=values.snmode,amplitude=ampl,samples=nsamp,nchan=nchan,tsamp=tsamp,
+                  fch1=fch1,bwchan=bwchan,tbin=tbin,fbin=fbin,npulse=npulse,widths=sigmarange.tolist(),
+                  dms=dmrange.tolist(),pack=values.pack,pack_gap=values.pack_gap,seed=seed)
+    if values.dtype!='float64':
+        ### float64 campaigns keep the parameters of manifests written before --dtype
+        campaign['dtype']=values.dtype
+    profile=ProfileReport(values.profile,values.profile_interval) if values.profile else None
+    manifest=None
+    if values.stream is None:
+        manifest=Manifest(manifestname,campaign,resume=values.resume)
+        seed=manifest.params['seed']
 
     if values.snmode == 'fluence':
-        fluencebatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl)
+        fluencebatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl,seed,
+                     values.pack,values.pack_gap,cache,manifest,cells,queue,tag,values.stream,values.max_memory,values.dtype,values.threads)
     elif values.snmode == 'snr':
-        snrbatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl)
+        snrbatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl,seed,
+                 values.pack,values.pack_gap,cache,manifest,cells,queue,tag,values.stream,values.max_memory,values.dtype,values.threads)
+    if manifest is not None:
+        manifest.close()
+    if profile is not None:
+        profile.close()
 
 
-def fluencebatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl):
-    model=Spectra(fch1=fch1,nchan=nchan,bwchan=bwchan,tsamp=tsamp,tbin=tbin,fbin=fbin)
-    testname=f"{label}_{mode}"
-    w=open(f"{testname}.txt",'w')
+def cell_seed(seed,iwidth,idm):
+    """Seed of one (width, DM) file, independent of the order the files are written in."""
+    return int(np.random.SeedSequence([seed,iwidth,idm]).generate_state(1)[0])
+
 
+def fluencebatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl,seed=0,
+                 pack=False,gap=None,cache=None,manifest=None,cells=None,queue=None,tag="",stream=None,max_memory=None,dtype='float64',threads=1):
     tstart = nsamp * (0.75 if bwchan>0 else 0.25) * tsamp
     console.print(f"[bold magenta]starting injection[/]: tstart={tstart} bwchan={bwchan}\n")
+    injectbatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl,seed,
+                tstart,'fluence',pack,gap,cache,manifest,cells,queue,tag,stream,max_memory,dtype,threads)
 
-    with Progress(
-        TextColumn("[bold blue]{task.description}"),
-        BarColumn(),
-        TextColumn("{task.completed}/{task.total}"),
-        TimeRemainingColumn(),
-        console=console
-    ) as progress:
-
-        width_task = progress.add_task("Widths", total=len(sigmarange))
-
-        for i in sigmarange:
-            dm_task = progress.add_task("  DMs", total=len(dmrange))
-
-            for j in dmrange:
-                progress.update(dm_task, advance=1)
-
-                model.create_filterbank(f"{testname}_dm{np.round(j,0)}_width{np.round(i,1)}",std=18,base=127)
-
-                xset=np.random.rand()-0.5
-                model.writenoise(nsamp=nsamp)
-                model.writenoise(nsamp=nsamp)
-
-                base1,base2 = model.burst(
-                    t0=tstart, dm=j, A=50, width=i,
-                    mode=mode, nsamp=nsamp, offset=xset
-                )
-
-                pulse_task = progress.add_task("    Pulses", total=npulse)
-
-                for _ in range(npulse):
-                    progress.update(pulse_task, advance=1)
-                    model.writenoise(nsamp=nsamp)
-                    model.inject(base1/model.write_flux()*ampl)
-                    w.write(model.write_snr()[0][:-2]+";"
-                            +str(L2_snr(base2/model.write_snr()[1]*50))
-                            +f";{xset}\n")
-                    model.writenoise(nsamp=nsamp)
-
-                model.writenoise(nsamp=nsamp)
-                model.closefile()
-
-            progress.update(width_task, advance=1)
-
-    w.close()
-    console.print("\n[bold green]Finished[/]\n")
-
-
-def snrbatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl):
-
-    model=Spectra(fch1=fch1,nchan=nchan,bwchan=bwchan,tsamp=tsamp,tbin=tbin,fbin=fbin)
-    testname=f"{label}_{mode}"
-    w=open(f"{testname}.txt",'w')
 
+def snrbatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl,seed=0,
+             pack=False,gap=None,cache=None,manifest=None,cells=None,queue=None,tag="",stream=None,max_memory=None,dtype='float64',threads=1):
     tstart = nsamp * (0.75 if bwchan<0 else 0.25) * tsamp
     console.print("[bold magenta]starting injection[/]\n")
+    injectbatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl,seed,
+                tstart,'snr',pack,gap,cache,manifest,cells,queue,tag,stream,max_memory,dtype,threads)
+
+
+def injectbatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,tbin,fbin,ampl,seed,
+                tstart,snmode,pack=False,gap=None,cache=None,manifest=None,cells=None,queue=None,tag="",stream=None,max_memory=None,dtype='float64',threads=1):
+    """Write one filterbank per (width, DM) with npulse bursts scaled to a fluence or S/N of ampl.
+    Every pulse is logged to {label}_{mode}.truth.npy, exported to the legacy {label}_{mode}.txt at the end.
+    With pack the bursts are cropped to their dispersed extent and written back to back, gap samples apart.
+    Bursts come from the TemplateCache cache when one is given. Cells recorded in the Manifest manifest
+    whose files are unchanged are skipped, and each newly written cell is recorded in it.
+    cells restricts the run to a list of (iwidth, idm) cells, queue claims cells from a WorkQueue, and
+    tag is appended to the truth output names of such a partial run.
+    With a stream sink spec every cell goes into one continuous filterbank stream instead of its own
+    file, and the truth sample of each pulse counts from the start of the stream.
+    max_memory bounds the simulation arrays (MB), see MemoryPlan, and dtype is their precision.
+    threads splits the synthesis, dedispersion and injection of each burst over blocks of channels.
+    """
+    model=Spectra(fch1=fch1,nchan=nchan,bwchan=bwchan,tsamp=tsamp,tbin=tbin,fbin=fbin,max_memory=max_memory,dtype=dtype,threads=threads)
+    sink=streamfilterbank(stream,model.header) if stream is not None else None
+    burst=model.burst if cache is None else partial(cache.burst, model)
+    testname=f"{label}_{mode}"
+    names=[sink.spec] if sink is not None else [cellname(testname,i,j)+".fil" for i in sigmarange for j in dmrange]
+    catalog=TruthCatalog(f"{testname}{tag}.truth.npy",dtype=truth_dtype(max(map(len,names))))
+    cells=None if cells is None else set(cells)
 
     with Progress(
         TextColumn("[bold blue]{task.description}"),
@@ -127,40 +189,146 @@ def snrbatch(fch1,bwchan,nchan,tsamp,mode,label,nsamp,npulse,sigmarange,dmrange,
 
         width_task = progress.add_task("Widths", total=len(sigmarange))
 
-        for i in sigmarange:
+        for iw,i in enumerate(sigmarange):
             dm_task = progress.add_task("  DMs", total=len(dmrange))
 
-            for j in dmrange:
+            for idm,j in enumerate(dmrange):
                 progress.update(dm_task, advance=1)
+                if cells is not None and (iw,idm) not in cells:
+                    continue
+                rows=manifest.completed((iw,idm)) if manifest is not None else None
+                if rows is None:
+                    if queue is not None and not queue.claim((iw,idm)):
+                        continue
+                    filename=cellname(testname,i,j)
+                    rows=injectcell(model,burst,filename,mode,i,j,cell_seed(seed,iw,idm),tstart,nsamp,npulse,
+                                    tsamp,ampl,snmode,pack,gap,progress,sink)
+                    if manifest is not None:
+                        with stage("manifest"):
+                            manifest.record((iw,idm),filename+".fil",rows)
+                    if queue is not None:
+                        queue.done((iw,idm))
+                with stage("truth"):
+                    for row in rows:
+                        catalog.add(**row)
 
-                model.create_filterbank(f"{testname}_dm{np.round(j,0)}_width{np.round(i,1)}",std=18,base=127)
-                xset=np.random.rand()-0.5
-
-                model.writenoise(nsamp=nsamp)
-                model.writenoise(nsamp=nsamp)
+            progress.update(width_task, advance=1)
 
-                base1,base2=model.burst(t0=tstart,dm=j,A=50,width=i,mode=mode,nsamp=nsamp,offset=xset)
+    if sink is not None:
+        sink.close()
+    with stage("truth"):
+        catalog.close()
+        export_text(catalog.filename,f"{testname}{tag}.txt")
+    console.print("\n[bold green]Finished[/]\n")
 
-                pulse_task = progress.add_task("    Pulses", total=npulse)
-                for _ in range(npulse):
-                    progress.update(pulse_task, advance=1)
-                    model.writenoise(nsamp=nsamp)
-                    model.inject(base1/model.write_snr()[1]*ampl)
-                    w.write(model.write_snr()[0][:-2]+";"
-                            +str(L2_snr(base2/model.write_snr()[1]*50))
-                            +f";{xset}\n")
-                    model.writenoise(nsamp=nsamp)
 
-                model.writenoise(nsamp=nsamp)
-                model.closefile()
+def cellname(testname,i,j):
+    """Filterbank name, without extension, of the (width i, DM j) cell."""
+    return f"{testname}_dm{np.round(j,0)}_width{np.round(i,1)}"
+
+
+def injectcell(model,burst,filename,mode,i,j,fseed,tstart,nsamp,npulse,tsamp,ampl,snmode,pack,gap,progress,sink=None):
+    """Write the filterbank of one (width i, DM j) cell, or append it to the streamfilterbank sink.
+    Returns
+    -------
+    list of truth catalog rows, one dict per pulse
+    """
+    np.random.seed(fseed)
+    model.create_filterbank(filename,std=18,base=127,stream=sink)
+
+    xset=np.random.rand()-0.5
+    model.writenoise(nsamp=nsamp)
+    model.writenoise(nsamp=nsamp)
+
+    base1,base2 = burst(
+        t0=tstart, dm=j, A=50, width=i,
+        mode=mode, nsamp=nsamp, offset=xset
+    )
+    quadsn=model.write_snr()[1]
+    flux=model.write_flux()
+    fwhm=m.sqrt(8.0*m.log(2.0))*i
+    scale=flux if snmode=='fluence' else quadsn
+    chunk=model.memory_plan(nsamp).rows
+
+    pulse_task = progress.add_task("    Pulses", total=npulse)
+    record=dict(file=filename+".fil" if sink is None else sink.spec,t0=tstart+xset,dm=j,width=i,fwhm=fwhm,offset=xset,
+                amplitude=ampl,quadsn=quadsn,flux=flux,seed=fseed)
+    peak=int(np.rint((tstart+xset)/tsamp))
+    rows=[]
+
+    if pack:
+        model.writenoise(nsamp=nsamp)
+        for k,block in injectpacked(model,base1/scale*ampl,npulse,nsamp,gap):
+            progress.update(pulse_task, advance=1)
+            with stage("measure"):
+                l2snr=L2_snr(base2/quadsn*50,chunk)
+            rows.append(dict(pulse=k,block=block,sample=block+peak,l2snr=l2snr,**record))
+        model.writenoise(nsamp=nsamp)
+        model.closefile()
+        return rows
+
+    for k in range(npulse):
+        progress.update(pulse_task, advance=1)
+        model.writenoise(nsamp=nsamp)
+        block=model.filterbank.nwritten
+        model.inject(base1/scale*ampl)
+        with stage("measure"):
+            l2snr=L2_snr(base2/quadsn*50,chunk)
+        rows.append(dict(pulse=k,block=block,sample=block+peak,l2snr=l2snr,**record))
+        model.writenoise(nsamp=nsamp)
+
+    model.writenoise(nsamp=nsamp)
+    model.closefile()
+    return rows
+
+
+def merge():
+    """Combine the truth catalogs of a sharded or queued campaign into one catalog and legacy text table."""
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
-            progress.update(width_task, advance=1)
+    parser = ArgumentParser(description='Merge simpulse truth catalogs of a campaign split across nodes, sorted by file and pulse.', formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o', '--output', required=True, type=str, help='Output name, writes <output>.truth.npy and <output>.txt')
+    parser.add_argument(dest='files', nargs='+', help='per-node .truth.npy catalogs')
+    values = parser.parse_args()
 
-    w.close()
-    console.print("\n[bold green]Finished[/]\n")
+    merged=merge_catalogs(values.files,f"{values.output}.truth.npy")
+    export_text(merged,f"{values.output}.txt")
+    console.print(f"[bold green]Merged[/] {len(merged)} pulses from {len(values.files)} catalogs")
+
+
+def injectpacked(model,burst,npulse,nsamp,gap=None):
+    """Inject npulse copies of a burst back to back, each cropped to the samples where it is nonzero.
+    Pulses go out in blocks of about nsamp samples, each with one noise draw and one broadcast add.
+    Parameters
+    ----------
+    model : Spectra
+        model with an open filterbank
+    burst : numpy array
+        (nsamp, nchan) scaled burst, as passed to Spectra.inject
+    gap : int
+        noise samples between consecutive bursts, defaults to the cropped burst length
+
+    Yields
+    ------
+    pulse number, absolute sample where the uncropped nsamp block of that pulse would start
+    """
+    rows=np.flatnonzero(np.any(burst!=0,axis=1))
+    lo,hi=(rows[0],rows[-1]+1) if rows.size else (0,1)
+    length=hi-lo
+    spacing=length+(length if gap is None else gap)
+    per=max(1,nsamp//spacing)
+    for first in range(0,npulse,per):
+        n=min(per,npulse-first)
+        with stage("pack"):
+            train=np.zeros((n,spacing,burst.shape[1]),dtype=model.dtype)
+            train[:,:length]=burst[lo:hi]
+        start=model.filterbank.nwritten
+        model.inject(train.reshape(n*spacing,-1),norm=nsamp)
+        for k in range(n):
+            yield first+k,start+k*spacing-lo
 
 
 ##########
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -34,6 +34,7 @@ try:
     import simpulse.sim.burst
     import simpulse.sim.noise
     import simpulse.sim.measurement
+    import simpulse.sim.truth
     print("PASS: simpulse.sim.* imports")
 except Exception as e:
     print("FAIL: simpulse.sim.* imports -->", e)
@@ -47,6 +48,27 @@ except Exception as e:
     print("FAIL: simpulse.io.fbio -->", e)
     raise
 
+try:
+    from simpulse.dataset import TrainingSet, make_batch
+    print("PASS: simpulse.dataset imports")
+except Exception as e:
+    print("FAIL: simpulse.dataset -->", e)
+    raise
+
+try:
+    from simpulse.realtime import RealtimeStream
+    print("PASS: simpulse.realtime imports")
+except Exception as e:
+    print("FAIL: simpulse.realtime -->", e)
+    raise
+
+try:
+    from simpulse.analysis import fdmt, boxcar_search, recover
+    print("PASS: simpulse.analysis imports")
+except Exception as e:
+    print("FAIL: simpulse.analysis -->", e)
+    raise
+
 
 print("\n=== FUNCTIONAL TEST ===")
 
@@ -93,5 +115,342 @@ except Exception as e:
     print("FAIL: closefile() -->", e)
     raise
 
+try:
+    import numpy as np
+    m32 = Spectra(nchan=64, dtype=np.float32)
+    orig32, dd32 = m32.burst(dm=100, width=1, A=10, nsamp=500)
+    assert orig32.dtype == dd32.dtype == np.float32, orig32.dtype
+    print("PASS: float32 burst()")
+except Exception as e:
+    print("FAIL: float32 burst() -->", e)
+    raise
+
+try:
+    mt = Spectra(nchan=64, threads=3)
+    origt, ddt = mt.burst(dm=100, width=1, A=10, nsamp=500)
+    orig1, dd1 = Spectra(nchan=64).burst(dm=100, width=1, A=10, nsamp=500)
+    assert np.array_equal(origt, orig1) and np.array_equal(ddt, dd1)
+    print("PASS: threaded burst() matches one thread")
+except Exception as e:
+    print("FAIL: threaded burst() -->", e)
+    raise
+
+try:
+    from simpulse.sim.truth import TruthCatalog, load_truth, truth_dtype
+    longname = "x" * 200 + ".fil"
+    with TruthCatalog("test_truth.npy", dtype=truth_dtype(len(longname))) as cat:
+        cat.add(file=longname, pulse=1)
+    assert load_truth("test_truth.npy")["file"][0] == longname
+    with TruthCatalog("test_truth.npy") as cat:
+        try:
+            cat.add(file=longname)
+            raise AssertionError("long file name was truncated")
+        except ValueError:
+            pass
+    print("PASS: truth catalog keeps long file names")
+except Exception as e:
+    print("FAIL: truth catalog file names -->", e)
+    raise
+
+
+print("\n=== TRAINING SET ===")
+
+import subprocess
+import sys
+
+### spawned workers re-import the main module, so the pool runs in its own interpreter
+TRAINING_SET_PROBE = """
+import os, signal
+import numpy as np
+from simpulse.dataset import TrainingSet, make_batch
+with TrainingSet(nchan=32, nsamp=64, batch_size=4, nworkers=2, seed=1) as ts:
+    it = ts.batches(1000)
+    assert all(np.array_equal(next(it)[0], make_batch(1, i, ts.config)[0]) for i in range(3))
+    os.kill(ts.workers[0].pid, signal.SIGKILL)
+    try:
+        for _ in it:
+            pass
+        raise AssertionError("no error after a worker was killed")
+    except RuntimeError as e:
+        assert "exit code -9" in str(e) and ts.shm is None, e
+"""
+
+try:
+    subprocess.run([sys.executable, "-c", TRAINING_SET_PROBE], capture_output=True, text=True, check=True, timeout=120)
+    print("PASS: TrainingSet raises when a worker is killed")
+except subprocess.CalledProcessError as e:
+    print("FAIL: TrainingSet worker kill -->", e.stderr.strip().splitlines()[-1])
+    raise
+except Exception as e:
+    print("FAIL: TrainingSet worker kill -->", e)
+    raise
+
+
+print("\n=== CROSSMATCH ===")
+
+import os
+import tempfile
+
+from simpulse.analysis import crossmatch
+
+try:
+    ai, bj = crossmatch.window_pairs([10.], [0.], [5., 10., 15., 14., 6.], [0., 0., 0., 10., 9.], 5, 10)
+    assert sorted(zip(ai.tolist(), bj.tolist())) == [(0, 1), (0, 4)], (ai, bj)
+    best = crossmatch.closest_match(np.array([0, 0, 1]), np.array([2, 1, 0]), [10., 5.], [11., 9., 5.], 3)
+    assert best.tolist() == [1, 0, -1], best
+    print("PASS: window_pairs edges and closest_match ties")
+except Exception as e:
+    print("FAIL: window_pairs / closest_match -->", e)
+    raise
+
+### (DM 100, S/N 10) has a truth matched at x = 0, an S/N tie and a false alarm,
+### (DM 100, S/N 20) a single-candidate file and (DM 500) no candidate file at all
+CAMPAIGN = {
+    "truth.txt": ["10 1000 1.0 2 0 100 0 0 1.0 0 0 0",
+                  "10 2000 2.0 3 0 100 0 0 1.0 0.5 0 0",
+                  "10 3000 3.0 4 0 100 0 0 1.0 0 0 0",
+                  "20 1000 1.0 5 0 100 0 0 1.0 0.25 0 0",
+                  "10 1000 1.0 2 0 500 0 0 2.0 0 0 0"],
+    "testset_0100_1.0_10.0_fixed.fil.cand.fof": ["11 1003 1.003 3 0 99 0 0 0 0 0 0",
+                                                 "9 1002 1.002 2 0 101 0 0 0 0 0 0",
+                                                 "12 2001 2.001 1 0 100 0 0 0 0 0 0",
+                                                 "20 5000 5.0 1 0 100 0 0 0 0 0 0"],
+    "testset_0100_1.0_20.0_fixed.fil.cand.fof": ["18 1001 1.001 4 0 100 0 0 0 0 0 0"],
+}
+### outputs of the original crossmatch script on CAMPAIGN with -x 9 -y 0
+EXPECTED = {
+    "histodata.txt": ["#### time error, s/n truth, s/n fredda, dm, dm_fredda, width_intrinsic, boxcar_fredda ",
+                      "3 10.000000 11.000000 100.000000 99.000000 1.000000 3",
+                      "2 10.000000 9.000000 100.000000 101.000000 1.000000 2",
+                      "1 10.000000 12.000000 100.000000 100.000000 1.000000 1",
+                      "1 20.000000 18.000000 100.000000 100.000000 5 4"],
+    "outlier.txt": ["fa {}testset_0100_1.0_10.0_fixed.fil.cand.fof 100.0 1.0 10.0 0.25 [0. 0. 0.] [11.  9. 20.]"],
+    "cells.csv": ["a,b,c,dm,width,sn,ntruth,ncand,ndetected,nmatched,pd,pfa",
+                  "100,10,1,100,1,10,3,4,2,3,0.6666666667,0.25",
+                  "100,20,1,100,1,20,1,1,1,1,1,0",
+                  "500,10,2,500,2,10,1,0,0,0,0,0"],
+}
+
+try:
+    with tempfile.TemporaryDirectory() as tmp:
+        prefix = os.path.join(tmp, "")
+        for name, lines in CAMPAIGN.items():
+            with open(prefix + name, "w") as f:
+                f.write("\n".join(lines) + "\n")
+        truth = crossmatch.load_truth(prefix + "truth.txt", use_cache=False)
+        results = crossmatch.crossmatch(truth, prefix + "testset_", x=9, y=0, nproc=1, use_cache=False)
+        crossmatch.write_tables(results, prefix)
+        crossmatch.write_summary(crossmatch.summarise(results, x=9), prefix)
+        for name, lines in EXPECTED.items():
+            with open(prefix + name) as f:
+                got = f.read().splitlines()
+            assert got == [line.format(prefix) for line in lines], "{} is {}".format(name, got)
+    print("PASS: crossmatch campaign matches the original script")
+except Exception as e:
+    print("FAIL: crossmatch campaign -->", e)
+    raise
+
+
+print("\n=== RECOVERY ===")
+
+from simpulse.analysis import recover, recover_file
+from simpulse.sim.burst import tidm
+
+def recovered(found, truth_dm, truth_sample, f_lo, f_hi):
+    """the boxcar covers the burst at the top of the band and the residual sweep fits inside it;
+    the intra-channel smear leaves the DM peak flat over several trials, so one trial is too tight"""
+    snr, dm, isamp, width = found
+    return isamp <= truth_sample < isamp + width and tidm(abs(dm - truth_dm), f_lo, f_hi) <= width
+
+try:
+    for fch1, bwchan, t0 in ((1100, -4, 200), (846, 4, 900)):
+        mr = Spectra(nchan=64, fch1=fch1, bwchan=bwchan)
+        disp, _ = mr.burst(t0=t0, dm=0.3, width=4, A=1, nsamp=1200)
+        top = np.flatnonzero(disp[:, np.argmax(mr.vif)])[0]
+        found = recover(disp + np.random.default_rng(0).standard_normal(disp.shape), mr.vif, mr.tsamp, dm_max=0.5)
+        assert recovered(found, 0.3, top, 844, 1102), "{} MHz band: {} for the burst at sample {}".format(bwchan, found, top)
+    print("PASS: recover() finds DM 0.3 in descending and ascending bands")
+except Exception as e:
+    print("FAIL: recover() -->", e)
+    raise
+
+try:
+    mr = Spectra(nchan=64, fch1=1100, bwchan=-4)
+    disp, _ = mr.burst(t0=200, dm=0.3, width=4, A=3, nsamp=1200)
+    top = 1000 + np.flatnonzero(disp[:, 0])[0]
+    np.random.seed(3)
+    with tempfile.TemporaryDirectory() as tmp:
+        mr.create_filterbank(os.path.join(tmp, "recover"), std=18, base=127)
+        mr.writenoise(nsamp=1000)
+        mr.inject(disp, norm=1)
+        mr.writenoise(nsamp=1000)
+        mr.closefile()
+        ### the burst starts 8 samples after a block boundary, and 8 before one with its sweep in the overlap;
+        ### 1050 leaves a last block of 50 samples, far shorter than the sweep
+        for blocksize in (top - 8, top + 8, 1050):
+            found = recover_file(os.path.join(tmp, "recover.fil"), 0.5, blocksize=blocksize, freqs=mr.vif)
+            assert recovered(found, 0.3, top, 844, 1102), "blocks of {}: {} for the burst at sample {}".format(blocksize, found, top)
+    print("PASS: recover_file() finds the burst across block boundaries")
+except Exception as e:
+    print("FAIL: recover_file() -->", e)
+    raise
+
+
+print("\n=== SIMPERIOD ===")
+
+def fil_parts(path):
+    """header with the tstart value blanked, and the data after HEADER_END"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    split = raw.index(b"HEADER_END") + len(b"HEADER_END")
+    header = bytearray(raw[:split])
+    at = header.index(b"tstart") + len(b"tstart")
+    header[at:at + 8] = bytes(8)
+    return bytes(header), raw[split:]
+
+try:
+    with tempfile.TemporaryDirectory() as tmp:
+        parts = []
+        ### one chunk at 4096 MB, a dozen at 2 MB
+        for budget in ("4096", "2"):
+            out = os.path.join(tmp, "budget" + budget)
+            subprocess.run([sys.executable, "-c", "from simpulse.simperiod_cli import main; main()",
+                            "-dm", "1", "-p", "0.1", "-w", "1", "-snr", "30", "-npulses", "50", "-nchan", "128",
+                            "-tsamp", "1", "--seed", "2", "--jitter", "0.1", "--amp-dist", "lognormal:0,0.3",
+                            "--max-memory", budget, "-o", out], capture_output=True, check=True)
+            parts.append(fil_parts(out + ".fil"))
+    assert parts[0][1] == parts[1][1], "data differs between memory budgets"
+    assert parts[0][0] == parts[1][0], "header differs beyond tstart"
+    print("PASS: simperiod output does not depend on --max-memory")
+except Exception as e:
+    print("FAIL: simperiod chunking -->", e)
+    raise
+
+
+print("\n=== CAMPAIGNS ===")
+
+import glob
+import json
+
+from simpulse.sim.truth import load_truth
+
+### five (width, DM) cells of two pulses each
+CAMPAIGN_ARGS = ["-o", "camp", "-s", "3000", "--nchan", "64", "--dm", "4", "--step", "1", "-N", "2", "--seed", "5"]
+
+def run_cli(cwd, entry, *args):
+    """run a simpulse_cli entry point in cwd"""
+    subprocess.run([sys.executable, "-c", "from simpulse.simpulse_cli import {0}; {0}()".format(entry)] + list(args),
+                   cwd=cwd, capture_output=True, check=True)
+
+def fil_files(cwd):
+    """modification time and data after HEADER_END of every filterbank in cwd"""
+    files = {}
+    for path in sorted(glob.glob(os.path.join(cwd, "*.fil"))):
+        with open(path, "rb") as f:
+            raw = f.read()
+        files[os.path.basename(path)] = (os.stat(path).st_mtime_ns, raw[raw.index(b"HEADER_END"):])
+    return files
+
+try:
+    with tempfile.TemporaryDirectory() as tmp:
+        run_cli(tmp, "main", *CAMPAIGN_ARGS)
+        first = fil_files(tmp)
+        truth = load_truth(os.path.join(tmp, "camp_single.truth.npy"), mmap=False)
+        manifest = os.path.join(tmp, "camp_single.manifest.jsonl")
+        with open(manifest) as f:
+            lines = f.readlines()
+        ### keep the campaign line and three cells, and lose the file of the first of them
+        with open(manifest, "w") as f:
+            f.writelines(lines[:4])
+        recorded = [json.loads(line)["file"] for line in lines[1:4]]
+        os.remove(os.path.join(tmp, recorded[0]))
+        run_cli(tmp, "main", "--resume", *CAMPAIGN_ARGS)
+        second = fil_files(tmp)
+        assert sorted(second) == sorted(first) and len(first) == 5, sorted(second)
+        for name, (mtime, data) in first.items():
+            assert second[name][1] == data, "{} differs after --resume".format(name)
+            assert (second[name][0] == mtime) == (name in recorded[1:]), "{} was {}".format(
+                name, "kept" if second[name][0] == mtime else "rewritten")
+        assert np.array_equal(load_truth(os.path.join(tmp, "camp_single.truth.npy"), mmap=False), truth)
+    print("PASS: --resume keeps recorded cells and regenerates the rest identically")
+except Exception as e:
+    print("FAIL: --resume -->", e)
+    raise
+
+try:
+    with tempfile.TemporaryDirectory() as single, tempfile.TemporaryDirectory() as split:
+        run_cli(single, "main", *CAMPAIGN_ARGS)
+        for shard in ("0/2", "1/2"):
+            run_cli(split, "main", "--shard", shard, *CAMPAIGN_ARGS)
+        run_cli(split, "merge", "-o", "merged", "camp_single.shard0of2.truth.npy", "camp_single.shard1of2.truth.npy")
+        whole = fil_files(single)
+        shards = fil_files(split)
+        assert sorted(shards) == sorted(whole), sorted(shards)
+        assert all(shards[name][1] == whole[name][1] for name in whole), "shard files differ"
+        ### the merged catalog is sorted by file and pulse, the single-node one is in grid order
+        truth = load_truth(os.path.join(single, "camp_single.truth.npy"), mmap=False)
+        truth = truth[np.lexsort((truth["pulse"], truth["file"]))]
+        assert np.array_equal(load_truth(os.path.join(split, "merged.truth.npy"), mmap=False), truth)
+    print("PASS: --shard 0/2 and 1/2 merge into the single-node campaign")
+except Exception as e:
+    print("FAIL: --shard / simpulse-merge -->", e)
+    raise
+
+
+print("\n=== KERNELS ===")
+
+import itertools
+
+from simpulse.sim import kernels, burst, measurement, noise, periodic
+
+rng = np.random.default_rng(0)
+tpl, half = periodic.pulse_templates(np.array([0.5, 1.0, 2.0]), 1.0)
+fs = rng.standard_normal(200)
+KERNEL_CASES = [
+    ("roll_channels", burst.roll_channels, (np.asfortranarray(rng.standard_normal((1000, 32))), rng.integers(-3000, 3000, 32))),
+    ("gaussian_rows", burst.gaussian_rows, (np.zeros((40, 2000), np.float32), np.arange(2000) * 0.5, rng.uniform(0, 1000, 40), 0.7, 20)),
+    ("scatter_pulses", periodic.scatter_pulses, (np.zeros((1000, 24)), np.sort(rng.uniform(-20, 1000, 100)), rng.uniform(0, 50, 24),
+                                                 tpl, half, 1.0, 3, rng.uniform(0, 3, 100), rng.integers(0, 3, 100))),
+    ("quantize", noise.quantize, (rng.normal(127, 80, (300, 40)).astype(np.float32),)),
+    ("triangle_max", measurement.triangle_max, (fs,)),
+    ("rolling_max", measurement.rolling_max, (fs,)),
+]
+
+if not kernels.numba_available():
+    print("SKIP: numba kernels, numba is not installed")
+else:
+    for (name, reference, args), build in itertools.product(KERNEL_CASES, ("parallel", "serial")):
+        try:
+            expected = np.asarray(reference(*[a.copy() if isinstance(a, np.ndarray) else a for a in args]), dtype=np.float64)
+            kernel = kernels.compiled(name, parallel=build == "parallel")
+            got = np.asarray(kernel(*[a.copy() if isinstance(a, np.ndarray) else a for a in args]), dtype=np.float64)
+            err = np.max(np.abs(got - expected)) / max(np.max(np.abs(expected)), 1e-300)
+            assert err <= kernels.TOLERANCE[name], "relative difference {:.2e}".format(err)
+            print("PASS: numba {} ({}) matches NumPy | {:.1e}".format(name, build, err))
+        except Exception as e:
+            print("FAIL: numba {} ({}) -->".format(name, build), e)
+            raise
+
+print("\n=== IMPORT TIME ===")
+
+### seconds a fresh interpreter may spend importing a command-line entry point
+IMPORT_BUDGET = 1.0
+HEAVY_MODULES = ("matplotlib", "astropy", "scipy", "numba")
+
+for module in ("simpulse", "simpulse.simpulse_cli", "simpulse.simperiod_cli",
+               "simpulse.realtime", "simpulse.analysis.crossmatch"):
+    probe = ("import json, sys, time; t = time.perf_counter(); import {}; "
+             "print(json.dumps([time.perf_counter() - t, [m for m in {!r} if m in sys.modules]]))"
+             ).format(module, HEAVY_MODULES)
+    try:
+        out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True)
+        seconds, heavy = json.loads(out.stdout)
+        assert not heavy, "pulls in " + ", ".join(heavy)
+        assert seconds < IMPORT_BUDGET, "{:.2f} s is over the {} s budget".format(seconds, IMPORT_BUDGET)
+        print("PASS: import {} | {:.3f} s".format(module, seconds))
+    except Exception as e:
+        print("FAIL: import time of {} -->".format(module), e)
+        raise
+
 
 print("\n=== ALL TESTS PASSED ===")